@@ -0,0 +1,128 @@
+"""
+Measures the bandwidth saved and CPU spent compressing the status
+WebSocket messages and HTTP JSON responses at several deflate levels
+
+WebSocket messages are compressed the way permessage-deflate does it, one
+deflate stream per connection flushed after every message, so later
+messages reuse the earlier ones as their dictionary.  HTTP responses are
+compressed one at a time like gzip does.  Times are scaled to the BBB's
+single 1 GHz Cortex-A8 core by a rough slowdown factor over the machine
+running the benchmark.
+
+Usage: python benchmarks/compression.py [hours] [slowdown]
+"""
+import json
+import os.path
+import random
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from smokematic.encoding import encode_binary
+
+NUM_FOOD_PROBES = 1
+
+# Same as smokematic/web.py and smokematic/broadcaster.py
+HISTORY_CHUNK_SIZE = 120
+UPDATE_INTERVAL = 5
+
+LEVELS = [1, 6, 9]
+
+# Rough factor the BBB is slower than a desktop core at zlib
+BBB_SLOWDOWN = 15
+
+REPEAT = 10
+
+def history_messages(minutes):
+    points = {}
+    for time_offset in range(minutes):
+        points[time_offset] = {
+            'pit_temp': random.uniform(200, 275),
+            'food_temp': [random.uniform(40, 203) for _ in range(NUM_FOOD_PROBES)],
+            'setpoint': 250.0,
+            'blower_speed': random.uniform(0, 100)}
+
+    messages = []
+    for chunk_start in range(0, minutes, HISTORY_CHUNK_SIZE):
+        messages.append({
+            'type': 'initial' if not chunk_start else 'history',
+            'session': 1792202045363,
+            'latest': minutes - 1,
+            'more': chunk_start + HISTORY_CHUNK_SIZE < minutes,
+            'data': dict(
+                (time_offset, points[time_offset])
+                for time_offset in range(chunk_start, min(minutes, chunk_start + HISTORY_CHUNK_SIZE)))})
+
+    return messages
+
+def update_messages(count):
+    return [
+        {
+            'type': 'update',
+            'data': {
+                'time': 1792202045.25 + UPDATE_INTERVAL * index,
+                'pit_temp': random.uniform(200, 275),
+                'food_temp': [random.uniform(40, 203) for _ in range(NUM_FOOD_PROBES)],
+                'setpoint': 250,
+                'food_alarms': [None] * NUM_FOOD_PROBES,
+                'blower_speed': random.randint(0, 100),
+                'lid': 'closed'}}
+        for index in range(count)]
+
+def deflate_stream(payloads, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return [compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH) for payload in payloads]
+
+def gzip_each(payloads, level):
+    return [zlib.compress(payload, level) for payload in payloads]
+
+def measure(name, payloads, compress, level, slowdown):
+    size = sum(len(payload) for payload in payloads)
+    compressed = sum(len(payload) for payload in compress(payloads, level))
+    elapsed = min(timeit.repeat(
+        lambda: compress(payloads, level),
+        number=1,
+        repeat=REPEAT)) * slowdown
+
+    print('{:<16} {:>5} {:>10d} {:>10d} {:>7.1f}x {:>10.1f} {:>10.2f}'.format(
+        name,
+        level,
+        size,
+        compressed,
+        float(size) / compressed,
+        elapsed / len(payloads) * 1e6,
+        elapsed * 1e3))
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    slowdown = float(sys.argv[2]) if len(sys.argv) > 2 else BBB_SLOWDOWN
+    minutes = int(hours * 60)
+
+    history = history_messages(minutes)
+    updates = update_messages(100)
+    profile = [json.dumps(dict(
+        (time_offset, random.uniform(200, 275))
+        for time_offset in range(0, minutes, 5))).encode('utf-8')]
+
+    cases = [
+        ('history json', [json.dumps(message).encode('utf-8') for message in history], deflate_stream),
+        ('history binary', [encode_binary(message) for message in history], deflate_stream),
+        ('update json', [json.dumps(message).encode('utf-8') for message in updates], deflate_stream),
+        ('update binary', [encode_binary(message) for message in updates], deflate_stream),
+        ('profile gzip', profile, gzip_each)]
+
+    print('{} hour history, {} food probe(s), {} updates, BBB times at {:.0f}x slower'.format(
+        hours,
+        NUM_FOOD_PROBES,
+        len(updates),
+        slowdown))
+    print('{:<16} {:>5} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        '', 'Level', 'Raw bytes', 'Deflated', 'Ratio', 'BBB us/msg', 'BBB ms'))
+    for name, payloads, compress in cases:
+        for level in LEVELS:
+            measure(name, payloads, compress, level, slowdown)
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares the memory use and append cost of the original dictionary of
+StatPoints against the StatHistory ring buffer for a long cook
+
+Usage: python benchmarks/history.py [hours]
+"""
+import os.path
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'smokematic'))
+
+from history import StatHistory, StatPoint
+
+NUM_FOOD_PROBES = 1
+
+def random_point():
+    return StatPoint(
+        random.uniform(200, 275),
+        250.0,
+        random.randint(0, 100),
+        [random.uniform(40, 203) for _ in range(NUM_FOOD_PROBES)])
+
+def dict_append(history, point):
+    if history:
+        new_time = max(history.keys()) + 1
+    else:
+        new_time = 0
+
+    history[new_time] = StatPoint(
+        point.pit_temp,
+        point.setpoint,
+        point.blower_speed,
+        list(point.food_temps))
+
+def measure(name, make_history, append, minutes):
+    points = [random_point() for _ in range(minutes)]
+
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    history = make_history()
+    start_time = timeit.default_timer()
+    for point in points[:-100]:
+        append(history, point)
+    end_time = timeit.default_timer()
+    memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+
+    # Cost of an append once the whole session is recorded
+    late_start = timeit.default_timer()
+    for point in points[-100:]:
+        append(history, point)
+    late_time = (timeit.default_timer() - late_start) / 100
+
+    print('{:<12} {:>10.1f} KiB {:>8.2f} us/append {:>8.2f} us/append at end'.format(
+        name,
+        memory / 1024.0,
+        (end_time - start_time) / (minutes - 100) * 1e6,
+        late_time * 1e6))
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 48
+    minutes = int(hours * 60)
+
+    print('{} hour session, {} stat points, {} food probe(s)'.format(
+        hours,
+        minutes,
+        NUM_FOOD_PROBES))
+
+    measure('dict', dict, dict_append, minutes)
+
+    # Sized to hold exactly the session so the memory is comparable
+    point_size = 8 * (3 + NUM_FOOD_PROBES)
+    measure(
+        'StatHistory',
+        lambda: StatHistory(NUM_FOOD_PROBES, point_size * minutes),
+        lambda history, point: history.append(point),
+        minutes)
+
+if '__main__' == __name__:
+    main()
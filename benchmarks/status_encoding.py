@@ -0,0 +1,99 @@
+"""
+Compares the size and serialization cost of the JSON and binary encodings
+of the status WebSocket messages for a long cook
+
+Usage: python benchmarks/status_encoding.py [hours]
+"""
+import json
+import os.path
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from smokematic.encoding import decode_binary, encode_binary
+
+NUM_FOOD_PROBES = 1
+
+# Same as smokematic/web.py
+HISTORY_CHUNK_SIZE = 120
+
+REPEAT = 20
+
+def history_messages(minutes):
+    points = {}
+    for time_offset in range(minutes):
+        points[time_offset] = {
+            'pit_temp': random.uniform(200, 275),
+            'food_temp': [random.uniform(40, 203) for _ in range(NUM_FOOD_PROBES)],
+            'setpoint': 250.0,
+            'blower_speed': random.uniform(0, 100)}
+
+    messages = []
+    for chunk_start in range(0, minutes, HISTORY_CHUNK_SIZE):
+        messages.append({
+            'type': 'initial' if not chunk_start else 'history',
+            'session': 1792202045363,
+            'latest': minutes - 1,
+            'more': chunk_start + HISTORY_CHUNK_SIZE < minutes,
+            'data': dict(
+                (time_offset, points[time_offset])
+                for time_offset in range(chunk_start, min(minutes, chunk_start + HISTORY_CHUNK_SIZE)))})
+
+    return messages
+
+def update_message():
+    return {
+        'type': 'update',
+        'data': {
+            'time': 1792202045.25,
+            'pit_temp': random.uniform(200, 275),
+            'food_temp': [random.uniform(40, 203) for _ in range(NUM_FOOD_PROBES)],
+            'setpoint': 250,
+            'food_alarms': [None] * NUM_FOOD_PROBES,
+            'blower_speed': random.randint(0, 100),
+            'lid': 'closed'}}
+
+def measure(name, messages, encode):
+    size = sum(len(encode(message)) for message in messages)
+    elapsed = min(timeit.repeat(
+        lambda: [encode(message) for message in messages],
+        number=1,
+        repeat=REPEAT))
+
+    print('{:<16} {:>10d} bytes {:>10.1f} us'.format(
+        name,
+        size,
+        elapsed * 1e6))
+
+    return size, elapsed
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    minutes = int(hours * 60)
+
+    history = history_messages(minutes)
+    update = [update_message()]
+
+    # The client only sees float32 precision
+    for message in history + update:
+        decoded = decode_binary(encode_binary(message))
+        assert sorted(decoded['data']) == sorted(message['data'])
+
+    print('{} hour history, {} stat points in {} messages, {} food probe(s)'.format(
+        hours,
+        minutes,
+        len(history),
+        NUM_FOOD_PROBES))
+
+    for label, messages in (('history', history), ('update', update)):
+        json_size, json_time = measure('{} json'.format(label), messages, json.dumps)
+        binary_size, binary_time = measure('{} binary'.format(label), messages, encode_binary)
+        print('{:<16} {:>10.1f}x      {:>10.1f}x'.format(
+            '',
+            float(json_size) / binary_size,
+            json_time / binary_time))
+
+if '__main__' == __name__:
+    main()
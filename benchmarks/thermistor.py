@@ -0,0 +1,59 @@
+"""
+Compares the exact Steinhart-Hart conversion against the lookup table at
+several resolutions using the probe coefficients from the skeleton config
+
+Usage: python benchmarks/thermistor.py
+"""
+import json
+import os.path
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'smokematic'))
+
+import thermistor
+
+NUM_VALUES = 100000
+RESOLUTIONS = [256, 1024, 4096, 16384]
+
+def main():
+    config_path = os.path.join(
+        os.path.dirname(__file__), '..', 'smokematic', 'skel', 'config.json')
+    with open(config_path) as f:
+        config = json.load(f)
+
+    probes = [('pit', config['pit_probe'])]
+    probes.extend(
+        ('food{}'.format(i), probe) for i, probe in enumerate(config['food_probes']))
+
+    # Reads of a 12-bit ADC, excluding the rails
+    values = [random.randint(1, 4094) / 4095.0 for _ in range(NUM_VALUES)]
+
+    for name, probe in probes:
+        coefficients = (probe['sh_a'], probe['sh_b'], probe['sh_c'])
+
+        exact_time = min(timeit.repeat(
+            lambda: thermistor.convert(values, *coefficients),
+            number=1,
+            repeat=7))
+        print('{} exact: {:.3f} us/read'.format(name, exact_time / NUM_VALUES * 1e6))
+
+        for resolution in RESOLUTIONS:
+            build_start = timeit.default_timer()
+            table = thermistor.LookupTable(*(coefficients + (resolution,)))
+            build_time = timeit.default_timer() - build_start
+
+            table_time = min(timeit.repeat(
+                lambda: table.convert(values),
+                number=1,
+                repeat=7))
+            print('{} table {:>5}: {:.3f} us/read, {:.1f} ms to build, max error {:.6f} F'.format(
+                name,
+                resolution,
+                table_time / NUM_VALUES * 1e6,
+                build_time * 1e3,
+                table.get_max_error()))
+
+if '__main__' == __name__:
+    main()
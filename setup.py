@@ -14,13 +14,19 @@ setup(
     packages=['smokematic'],
     entry_points={
         'console_scripts': [
-            'smokematic=smokematic:entry'
+            'smokematic=smokematic:entry',
+            'smokematic-simulate=smokematic.simulator:entry',
+            'smokematic-sweep=smokematic.sweep:entry [sweep]'
         ]
     },
     install_requires=[
         'tornado',
-        'Adafruit_BBIO'
+        'Adafruit_BBIO',
+        'futures; python_version < "3.0"'
     ],
+    extras_require={
+        'sweep': ['numpy']
+    },
     include_package_data=True,
     classifiers= [
         'License :: OSI Approved :: BSD License',
@@ -0,0 +1,261 @@
+import math
+
+# Degrees the pit must pass the setpoint by before the relay switches
+HYSTERESIS = 3
+
+# Number of oscillations measured, after the first one is discarded
+CYCLES = 4
+
+# Seconds after which the experiment fails
+MAX_TIME = 4 * 60 * 60
+
+# Ratios of the proportional gain to the ultimate gain and of the integral
+# and derivative times to the ultimate period
+RULES = {
+    'classic': (0.6, 0.5, 0.125),
+    'some_overshoot': (1.0 / 3, 0.5, 1.0 / 3),
+    'no_overshoot': (0.2, 0.5, 1.0 / 3)
+}
+
+class RelayAutoTune(object):
+    """
+    Astrom-Hagglund relay feedback experiment that finds PID coefficients
+
+    The blower is switched between two speeds whenever the pit passes the
+    setpoint by more than the hysteresis, which makes the pit oscillate at
+    its ultimate period.  The ultimate gain follows from the oscillation
+    amplitude, and the coefficients from one of the :const:`RULES`.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(
+            self,
+            blower,
+            probe_bank,
+            setpoint,
+            hysteresis=HYSTERESIS,
+            cycles=CYCLES,
+            rule='some_overshoot',
+            output_low=0,
+            output_high=100,
+            max_time=MAX_TIME):
+        """
+        Initializes the experiment without starting it
+
+        :param blower: The blower to switch
+        :type blower: Blower
+        :param probe_bank: The ProbeBank with the pit probe
+        :type probe_bank: ProbeBank
+        :param setpoint: The temperature to oscillate around
+        :type setpoint: float
+        :param hysteresis: The degrees the pit must pass the setpoint by
+        :type hysteresis: float
+        :param cycles: The number of oscillations to measure
+        :type cycles: int
+        :param rule: The name of the tuning rule
+        :type rule: str
+        :param output_low: The low blower speed
+        :type output_low: int
+        :param output_high: The high blower speed
+        :type output_high: int
+        :param max_time: The seconds after which the experiment fails
+        :type max_time: float
+        :raises: ValueError
+        """
+        if hysteresis < 0:
+            raise ValueError('Auto-tune hysteresis must be >= 0')
+
+        if cycles < 1:
+            raise ValueError('Auto-tune must measure at least 1 cycle')
+
+        if rule not in RULES:
+            raise ValueError('Auto-tune rule must be one of {}'.format(
+                ', '.join(sorted(RULES))))
+
+        if not 0 <= output_low < output_high <= 100:
+            raise ValueError('Auto-tune blower speeds must be 0-100 with low below high')
+
+        self._blower = blower
+        self._probe_bank = probe_bank
+        self._setpoint = setpoint
+        self._hysteresis = hysteresis
+        self._cycles = cycles
+        self._rule = rule
+        self._output_low = output_low
+        self._output_high = output_high
+        self._max_time = max_time
+
+        self._state = None
+        self._message = None
+        self._callback = None
+        self._start_time = None
+        self._last_time = None
+        self._high = None
+        self._extreme = None
+
+        self._switch_times = []
+        self._peaks = []
+        self._troughs = []
+        self._result = None
+
+    def start(self, callback):
+        """
+        Starts the experiment on the next probe reading
+
+        :param callback: Called with the experiment once it finishes, fails,
+            or is cancelled
+        :type callback: callable
+        """
+        self._callback = callback
+        self._state = RelayAutoTune.RUNNING
+        self._probe_bank.subscribe(self._on_reading)
+
+    def cancel(self):
+        """
+        Stops a running experiment
+        """
+        if RelayAutoTune.RUNNING == self._state:
+            self._finish(RelayAutoTune.CANCELLED, 'Cancelled')
+
+    def get_state(self):
+        """
+        Returns the state of the experiment
+
+        :returns: The state or None if it was not started
+        :rtype: str
+        """
+        return self._state
+
+    def get_result(self):
+        """
+        Returns the tuned coefficients and the measurements they came from
+
+        :returns: Dictionary containing the coefficients, ultimate gain and
+            period in seconds, and amplitude in degrees, or None if the
+            experiment is not done
+        :rtype: dict
+        """
+        return self._result
+
+    def get_status(self):
+        """
+        Returns the progress of the experiment
+
+        :returns: Dictionary containing the state, the setpoint, the number of
+            measured cycles, the elapsed seconds, a message if it failed, and
+            the result if it is done
+        :rtype: dict
+        """
+        elapsed = 0
+        if self._start_time is not None:
+            elapsed = self._last_time - self._start_time
+
+        return {
+            'state': self._state,
+            'setpoint': self._setpoint,
+            'rule': self._rule,
+            'cycles': max(0, len(self._switch_times) - 2),
+            'target_cycles': self._cycles,
+            'elapsed': elapsed,
+            'message': self._message,
+            'result': self._result}
+
+    def _on_reading(self, reading):
+        """
+        Switches the relay and records the oscillation
+
+        :param reading: The new probe reading
+        :type reading: Reading
+        """
+        temp = reading.pit_temp
+
+        if self._start_time is None:
+            self._start_time = reading.time
+            self._switch(temp < self._setpoint, reading.time)
+        self._last_time = reading.time
+
+        if reading.time - self._start_time > self._max_time:
+            self._finish(RelayAutoTune.FAILED, 'The pit did not oscillate in time')
+            return
+
+        if self._high:
+            self._extreme = min(self._extreme, temp)
+            if temp > self._setpoint + self._hysteresis:
+                self._troughs.append(self._extreme)
+                self._switch(False, reading.time)
+        else:
+            self._extreme = max(self._extreme, temp)
+            if temp < self._setpoint - self._hysteresis:
+                self._peaks.append(self._extreme)
+                self._switch(True, reading.time)
+
+                # The first oscillation starts from wherever the pit was so
+                # one more is needed than is measured
+                if len(self._switch_times) >= self._cycles + 2:
+                    self._calculate()
+
+    def _switch(self, high, timestamp):
+        """
+        Switches the relay
+
+        :param high: Whether to switch the blower to the high speed
+        :type high: bool
+        :param timestamp: The time of the switch
+        :type timestamp: float
+        """
+        self._high = high
+        self._extreme = self._setpoint
+
+        if high:
+            self._switch_times.append(timestamp)
+            self._blower.set_speed(self._output_high)
+        else:
+            self._blower.set_speed(self._output_low)
+
+    def _calculate(self):
+        """
+        Calculates the coefficients from the measured oscillations
+        """
+        switch_times = self._switch_times[-(self._cycles + 1):]
+        period = (switch_times[-1] - switch_times[0]) / float(self._cycles)
+        peaks = self._peaks[-self._cycles:]
+        troughs = self._troughs[-self._cycles:]
+        amplitude = (sum(peaks) - sum(troughs)) / (2.0 * self._cycles)
+
+        if amplitude <= 0 or period <= 0:
+            self._finish(RelayAutoTune.FAILED, 'The pit oscillation could not be measured')
+            return
+
+        relay_amplitude = (self._output_high - self._output_low) / 2.0
+        ultimate_gain = 4 * relay_amplitude / (math.pi * amplitude)
+
+        gain_ratio, integral_ratio, derivative_ratio = RULES[self._rule]
+        k_p = gain_ratio * ultimate_gain
+        k_i = k_p / (integral_ratio * period)
+        k_d = k_p * derivative_ratio * period
+
+        self._result = {
+            'coefficients': {'p': k_p, 'i': k_i, 'd': k_d},
+            'ultimate_gain': ultimate_gain,
+            'ultimate_period': period,
+            'amplitude': amplitude}
+        self._finish(RelayAutoTune.DONE, None)
+
+    def _finish(self, state, message):
+        """
+        Ends the experiment
+
+        :param state: The final state
+        :type state: str
+        :param message: The reason the experiment ended early or None
+        :type message: str
+        """
+        self._probe_bank.unsubscribe(self._on_reading)
+        self._state = state
+        self._message = message
+
+        if self._callback:
+            self._callback(self)
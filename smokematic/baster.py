@@ -1,27 +1,30 @@
-import datetime
-
-import Adafruit_BBIO.GPIO as GPIO
-import tornado.gen
+from smokematic.scheduler import Scheduler
 
 class Baster(object):
     """
     Controller for the baster
     """
-    def __init__(self, baster_pin):
+    def __init__(self, baster_pin, hwio, gpio):
         """
         Initializes the controller for a baster and sets it closed
 
         :param baster_pin: The BBB GPIO to use, e.g. P8_14
         :type baster_pin: str
+        :param hwio: The hardware I/O queue that performs all GPIO writes
+        :type hwio: HardwareIO
+        :param gpio: The GPIO module of the hardware backend
+        :type gpio: Adafruit_BBIO.GPIO
         """
         self._baster_pin = baster_pin
+        self._hwio = hwio
+        self._gpio = gpio
         self._baste_off_handle = None
         self._baste_periodic_handle = None
         self._duration = 0
         self._frequency = 0
 
-        GPIO.setup(self._baster_pin, GPIO.OUT)
-        GPIO.output(self._baster_pin, GPIO.LOW)
+        hwio.submit('gpio_setup', gpio.setup, (self._baster_pin, gpio.OUT))
+        self._write_output(gpio.LOW)
 
     def config(self, frequency, duration):
         """
@@ -48,18 +51,17 @@ class Baster(object):
             self._baste_periodic_handle = None
 
         if self._baste_off_handle:
-            tornado.ioloop.IOLoop.instance().remove_timeout(
-                self._baste_off_handle
-            )
+            Scheduler.instance().cancel(self._baste_off_handle)
             self._baste_off_handle = None
 
         self._baste_off()
 
         if frequency > 0:
 
-            self._baste_periodic_handle = tornado.ioloop.PeriodicCallback(
+            self._baste_periodic_handle = Scheduler.instance().periodic(
                 self._baste,
-                frequency * 60 * 1000)
+                frequency * 60,
+                'baste')
             self._baste_periodic_handle.start()
             self._baste()
 
@@ -76,20 +78,34 @@ class Baster(object):
         """
         Bastes for the defined duration set in config
         """
-        ioloop = tornado.ioloop.IOLoop.instance()
+        scheduler = Scheduler.instance()
 
         if self._baste_off_handle:
-            ioloop.remove_timeout(self._baste_off_handle)
+            scheduler.cancel(self._baste_off_handle)
             self._baste_off_handle = None
 
-        GPIO.output(self._baster_pin, GPIO.HIGH)
-        self._baste_off_handle = ioloop.add_timeout(
-            datetime.timedelta(seconds=self._duration),
+        self._write_output(self._gpio.HIGH)
+        self._baste_off_handle = scheduler.call_later(
+            self._duration,
             self._baste_off)
 
     def _baste_off(self):
         """
         Turns off the basting
         """
-        GPIO.output(self._baster_pin, GPIO.LOW)
+        self._write_output(self._gpio.LOW)
+
+    def _write_output(self, value):
+        """
+        Queues a write of the GPIO output, replacing any earlier write that
+        has not happened yet
+
+        :param value: The output value, HIGH or LOW
+        :type value: int
+        """
+        self._hwio.submit(
+            'gpio_output',
+            self._gpio.output,
+            (self._baster_pin, value),
+            key='gpio:{}'.format(self._baster_pin))
 
@@ -1,30 +1,63 @@
-import datetime
-import functools
+import threading
 
-import Adafruit_BBIO.PWM as PWM
-import tornado.gen
+from smokematic import metrics
+from smokematic.scheduler import Scheduler
 
 PWM_FREQUENCY = 18000
 LOW_SPEED = 15
 
+# Seconds the blower runs for each pulse in "low speed" mode; this should be
+# 1 second but the spin-up takes half a second
+LOW_SPEED_PULSE = 2
+
+SPEED = metrics.gauge(
+    'smokematic_blower_speed',
+    'Blower speed from 0-100',
+    ('pin',))
+
+SPEED_CHANGES = metrics.counter(
+    'smokematic_blower_speed_changes_total',
+    'Blower speed changes',
+    ('pin',))
+
+DUTY_CYCLE_WRITES = metrics.counter(
+    'smokematic_blower_duty_cycle_writes_total',
+    'Blower PWM duty cycle writes queued',
+    ('pin',))
+
 class Blower(object):
     """
     Controller for a blower
     """
-    def __init__(self, blower_pin):
+    def __init__(self, blower_pin, hwio, pwm):
         """
         Initializes the controller for a blower and sets the blower speed to 0
 
         :param blower_pin: The BBB PWM to use, e.g. P9_14
         :type blower_pin: str
+        :param hwio: The hardware I/O queue that performs all PWM writes
+        :type hwio: HardwareIO
+        :param pwm: The PWM module of the hardware backend
+        :type pwm: Adafruit_BBIO.PWM
         """
         self._blower_pin = blower_pin
+        self._hwio = hwio
+        self._pwm = pwm
         self._speed = 0
-        self._low_speed_handle = None
+        self._speed_gauge = SPEED.labels(blower_pin)
+        self._speed_changes = SPEED_CHANGES.labels(blower_pin)
+        self._duty_cycle_writes = DUTY_CYCLE_WRITES.labels(blower_pin)
+        self._low_speed_task = None
+        self._timeout_handle = None
+        self._held = False
+
+        # Serializes the duty cycle writes of the hardware I/O thread and the
+        # watchdog's fail-safe writes
+        self._pwm_lock = threading.Lock()
 
-        PWM.start(blower_pin, 0)
-        PWM.stop(blower_pin)
-        PWM.cleanup()
+        hwio.submit('pwm_start', pwm.start, (blower_pin, 0))
+        hwio.submit('pwm_stop', pwm.stop, (blower_pin,))
+        hwio.submit('pwm_cleanup', pwm.cleanup)
 
     def get_speed(self):
         """
@@ -46,33 +79,97 @@ class Blower(object):
         :type speed: int
         :raises: ValueError
         """
-        ioloop = tornado.ioloop.IOLoop.instance()
+        scheduler = Scheduler.instance()
 
         if speed < 0 or speed > 100:
             raise ValueError('Fan speed must be between 0-100')
 
-        if self._low_speed_handle:
-            ioloop.remove_timeout(self._low_speed_handle)
-            self._low_speed_handle = None
+        # The watchdog holds the blower off until the control loop recovers
+        if self._held:
+            return self._speed
+
+        # Restarting the low speed cycle or the spin-up for an unchanged
+        # speed would only make the blower chatter
+        if speed == self._speed:
+            return self._speed
+
+        if self._low_speed_task:
+            self._low_speed_task.stop()
+            self._low_speed_task = None
+
+        if self._timeout_handle:
+            scheduler.cancel(self._timeout_handle)
+            self._timeout_handle = None
 
         if self._speed < LOW_SPEED and speed > 0:
             # Want to give the fan a full kick to start spinning
-            PWM.start(self._blower_pin, 100, PWM_FREQUENCY, 0)
+            self._write_duty_cycle(100)
 
             # Only want full speed for 1 second so add a timeout to then set
             # the real speed
-            partial_real_speed = functools.partial(
-                self._set_speed,
-                speed)
-            ioloop.add_timeout(
-                datetime.timedelta(seconds=1),
-                partial_real_speed)
+            self._timeout_handle = scheduler.call_later(1, self._set_speed, speed)
         else:
             self._set_speed(speed)
 
         self._speed = speed
+        self._speed_gauge.set(speed)
+        self._speed_changes.inc()
         return self._speed
 
+    def stop(self):
+        """
+        Turns the blower off immediately, including any spin-up or "low
+        speed" pulse in progress
+        """
+        self.set_speed(0)
+        self._write_duty_cycle(0)
+
+    def hold_off(self):
+        """
+        Turns the blower off and ignores speed changes until :meth:`release`
+        is called
+        """
+        self.stop()
+        self._held = True
+
+    def release(self):
+        """
+        Accepts speed changes again after :meth:`hold_off`
+        """
+        self._held = False
+
+    def is_held(self):
+        """
+        Returns whether the blower is held off
+
+        :returns: Whether the blower is held off
+        :rtype: bool
+        """
+        return self._held
+
+    def write_failsafe(self):
+        """
+        Turns the blower off by writing straight to the PWM, bypassing the
+        IOLoop and the hardware I/O queue
+
+        Safe to call from any thread.  The write is skipped rather than
+        waited for while the hardware I/O thread is writing the PWM, as that
+        write may be what is stuck.  The blower keeps its speed so
+        :meth:`hold_off` must also be called on the IOLoop.
+
+        :returns: Whether the duty cycle was written
+        :rtype: bool
+        """
+        if not self._pwm_lock.acquire(False):
+            return False
+
+        try:
+            self._pwm.start(self._blower_pin, 0, PWM_FREQUENCY, 0)
+        finally:
+            self._pwm_lock.release()
+
+        return True
+
     def _set_speed(self, speed):
         """
         Sets the speed of the fan without the high-powered spin up
@@ -80,39 +177,66 @@ class Blower(object):
         :param speed: The new desired speed from 0-100
         :type speed: int
         """
+        self._timeout_handle = None
+
         if speed > LOW_SPEED:
-            PWM.start(self._blower_pin, speed, PWM_FREQUENCY, 0)
+            self._write_duty_cycle(speed)
         elif speed > 0:
             self._set_low_speed(speed)
         else:
-            PWM.start(self._blower_pin, 0, PWM_FREQUENCY, 0)
+            self._write_duty_cycle(0)
 
-    def _set_low_speed(self, speed, enable_fan=True):
+    def _set_low_speed(self, speed):
         """
-        Sets the speed of the fan in "low speed" mode
+        Sets the speed of the fan in "low speed" mode, pulsing it at full
+        power for :const:`LOW_SPEED_PULSE` seconds of every ``100 / speed + 1``
+        seconds
 
         :param speed: The new desired speed from 0-:const:`LOW_SPEED`
         :type speed: int
-        :param enable_fan: Whether to enable or disable the fan
-        :type enable_fan: bool
         """
-        ioloop = tornado.ioloop.IOLoop.instance()
         period = float(100) / speed
 
-        if enable_fan:
-            # This should be 1 second but the spin-up takes half a second
-            timeout_len = 2
-        else:
-            timeout_len = period-1
+        self._low_speed_task = Scheduler.instance().periodic(
+            self._low_speed_pulse,
+            period + 1,
+            'blower_low_speed')
+        self._low_speed_task.start(0)
 
-        PWM.start(self._blower_pin, 100 if enable_fan else 0, PWM_FREQUENCY, 0)
+    def _low_speed_pulse(self):
+        """
+        Runs the fan at full power for a single "low speed" pulse
+        """
+        if self._held:
+            return
 
-        toggle_partial = functools.partial(
-            self._set_low_speed,
-            speed,
-            not enable_fan)
+        self._write_duty_cycle(100)
+        self._timeout_handle = Scheduler.instance().call_later(
+            LOW_SPEED_PULSE,
+            self._write_duty_cycle,
+            0)
 
-        self._low_speed_handle = ioloop.add_timeout(
-            datetime.timedelta(seconds=timeout_len),
-            toggle_partial)
+    def _write_duty_cycle(self, duty_cycle):
+        """
+        Queues a write of the PWM duty cycle, replacing any earlier write
+        that has not happened yet
 
+        :param duty_cycle: The duty cycle from 0-100
+        :type duty_cycle: float
+        """
+        self._duty_cycle_writes.inc()
+        self._hwio.submit(
+            'pwm_start',
+            self._start_pwm,
+            (duty_cycle,),
+            key='pwm:{}'.format(self._blower_pin))
+
+    def _start_pwm(self, duty_cycle):
+        """
+        Writes the PWM duty cycle on the hardware I/O thread
+
+        :param duty_cycle: The duty cycle from 0-100
+        :type duty_cycle: float
+        """
+        with self._pwm_lock:
+            self._pwm.start(self._blower_pin, duty_cycle, PWM_FREQUENCY, 0)
@@ -0,0 +1,427 @@
+import collections
+import json
+import logging
+import time
+
+import tornado.ioloop
+import tornado.websocket
+
+from smokematic import metrics
+from smokematic.encoding import encode_binary
+from smokematic.metrics import Family
+from smokematic.scheduler import Scheduler
+
+UPDATE_INTERVAL = 5
+
+# Maximum number of messages waiting to be written to a status client
+MAX_QUEUED_MESSAGES = 16
+
+# Seconds a status client may take to accept a message before it is dropped
+STALL_TIMEOUT = 60
+
+ENCODE_SECONDS = metrics.histogram(
+    'smokematic_websocket_encode_seconds',
+    'Time spent serializing WebSocket messages',
+    ('type', 'encoding'))
+
+MESSAGE_BYTES = metrics.histogram(
+    'smokematic_websocket_message_bytes',
+    'Size of serialized WebSocket messages',
+    ('type', 'encoding'),
+    metrics.SIZE_BUCKETS)
+
+COALESCED_UPDATES = metrics.counter(
+    'smokematic_websocket_coalesced_updates_total',
+    'Queued status updates replaced by a newer one before being sent')
+
+DROPPED_CLIENTS = metrics.counter(
+    'smokematic_websocket_dropped_clients_total',
+    'Status clients disconnected for falling behind',
+    ('reason',))
+
+def encode_message(message, encoding='json'):
+    """
+    Serializes a WebSocket message, recording the time taken and its size by
+    message type and encoding
+
+    :param message: The message with a ``type`` key
+    :type message: dict
+    :param encoding: The encoding from :const:`smokematic.encoding.ENCODINGS`
+    :type encoding: str
+    :returns: The serialized message, bytes for the binary encoding
+    :rtype: str
+    """
+    start_time = time.time()
+    if 'binary' == encoding:
+        encoded = encode_binary(message)
+    else:
+        encoded = json.dumps(message)
+    ENCODE_SECONDS.labels(message['type'], encoding).observe(time.time() - start_time)
+    MESSAGE_BYTES.labels(message['type'], encoding).observe(len(encoded))
+
+    return encoded
+
+class SendQueue(object):
+    """
+    Bounded queue of the messages waiting to be written to one status client
+
+    Only one message is handed to the WebSocket at a time, so a slow client
+    holds at most :attr:`_max_messages` messages here instead of growing the
+    Tornado write buffer without bound.  A queued status update is replaced
+    by a newer one rather than sent late.  A client whose queue fills up or
+    whose current write takes longer than :attr:`_stall_timeout` seconds is
+    disconnected.
+    """
+    def __init__(
+            self,
+            client,
+            name,
+            binary=False,
+            max_messages=MAX_QUEUED_MESSAGES,
+            stall_timeout=STALL_TIMEOUT):
+        """
+        Initializes an empty queue
+
+        :param client: The client the messages are written to
+        :type client: StatusWebSocket
+        :param name: The name of the client in the logs and metrics
+        :type name: str
+        :param binary: Whether the messages are sent as binary frames
+        :type binary: bool
+        :param max_messages: The maximum number of queued messages
+        :type max_messages: int
+        :param stall_timeout: The seconds a write may take before the client
+            is dropped
+        :type stall_timeout: float
+        """
+        self._client = client
+        self._name = name
+        self._binary = binary
+        self._max_messages = max_messages
+        self._stall_timeout = stall_timeout
+
+        # Pairs of the serialized message and whether a newer one replaces it
+        self._messages = collections.deque()
+        self._write_started = None
+        self._closed = False
+
+    def get_name(self):
+        """
+        Returns the name of the client
+
+        :returns: The name of the client
+        :rtype: str
+        """
+        return self._name
+
+    def get_depth(self):
+        """
+        Returns the number of messages not yet written to the client
+
+        :returns: The queued messages plus the one being written
+        :rtype: int
+        """
+        return len(self._messages) + (self._write_started is not None)
+
+    def put(self, message, coalesce=False):
+        """
+        Queues a message for the client
+
+        :param message: The serialized message
+        :type message: str
+        :param coalesce: Whether the message replaces any earlier queued
+            message that was also put with ``coalesce``
+        :type coalesce: bool
+        :returns: False if the client is closed or was dropped
+        :rtype: bool
+        """
+        if self._closed:
+            return False
+
+        if (self._write_started is not None and
+                Scheduler.instance().monotonic() - self._write_started > self._stall_timeout):
+            self.drop('stalled')
+            return False
+
+        if coalesce:
+            for queued in self._messages:
+                if queued[1]:
+                    # The newer message goes to the back so messages stay in
+                    # the order they were created
+                    self._messages.remove(queued)
+                    COALESCED_UPDATES.inc()
+                    break
+
+        if len(self._messages) >= self._max_messages:
+            self.drop('queue_full')
+            return False
+
+        self._messages.append((message, coalesce))
+        if self._write_started is None:
+            self._write_next()
+
+        return True
+
+    def _write_next(self):
+        """
+        Hands the oldest queued message to the WebSocket
+        """
+        if self._closed or not self._messages:
+            self._write_started = None
+            return
+
+        message, _ = self._messages.popleft()
+        self._write_started = Scheduler.instance().monotonic()
+        try:
+            future = self._client.write_message(message, self._binary)
+        except tornado.websocket.WebSocketClosedError:
+            self._close()
+            return
+
+        tornado.ioloop.IOLoop.current().add_future(future, self._on_written)
+
+    def _on_written(self, future):
+        """
+        Starts the next write once the client accepted a message
+
+        :param future: The future of the finished write
+        :type future: tornado.concurrent.Future
+        """
+        try:
+            future.result()
+        except tornado.websocket.WebSocketClosedError:
+            self._close()
+            return
+
+        self._write_next()
+
+    def drop(self, reason):
+        """
+        Disconnects a client that fell behind
+
+        :param reason: Why the client is dropped
+        :type reason: str
+        """
+        logging.warning('Dropping status client {} ({}) with {} unsent messages'.format(
+            self._name,
+            reason,
+            self.get_depth()))
+        DROPPED_CLIENTS.labels(reason).inc()
+        self._close()
+        self._client.close()
+
+    def _close(self):
+        """
+        Discards the queued messages and refuses new ones
+        """
+        self._closed = True
+        self._messages.clear()
+        self._write_started = None
+
+class StatusBroadcaster(object):
+    """
+    Builds a single status snapshot on a fixed interval and sends it to every
+    subscribed status client
+    """
+    def __init__(self, application, interval=UPDATE_INTERVAL):
+        """
+        Initializes the broadcaster
+
+        :param application: The Tornado application whose settings hold the
+            peripherals
+        :type application: tornado.web.Application
+        :param interval: The number of seconds between status updates
+        :type interval: float
+        """
+        self._application = application
+        self._interval = interval
+        self._subscribers = set()
+        self._periodic_handle = None
+
+        self._broadcast_count = 0
+        self._last_client_count = 0
+        self._last_fanout_time = 0
+        self._max_fanout_time = 0
+
+    def start(self):
+        """
+        Starts the periodic status broadcast
+        """
+        if self._periodic_handle:
+            return
+
+        self._periodic_handle = Scheduler.instance().periodic(
+            self._broadcast,
+            self._interval,
+            'broadcast')
+        self._periodic_handle.start()
+
+    def stop(self):
+        """
+        Stops the periodic status broadcast
+        """
+        if self._periodic_handle:
+            self._periodic_handle.stop()
+            self._periodic_handle = None
+
+    def subscribe(self, client):
+        """
+        Adds a client to receive status updates
+
+        :param client: The client to send updates to
+        :type client: StatusWebSocket
+        """
+        self._subscribers.add(client)
+
+    def unsubscribe(self, client):
+        """
+        Removes a client from the status updates
+
+        :param client: The client to stop sending updates to
+        :type client: StatusWebSocket
+        """
+        self._subscribers.discard(client)
+
+    def get_snapshot(self):
+        """
+        Returns the current smoker status
+
+        :returns: Dictionary containing the time and temperatures of the
+            latest probe reading, setpoint, food alarms, blower speed, and
+            lid state
+        :rtype: dict
+        """
+        settings = self._application.settings
+        reading = settings['probe_bank'].get_reading()
+
+        return {
+            'time': reading.time,
+            'pit_temp': reading.pit_temp,
+            'food_temp': reading.food_temps,
+            'setpoint': settings['controller'].get_setpoint(),
+            'food_alarms': settings['food_alarms'],
+            'blower_speed': settings['blower'].get_speed(),
+            'lid': settings['controller'].get_lid_state()}
+
+    def get_stats(self):
+        """
+        Returns statistics about the status broadcasts
+
+        :returns: Dictionary containing the number of broadcasts sent, the
+            number of clients served by the last broadcast, and the last and
+            maximum fan-out times in seconds
+        :rtype: dict
+        """
+        return {
+            'broadcasts': self._broadcast_count,
+            'clients': self._last_client_count,
+            'last_fanout_time': self._last_fanout_time,
+            'max_fanout_time': self._max_fanout_time}
+
+    def collect_metrics(self):
+        """
+        Returns the broadcast statistics as metrics
+
+        :returns: List of the metrics
+        :rtype: list
+        """
+        return [
+            Family(
+                'smokematic_broadcasts_total',
+                'counter',
+                'Status broadcasts sent',
+                [('smokematic_broadcasts_total', {}, self._broadcast_count)]),
+            Family(
+                'smokematic_websocket_clients',
+                'gauge',
+                'WebSocket clients subscribed to the status broadcast',
+                [('smokematic_websocket_clients', {}, len(self._subscribers))]),
+            Family(
+                'smokematic_websocket_queue_depth',
+                'gauge',
+                'Messages not yet written to each status client',
+                [
+                    (
+                        'smokematic_websocket_queue_depth',
+                        {'client': client.get_send_queue().get_name()},
+                        client.get_send_queue().get_depth())
+                    for client in self._subscribers]),
+            Family(
+                'smokematic_broadcast_fanout_seconds',
+                'gauge',
+                'Time the last status broadcast took to serialize and send',
+                [('smokematic_broadcast_fanout_seconds', {}, self._last_fanout_time)]),
+            Family(
+                'smokematic_broadcast_fanout_seconds_max',
+                'gauge',
+                'Longest time a status broadcast took to serialize and send',
+                [('smokematic_broadcast_fanout_seconds_max', {}, self._max_fanout_time)])]
+
+    def publish_lid_event(self, state, timestamp):
+        """
+        Immediately sends a change of the lid state to every subscriber
+
+        :param state: The new lid state
+        :type state: str
+        :param timestamp: The time of the change in seconds since the epoch
+        :type timestamp: float
+        """
+        self._send({
+            'type': 'lid',
+            'data': {
+                'state': state,
+                'time': timestamp}})
+
+    def _broadcast(self):
+        """
+        Serializes the status snapshot once per encoding and sends it to every
+        subscriber
+        """
+        if not self._subscribers:
+            return
+
+        start_time = time.time()
+
+        served = self._send(
+            {
+                'type': 'update',
+                'data': self.get_snapshot()},
+            True)
+
+        fanout_time = time.time() - start_time
+
+        self._broadcast_count += 1
+        self._last_client_count = served
+        self._last_fanout_time = fanout_time
+        self._max_fanout_time = max(self._max_fanout_time, fanout_time)
+
+        logging.debug('Status broadcast sent to {} clients in {:.6f} seconds'.format(
+            served,
+            fanout_time))
+
+    def _send(self, message, coalesce=False):
+        """
+        Serializes a message once for each encoding the subscribers use and
+        queues it for every subscriber
+
+        :param message: The message with a ``type`` key
+        :type message: dict
+        :param coalesce: Whether the message replaces an older one of the
+            same kind still queued for a subscriber
+        :type coalesce: bool
+        :returns: The number of subscribers the message was queued for
+        :rtype: int
+        """
+        encoded = {}
+        served = 0
+        for client in list(self._subscribers):
+            encoding = client.get_encoding()
+            if encoding not in encoded:
+                encoded[encoding] = encode_message(message, encoding)
+
+            if client.get_send_queue().put(encoded[encoding], coalesce):
+                served += 1
+            else:
+                self.unsubscribe(client)
+
+        return served
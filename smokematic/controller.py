@@ -1,15 +1,42 @@
-from collections import namedtuple
 import logging
 import time
 
-import tornado.gen
+from smokematic import metrics
+from smokematic.autotune import RelayAutoTune
+from smokematic.fopdt import MAX_DEAD_TIME, MAX_GAIN, MIN_GAIN, MIN_POINTS, STATS_INTERVAL, fit_fopdt
+from smokematic.history import StatHistory, StatPoint
+from smokematic.lid import LidDetector
+from smokematic.probe import SAMPLE_PERIOD
+from smokematic.scheduler import Scheduler
 
 PID_INTERVAL = 60
 
-StatPoint = namedtuple(
-    'StatPoint',
-    ['pit_temp', 'setpoint', 'blower_speed', 'food_temps']
-)
+# Time constant, in seconds, of the low-pass filter on the derivative term
+DERIVATIVE_FILTER = 30
+
+# Fraction of the integral kept per minute while the pit is above setpoint
+INTEGRAL_DECAY = 0.10
+
+SETPOINT = metrics.gauge(
+    'smokematic_setpoint_degrees',
+    'Pit temperature setpoint in degrees fahrenheit')
+
+STATS_RECORDED = metrics.counter(
+    'smokematic_stats_recorded_total',
+    'Minute-by-minute stat points recorded')
+
+PID_CALCULATIONS = metrics.counter(
+    'smokematic_pid_calculations_total',
+    'PID calculations run')
+
+PID_DELAY = metrics.histogram(
+    'smokematic_pid_delay_seconds',
+    'Time from taking a probe reading to running the PID calculation on it')
+
+PID_TERM = metrics.gauge(
+    'smokematic_pid_term',
+    'Blower speed contribution of each term of the latest PID calculation',
+    ('term',))
 
 class Controller(object):
     """
@@ -19,29 +46,68 @@ class Controller(object):
     PROFILE_RUNNING = 1
     OVERRIDE = 2
 
-    def __init__(self, blower, pit_probe, *food_probes):
+    def __init__(self, blower, probe_bank):
         """
         Initializes the Controller
 
         :param blower: The blower object
         :type blower: Blower
-        :param pit_probe: The pit Probe object
-        :type pit_probe: Probe
-        :param food_probes: List of at least one food probe
-        :type food_probes: List of Probes
+        :param probe_bank: The ProbeBank with the pit and at least one food
+            probe
+        :type probe_bank: ProbeBank
         """
-        self._pit_probe = pit_probe
+        self._probe_bank = probe_bank
         self._blower = blower
-        self._food_probes = food_probes
 
-        self._pid = Pid(blower, pit_probe)
+        self._pid = Pid(blower, probe_bank)
 
         self._profile_periodic_handle = None
         self._stats_periodic_handle = None
         self._cook_profile = None
         self._profile_time_start = None
+        self._clock_behind = False
         self._state = Controller.UNINITIALIZED
-        self._stats_history = {}
+        self._stats_history = StatHistory(len(probe_bank.get_food_probes()))
+        self._history_session = None
+        self._journal = None
+        self._lid_detector = None
+        self._autotune = None
+        self._feed_forward = False
+        self._max_dead_time = MAX_DEAD_TIME
+        self._min_points = MIN_POINTS
+        self._min_gain = MIN_GAIN
+        self._max_gain = MAX_GAIN
+        self._plant_model = None
+        self._resume_pid = None
+
+    def hold_blower_off(self):
+        """
+        Turns the blower off and stops the PID and any auto-tune experiment
+        from driving it until :meth:`release_blower` is called
+
+        Used by the watchdog when the control loop has stalled.
+        """
+        if self._blower.is_held():
+            return
+
+        # An experiment would hand the blower back to the PID when it ends
+        self._resume_pid = self._pid.get_pid_status() or (
+            self._autotune is not None and RelayAutoTune.RUNNING == self._autotune.get_state())
+        self._blower.hold_off()
+        self.cancel_autotune()
+        self._pid.disable()
+
+    def release_blower(self):
+        """
+        Hands the blower back to the PID after :meth:`hold_blower_off`
+        """
+        if not self._blower.is_held():
+            return
+
+        self._blower.release()
+        if self._resume_pid:
+            self._pid.enable()
+        self._resume_pid = None
 
     def set_pid_coefficients(self, p, i, d):
         """
@@ -56,6 +122,10 @@ class Controller(object):
         """
         self._pid.set_coefficients(p, i, d)
 
+        if self._journal:
+            self._journal.record_coefficients(p, i, d)
+            self._journal.flush()
+
     def get_pid_coefficients(self):
         """
         Returns the current PID coefficients
@@ -65,6 +135,227 @@ class Controller(object):
         """
         return self._pid.get_coefficients()
 
+    def set_pid_timing(self, interval, derivative_filter):
+        """
+        Sets how often the PID runs and how much its derivative is smoothed
+
+        :param interval: The number of seconds between PID calculations
+        :type interval: float
+        :param derivative_filter: The time constant in seconds of the
+            derivative low-pass filter, 0 to disable it
+        :type derivative_filter: float
+        :raises: ValueError
+        """
+        self._pid.set_interval(interval)
+        self._pid.set_derivative_filter(derivative_filter)
+
+    def get_pid_timing(self):
+        """
+        Returns how often the PID runs and how much its derivative is smoothed
+
+        :returns: Tuple containing the PID interval and the derivative filter
+            time constant in seconds
+        :rtype: Tuple
+        """
+        return (self._pid.get_interval(), self._pid.get_derivative_filter())
+
+    def set_lid_detector(self, lid_detector):
+        """
+        Sets the detector that pauses the PID while the lid is open
+
+        :param lid_detector: The lid detector
+        :type lid_detector: LidDetector
+        """
+        self._lid_detector = lid_detector
+        self._pid.set_lid_detector(lid_detector)
+
+    def get_lid_state(self):
+        """
+        Returns the state of the lid
+
+        :returns: The lid state or None if lid detection is disabled
+        :rtype: str
+        """
+        return self._lid_detector.get_state() if self._lid_detector else None
+
+    def set_feed_forward(
+            self,
+            enabled,
+            max_dead_time=MAX_DEAD_TIME,
+            min_points=MIN_POINTS,
+            min_gain=MIN_GAIN,
+            max_gain=MAX_GAIN):
+        """
+        Enables or disables blower feed-forward from a model of the pit
+
+        While enabled, every setpoint change refits a first-order-plus-dead-
+        time model to the stats history and starts the blower at the speed
+        the model says holds the new setpoint, so the PID only corrects the
+        model's error.  Profile steps get that speed one dead time early.  The
+        last good model is kept while the history is too short to fit, e.g.
+        right after a new profile clears it, but a history that fits poorly
+        drops the model and the feed-forward until a later fit succeeds.
+
+        :param enabled: Whether to use feed-forward
+        :type enabled: bool
+        :param max_dead_time: The longest dead time in seconds to fit
+        :type max_dead_time: float
+        :param min_points: The fewest stats points to fit a model to
+        :type min_points: int
+        :param min_gain: The smallest plausible model gain in degrees per
+            percent of blower speed
+        :type min_gain: float
+        :param max_gain: The largest plausible model gain in degrees per
+            percent of blower speed
+        :type max_gain: float
+        """
+        self._feed_forward = enabled
+        self._max_dead_time = max_dead_time
+        self._min_points = min_points
+        self._min_gain = min_gain
+        self._max_gain = max_gain
+
+        if not enabled:
+            self._pid.set_feed_forward(0)
+
+    def get_plant_model(self):
+        """
+        Returns the parameters of the last fitted model of the pit
+
+        :returns: Dictionary containing the gain, time constant, dead time,
+            and bias or None if no model was fitted
+        :rtype: dict
+        """
+        return self._plant_model.get_parameters() if self._plant_model else None
+
+    def _fit_plant_model(self):
+        """
+        Refits the model of the pit to the stats history, keeping the previous
+        model if the history is too short to fit and dropping it if the
+        history fits poorly
+        """
+        stat_points = self._stats_history.get_range()
+        if len(stat_points) <= self._min_points + self._max_dead_time // STATS_INTERVAL:
+            logging.debug('Kept previous pit model as the history is too short to fit')
+            return
+
+        try:
+            self._plant_model = fit_fopdt(
+                stat_points,
+                max_dead_time=self._max_dead_time,
+                min_points=self._min_points,
+                min_gain=self._min_gain,
+                max_gain=self._max_gain)
+            logging.debug('Fitted pit model {}'.format(self._plant_model.get_parameters()))
+        except ValueError as e:
+            self._plant_model = None
+            logging.info('Dropped pit model and feed-forward: {}'.format(e))
+
+    def set_history_memory(self, max_memory):
+        """
+        Sets the maximum memory used to store the stats history, dropping the
+        oldest stats if they no longer fit
+
+        :param max_memory: The maximum number of bytes for the stats history
+        :type max_memory: int
+        :raises: ValueError
+        """
+        self._stats_history.resize(max_memory)
+
+    def set_journal(self, journal):
+        """
+        Resumes the cook recorded in the journal, if any, and then records
+        all further stats and state changes to it
+
+        :param journal: The journal
+        :type journal: Journal
+        :returns: Whether a cook was resumed from the journal
+        :rtype: bool
+        """
+        start_time = time.time()
+        state = journal.replay()
+
+        if state:
+            self._restore(state)
+            logging.info('Resumed cook from journal in {:.3f} seconds'.format(
+                time.time() - start_time))
+
+        self._journal = journal
+        self._journal.start(self._write_journal_snapshot)
+
+        return state is not None
+
+    def _restore(self, state):
+        """
+        Restores the controller to the state rebuilt from a journal
+
+        :param state: The rebuilt state
+        :type state: JournalState
+        """
+        if state.coefficients:
+            # Coefficients changed while cooking outlive a restart, so an
+            # edited config.json is only used once they are set again
+            configured = self.get_pid_coefficients()
+            if None not in configured and tuple(configured) != tuple(state.coefficients):
+                logging.warning(
+                    'Using the journaled PID coefficients {} instead of the configured {}'.format(
+                        tuple(state.coefficients),
+                        tuple(configured)))
+            self._pid.set_coefficients(*state.coefficients)
+
+        self._cook_profile = state.profile
+        self._profile_time_start = state.profile_time_start
+        self._history_session = int(self._profile_time_start * 1000)
+
+        self._stats_history.clear(state.stat_points[0][0] if state.stat_points else 0)
+        for _, stat_point in state.stat_points:
+            self._stats_history.append(stat_point)
+
+        if state.override_setpoint is None:
+            self._set_temperature_from_profile()
+            self._profile_periodic_handle = Scheduler.instance().periodic(
+                self._set_temperature_from_profile,
+                60,
+                'profile')
+            self._profile_periodic_handle.start()
+            self._state = Controller.PROFILE_RUNNING
+        else:
+            self._set_setpoint(state.override_setpoint)
+            self._state = Controller.OVERRIDE
+
+        if state.pid_state:
+            self._pid.restore_state(*state.pid_state)
+
+        self._stats_periodic_handle = Scheduler.instance().periodic(
+            self._record_stats,
+            60,
+            'stats')
+        self._stats_periodic_handle.start()
+
+    def _write_journal_snapshot(self, journal):
+        """
+        Records the complete current state to a freshly compacted journal
+
+        :param journal: The journal
+        :type journal: Journal
+        """
+        coefficients = self.get_pid_coefficients()
+        if None not in coefficients:
+            journal.record_coefficients(*coefficients)
+
+        if self._cook_profile is None:
+            return
+
+        journal.record_profile(self._cook_profile, self._profile_time_start)
+
+        for time_offset, stat_point in self._stats_history.get_range():
+            journal.record_stats(time_offset, stat_point)
+
+        if Controller.OVERRIDE == self._state:
+            journal.record_override(self.get_setpoint())
+
+        journal.record_pid_state(*self._pid.get_state())
+
     def set_profile(self, profile):
         """
         Sets a new cooking profile
@@ -77,42 +368,55 @@ class Controller(object):
             raise ValueError('Profile must have a temperature for time 0')
 
         self._cook_profile = profile
-        self._profile_time_start = time.time()
+        self._profile_time_start = Scheduler.instance().time()
 
         self._set_temperature_from_profile()
 
         if self._profile_periodic_handle:
             self._profile_periodic_handle.stop()
 
-        self._profile_periodic_handle = tornado.ioloop.PeriodicCallback(
+        self._profile_periodic_handle = Scheduler.instance().periodic(
             self._set_temperature_from_profile,
-            60000)
+            60,
+            'profile')
 
-        self._stats_history = {}
+        self._stats_history.clear()
+        self._history_session = int(self._profile_time_start * 1000)
         self._record_stats()
-        self._stats_periodic_handle = tornado.ioloop.PeriodicCallback(
+
+        if self._stats_periodic_handle:
+            self._stats_periodic_handle.stop()
+
+        self._stats_periodic_handle = Scheduler.instance().periodic(
             self._record_stats,
-            60000)
+            60,
+            'stats')
 
         self._profile_periodic_handle.start()
         self._stats_periodic_handle.start()
 
         self._state = Controller.PROFILE_RUNNING
 
+        # Everything previously journaled belongs to the old profile
+        if self._journal:
+            self._journal.compact()
+
     def _record_stats(self):
         """
         Records the current smoker stats
         """
-        if self._stats_history:
-            new_time = max(self._stats_history.keys()) + 1
-        else:
-            new_time = 0
-
-        self._stats_history[new_time] = StatPoint(
-            self._pit_probe.get_temp(),
+        reading = self._probe_bank.get_reading()
+        stat_point = StatPoint(
+            reading.pit_temp,
             self.get_setpoint(),
             self._blower.get_speed(),
-            [probe.get_temp() for probe in self._food_probes])
+            reading.food_temps)
+        time_offset = self._stats_history.append(stat_point)
+        STATS_RECORDED.inc()
+
+        if self._journal:
+            self._journal.record_stats(time_offset, stat_point)
+            self._journal.record_pid_state(*self._pid.get_state())
 
     def get_stat_history(self, sample_rate=1):
         """
@@ -123,21 +427,187 @@ class Controller(object):
         :returns: Dictionary of minute:temperature pairs
         :rtype: Dict
         """
-        return {str(k):v for k, v in self._stats_history.items() if k % sample_rate == 0}
+        return {str(k):v for k, v in self._stats_history.get_range(step=sample_rate)}
+
+    def get_downsampled_history(self, max_points):
+        """
+        Returns at most ```max_points``` data points that keep the shape of
+        the pit temperature history, including its peaks and dips
+
+        :param max_points: The maximum number of data points to return
+        :type max_points: int
+        :returns: Dictionary of minute:temperature pairs
+        :rtype: Dict
+        :raises: ValueError
+        """
+        return {str(k):v for k, v in self._stats_history.get_downsampled(max_points)}
+
+    def get_stat_history_since(self, time_offset):
+        """
+        Returns the temperature history recorded after ```time_offset```
+
+        :param time_offset: The last minute offset already known to the caller
+        :type time_offset: int
+        :returns: Dictionary of minute:temperature pairs
+        :rtype: Dict
+        """
+        return {str(k):v for k, v in self._stats_history.get_range(start=time_offset + 1)}
+
+    def get_latest_offset(self):
+        """
+        Returns the minute offset of the most recently recorded stats
+
+        :returns: The latest minute offset or None if nothing is recorded
+        :rtype: int
+        """
+        return self._stats_history.get_last_offset()
+
+    def get_history_session(self):
+        """
+        Returns an identifier for the current stats history, changed every
+        time a new profile clears the history
+
+        :returns: The history session identifier
+        :rtype: int
+        """
+        return self._history_session
 
     def _set_temperature_from_profile(self):
         """
         Sets the temperature based upon the cooking profile
         """
-        now = time.time()
+        now = Scheduler.instance().time()
         time_offset = (now - self._profile_time_start) / 60
 
-        sorted_times = sorted(self._cook_profile.keys())
+        # Only the latest step that has started applies; setting every
+        # earlier one on the way would reset the PID each time
+        started = [
+            profile_time for profile_time in self._cook_profile.keys()
+            if time_offset >= profile_time]
+
+        # A clock behind the profile start, e.g. a BBB restarted before NTP
+        # has synced, holds the first step until it catches up
+        current_time = max(started) if started else min(self._cook_profile.keys())
+
+        if not started and not self._clock_behind:
+            logging.warning(
+                'Clock is {:.1f} minutes behind the profile start, holding the first step until it catches up'.format(
+                    -time_offset))
+        self._clock_behind = not started
+
+        if self.get_setpoint() != self._cook_profile[current_time]:
+            self._set_setpoint(self._cook_profile[current_time])
+
+        if self._feed_forward and self._plant_model:
+            # The pit only responds after the dead time so the blower heads
+            # for the next step that early
+            lead = self._plant_model.get_dead_time() / 60.0
+            upcoming = [
+                profile_time for profile_time in self._cook_profile.keys()
+                if time_offset < profile_time <= time_offset + lead]
+            if upcoming:
+                self._pid.set_feed_forward(self._plant_model.get_steady_output(
+                    self._cook_profile[min(upcoming)]))
+
+    def _set_setpoint(self, setpoint):
+        """
+        Changes the PID setpoint, cancelling any auto-tune experiment as it
+        only holds for the setpoint it started at
+
+        :param setpoint: The new setpoint
+        :type setpoint: float
+        :raises: ValueError
+        """
+        self.cancel_autotune()
+        self._pid.set_setpoint(setpoint)
+        SETPOINT.set(setpoint)
+
+        if self._feed_forward:
+            self._fit_plant_model()
+            self._pid.set_feed_forward(
+                self._plant_model.get_steady_output(setpoint) if self._plant_model else 0)
+
+    def start_autotune(self, **settings):
+        """
+        Hands the blower to a relay auto-tune experiment around the current
+        setpoint, cancelling any running experiment
+
+        The PID resumes once the experiment ends.  Changing the setpoint
+        cancels the experiment.
+
+        :param settings: Keyword arguments for RelayAutoTune
+        :type settings: dict
+        :raises: ValueError, RuntimeError
+        """
+        setpoint = self.get_setpoint()
+        if setpoint is None:
+            raise RuntimeError('Temperature setpoint must be set before auto-tuning')
+
+        if self._blower.is_held():
+            raise RuntimeError('Blower is held off by the watchdog')
+
+        autotune = RelayAutoTune(
+            self._blower,
+            self._probe_bank,
+            setpoint,
+            **settings)
+
+        self.cancel_autotune()
+        self._pid.disable()
+
+        self._autotune = autotune
+        self._autotune.start(self._autotune_finished)
+
+    def cancel_autotune(self):
+        """
+        Cancels a running auto-tune experiment
+        """
+        if self._autotune:
+            self._autotune.cancel()
+
+    def get_autotune_status(self):
+        """
+        Returns the progress of the latest auto-tune experiment
+
+        :returns: The experiment status or None if none was started
+        :rtype: dict
+        """
+        return self._autotune.get_status() if self._autotune else None
+
+    def apply_autotune(self):
+        """
+        Sets the PID coefficients found by the latest auto-tune experiment
+
+        :returns: Tuple containing the P, I, D coefficients
+        :rtype: Tuple
+        :raises: RuntimeError
+        """
+        if not self._autotune or not self._autotune.get_result():
+            raise RuntimeError('No auto-tune results to apply')
 
-        for profile_time in sorted_times:
-            if time_offset >= profile_time:
-                if self.get_setpoint() != self._cook_profile[profile_time]:
-                    self._pid.set_setpoint(self._cook_profile[profile_time])
+        coefficients = self._autotune.get_result()['coefficients']
+        self.set_pid_coefficients(
+            coefficients['p'],
+            coefficients['i'],
+            coefficients['d'])
+
+        return self.get_pid_coefficients()
+
+    def _autotune_finished(self, autotune):
+        """
+        Hands the blower back to the PID once an experiment ends
+
+        :param autotune: The finished experiment
+        :type autotune: RelayAutoTune
+        """
+        if RelayAutoTune.DONE == autotune.get_state():
+            logging.info('Auto-tune found coefficients {}'.format(
+                autotune.get_result()['coefficients']))
+        elif RelayAutoTune.FAILED == autotune.get_state():
+            logging.warning('Auto-tune failed: {}'.format(autotune.get_status()['message']))
+
+        if not self._blower.is_held():
+            self._pid.enable()
 
     def get_state(self):
         """
@@ -159,9 +629,13 @@ class Controller(object):
             self._profile_periodic_handle.stop()
             self._profile_periodic_handle = None
 
-        self._pid.set_setpoint(temp)
+        self._set_setpoint(temp)
         self._state = Controller.OVERRIDE
 
+        if self._journal:
+            self._journal.record_override(temp)
+            self._journal.flush()
+
     def get_setpoint(self):
         """
         Gets the current setpoint temperature
@@ -179,28 +653,59 @@ class Controller(object):
             self._profile_periodic_handle.stop()
 
         self._set_temperature_from_profile()
-        self._profile_periodic_handle = tornado.ioloop.PeriodicCallback(
+        self._profile_periodic_handle = Scheduler.instance().periodic(
             self._set_temperature_from_profile,
-            1000)
+            60,
+            'profile')
 
         self._profile_periodic_handle.start()
         self._state = Controller.PROFILE_RUNNING
 
+        if self._journal:
+            self._journal.record_resume()
+            self._journal.flush()
+
 class Pid(object):
     """
     PID controller
+
+    Calculations are driven by the ProbeBank: while enabled the PID runs as
+    soon as every Nth reading arrives, N being the interval divided by the
+    probe sample period.  The integral and derivative use the time elapsed
+    between the readings so the coefficients mean the same at any interval.
+    The derivative comes from the pit probe's estimated slope when its
+    estimator provides one and is otherwise the low-pass filtered change in
+    error so short intervals don't make the blower chatter on probe noise.
+
+    A feed-forward blower speed, e.g. from a model of the pit, is added to
+    the output so the terms only have to correct it.
+
+    With a LidDetector set, the blower and integral are held while the lid is
+    open.  Once it closes the pit recovers on the proportional term alone,
+    with the integral still held, until it is back near the setpoint.
     """
-    def __init__(self, blower, pit_probe):
+    def __init__(
+            self,
+            blower,
+            probe_bank,
+            interval=PID_INTERVAL,
+            derivative_filter=DERIVATIVE_FILTER):
         """
         Initializes the PID controller
 
         :param blower: Blower object
         :type blower: Blower
-        :param pit_probe: Pit probe object
-        :type pit_probe: Probe
+        :param probe_bank: ProbeBank object
+        :type probe_bank: ProbeBank
+        :param interval: The number of seconds between PID calculations
+        :type interval: float
+        :param derivative_filter: The time constant in seconds of the
+            derivative low-pass filter, 0 to disable it
+        :type derivative_filter: float
+        :raises: ValueError
         """
         self._blower = blower
-        self._pit_probe = pit_probe
+        self._probe_bank = probe_bank
 
         self._setpoint = None
         self._enabled = False
@@ -209,10 +714,21 @@ class Pid(object):
         self._k_i = None
         self._k_d = None
         self._ci = 0
+        self._feed_forward = 0
 
-        self._pid_periodic_handle = None
+        self._readings_per_calc = 1
+        self._readings_since_calc = 0
 
         self._last_error = None
+        self._last_time = None
+        self._derivative = 0
+
+        self._lid_detector = None
+
+        self._interval = None
+        self._derivative_filter = None
+        self.set_interval(interval)
+        self.set_derivative_filter(derivative_filter)
 
     def get_setpoint(self):
         """
@@ -236,7 +752,7 @@ class Pid(object):
 
         self._setpoint = setpoint
         self._ci = 0
-        self._last_error = None
+        self._reset_derivative()
         self.enable()
 
     def set_coefficients(self, p, i, d):
@@ -263,6 +779,105 @@ class Pid(object):
         """
         return (self._k_p, self._k_i, self._k_d)
 
+    def set_interval(self, interval):
+        """
+        Sets the time between PID calculations, rounded to a whole number of
+        probe readings
+
+        :param interval: The number of seconds between PID calculations
+        :type interval: float
+        :raises: ValueError
+        """
+        if interval < SAMPLE_PERIOD:
+            raise ValueError('PID interval must be at least the {} second probe sample period'.format(
+                SAMPLE_PERIOD))
+
+        self._readings_per_calc = int(round(float(interval) / SAMPLE_PERIOD))
+        self._interval = self._readings_per_calc * SAMPLE_PERIOD
+
+    def set_feed_forward(self, feed_forward):
+        """
+        Sets the blower speed added to the PID output
+
+        :param feed_forward: The blower speed from 0-100
+        :type feed_forward: float
+        """
+        self._feed_forward = feed_forward
+
+    def get_feed_forward(self):
+        """
+        Returns the blower speed added to the PID output
+
+        :returns: The blower speed from 0-100
+        :rtype: float
+        """
+        return self._feed_forward
+
+    def get_interval(self):
+        """
+        Returns the time between PID calculations
+
+        :returns: The number of seconds between PID calculations
+        :rtype: float
+        """
+        return self._interval
+
+    def set_derivative_filter(self, derivative_filter):
+        """
+        Sets the time constant of the derivative low-pass filter
+
+        :param derivative_filter: The time constant in seconds, 0 to disable
+            the filter
+        :type derivative_filter: float
+        :raises: ValueError
+        """
+        if derivative_filter < 0:
+            raise ValueError('Derivative filter time constant must be >= 0')
+
+        self._derivative_filter = derivative_filter
+
+    def set_lid_detector(self, lid_detector):
+        """
+        Sets the detector that pauses the PID while the lid is open
+
+        :param lid_detector: The lid detector or None to disable detection
+        :type lid_detector: LidDetector
+        """
+        self._lid_detector = lid_detector
+
+    def get_derivative_filter(self):
+        """
+        Returns the time constant of the derivative low-pass filter
+
+        :returns: The time constant in seconds
+        :rtype: float
+        """
+        return self._derivative_filter
+
+    def get_state(self):
+        """
+        Returns the internal state of the PID calculation
+
+        :returns: Tuple containing the accumulated integral error and the
+            error of the last calculation
+        :rtype: Tuple
+        """
+        return (self._ci, self._last_error)
+
+    def restore_state(self, integral, last_error):
+        """
+        Restores the internal state of the PID calculation, e.g. after a
+        restart
+
+        :param integral: The accumulated integral error
+        :type integral: float
+        :param last_error: The error of the last calculation or None
+        :type last_error: float
+        """
+        self._reset_derivative()
+        self._ci = integral
+        self._last_error = last_error
+
     def enable(self):
         """
         Enables the PID controller
@@ -278,13 +893,10 @@ class Pid(object):
         if not self._setpoint:
             raise RuntimeError('Temperature setpoint must be set before enabling')
 
-        self._pid_periodic_handle = tornado.ioloop.PeriodicCallback(
-            self._pid_calc,
-            PID_INTERVAL * 1000)
-
         self._ci = 0
-        self._last_error = None
-        self._pid_periodic_handle.start()
+        self._reset_derivative()
+        self._readings_since_calc = 0
+        self._probe_bank.subscribe(self._on_reading)
         self._enabled = True
 
     def disable(self):
@@ -294,8 +906,7 @@ class Pid(object):
         if not self._enabled:
             return
 
-        self._pid_periodic_handle.stop()
-        self._pid_periodic_handle = None
+        self._probe_bank.unsubscribe(self._on_reading)
 
         self._enabled = False
 
@@ -316,36 +927,113 @@ class Pid(object):
         """
         return self._enabled
 
-    def _pid_calc(self):
+    def _reset_derivative(self):
+        """
+        Forgets the previous error so the next calculation has no derivative
+        """
+        self._last_error = None
+        self._last_time = None
+        self._derivative = 0
+
+    def _on_reading(self, reading):
+        """
+        Runs the PID calculation on every Nth probe reading
+
+        :param reading: The new probe reading
+        :type reading: Reading
+        """
+        if self._lid_detector:
+            self._lid_detector.update(reading, self._setpoint)
+
+        self._readings_since_calc += 1
+        if self._readings_since_calc < self._readings_per_calc:
+            return
+
+        self._readings_since_calc = 0
+        self._pid_calc(reading)
+
+    def _pid_calc(self, reading):
         """
         Main PID calculation function
+
+        :param reading: The probe reading to act on
+        :type reading: Reading
         """
-        curr_temp = self._pit_probe.get_temp()
+        if self._lid_detector:
+            lid_state = self._lid_detector.get_state()
+        else:
+            lid_state = LidDetector.CLOSED
+
+        PID_CALCULATIONS.inc()
+        PID_DELAY.observe(max(0.0, Scheduler.instance().time() - reading.time))
+
+        if LidDetector.OPEN == lid_state or self._blower.is_held():
+            # Leave the blower alone and start the derivative afresh once
+            # the lid closes or the watchdog releases the blower
+            self._reset_derivative()
+            return
+
+        # Only the pit's recovery from the open lid drives the error up, so
+        # the integral must not wind up or decay until it is over
+        integrate = LidDetector.CLOSED == lid_state
+
+        # The wall clock can step when NTP syncs so the elapsed time comes
+        # from the monotonic clock
+        if self._last_time is None:
+            elapsed = self._interval
+        else:
+            elapsed = reading.monotonic - self._last_time
+            if elapsed <= 0:
+                return
+        self._last_time = reading.monotonic
+
+        curr_temp = reading.pit_temp
         curr_blower = self._blower.get_speed()
 
         error = self._setpoint - curr_temp
 
-        if curr_temp >= self._setpoint:
-            self._ci *= 0.10
+        # Feed-forward can hold the pit above setpoint by itself, which only
+        # a negative integral can cancel
+        if integrate and curr_temp >= self._setpoint and not self._feed_forward:
+            self._ci *= INTEGRAL_DECAY ** (elapsed / 60.0)
 
         p_part = self._k_p * error
 
         # Anti-windup check
-        if (error > 0 and curr_blower < 100) or (error < 0 and curr_blower > 0):
-            self._ci += error * PID_INTERVAL
+        if integrate and ((error > 0 and curr_blower < 100) or (error < 0 and curr_blower > 0)):
+            self._ci += error * elapsed
         i_part = self._k_i * self._ci
 
-        if self._last_error is not None:
-            d_part = self._k_d * ((error - self._last_error) / PID_INTERVAL)
+        if reading.pit_slope is not None:
+            # The estimated slope is already smoothed and, unlike the change
+            # in error, doesn't jump when the setpoint changes
+            self._derivative = -reading.pit_slope
+            d_part = self._k_d * self._derivative
+        elif self._last_error is not None:
+            derivative = (error - self._last_error) / elapsed
+            weight = elapsed / (self._derivative_filter + elapsed)
+            self._derivative += (derivative - self._derivative) * weight
+            d_part = self._k_d * self._derivative
         else:
             d_part = 0
 
-        new_speed = int(min(100, max(0, p_part + i_part + d_part)))
+        # The rebound after the lid closes would otherwise throttle the
+        # recovery
+        if LidDetector.RECOVERING == lid_state:
+            d_part = 0
+
+        new_speed = int(min(100, max(0, self._feed_forward + p_part + i_part + d_part)))
         self._blower.set_speed(new_speed)
 
-        logging.debug('PID results: Read {}, Wanted {}, P={} I={} D={}, Set fan to {}'.format(
+        PID_TERM.labels('feed_forward').set(self._feed_forward)
+        PID_TERM.labels('p').set(p_part)
+        PID_TERM.labels('i').set(i_part)
+        PID_TERM.labels('d').set(d_part)
+
+        logging.debug('PID results: Read {}, Wanted {}, FF={} P={} I={} D={}, Set fan to {}'.format(
             curr_temp,
             self._setpoint,
+            self._feed_forward,
             p_part,
             i_part,
             d_part,
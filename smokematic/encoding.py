@@ -0,0 +1,183 @@
+import struct
+
+from smokematic.lid import LidDetector
+
+ENCODINGS = ('json', 'binary')
+
+MESSAGE_TYPES = ('initial', 'history', 'update', 'lid')
+
+# None when lid detection is disabled
+LID_STATES = (None, LidDetector.CLOSED, LidDetector.OPEN, LidDetector.RECOVERING)
+
+NAN = float('nan')
+
+# Every message is little-endian and starts with its index in
+# MESSAGE_TYPES.  Missing temperatures, setpoints, and alarms are NaN and
+# the lid state is its index in LID_STATES.
+
+# initial and history messages: type, more, session, latest, point count,
+# and food probe count followed by the int32 time offsets and then the
+# float32 pit temperatures, setpoints, blower speeds, and each food probe's
+# temperatures as one column per field
+HISTORY_HEADER = struct.Struct('<BBqiHB')
+
+# update messages: type, time, pit temperature, setpoint, blower speed, lid
+# state, and food probe count followed by the float32 food temperatures and
+# then the food alarms
+UPDATE_HEADER = struct.Struct('<BdfffBB')
+
+# lid messages: type, lid state, and time
+LID = struct.Struct('<BBd')
+
+def encode_binary(message):
+    """
+    Serializes a status message to the binary encoding
+
+    :param message: The message with a ``type`` key
+    :type message: dict
+    :returns: The serialized message
+    :rtype: bytes
+    :raises: ValueError
+    """
+    message_type = message['type']
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError('Unknown message type {}'.format(message_type))
+    type_code = MESSAGE_TYPES.index(message_type)
+    data = message['data']
+
+    if 'lid' == message_type:
+        return LID.pack(type_code, LID_STATES.index(data['state']), data['time'])
+
+    if 'update' == message_type:
+        food_temps = data['food_temp']
+        return UPDATE_HEADER.pack(
+            type_code,
+            data['time'],
+            _pack_float(data['pit_temp']),
+            _pack_float(data['setpoint']),
+            _pack_float(data['blower_speed']),
+            LID_STATES.index(data['lid']),
+            len(food_temps)) + _pack_floats(food_temps + data['food_alarms'])
+
+    time_offsets = sorted(data, key=int)
+    points = [data[time_offset] for time_offset in time_offsets]
+    num_food = len(points[0]['food_temp']) if points else 0
+
+    columns = [
+        _pack_floats([point['pit_temp'] for point in points]),
+        _pack_floats([point['setpoint'] for point in points]),
+        _pack_floats([point['blower_speed'] for point in points])]
+    for index in range(num_food):
+        columns.append(_pack_floats([point['food_temp'][index] for point in points]))
+
+    return b''.join([
+        HISTORY_HEADER.pack(
+            type_code,
+            message['more'],
+            message['session'],
+            message['latest'],
+            len(points),
+            num_food),
+        struct.pack('<{}i'.format(len(points)), *[int(offset) for offset in time_offsets])] + columns)
+
+def decode_binary(encoded):
+    """
+    Deserializes a binary status message into the message it was made from,
+    with float32 precision
+
+    :param encoded: The serialized message
+    :type encoded: bytes
+    :returns: The message
+    :rtype: dict
+    :raises: ValueError
+    """
+    try:
+        message_type = MESSAGE_TYPES[bytearray(encoded[:1])[0]]
+    except IndexError:
+        raise ValueError('Unknown message type')
+
+    if 'lid' == message_type:
+        _, lid, timestamp = LID.unpack_from(encoded)
+        return {'type': message_type, 'data': {'state': LID_STATES[lid], 'time': timestamp}}
+
+    if 'update' == message_type:
+        _, timestamp, pit_temp, setpoint, blower_speed, lid, num_food = UPDATE_HEADER.unpack_from(encoded)
+        values = _unpack_floats(encoded, UPDATE_HEADER.size, 2 * num_food)
+        return {
+            'type': message_type,
+            'data': {
+                'time': timestamp,
+                'pit_temp': _unpack_float(pit_temp),
+                'food_temp': values[:num_food],
+                'setpoint': _unpack_float(setpoint),
+                'food_alarms': values[num_food:],
+                'blower_speed': _unpack_float(blower_speed),
+                'lid': LID_STATES[lid]}}
+
+    _, more, session, latest, count, num_food = HISTORY_HEADER.unpack_from(encoded)
+    offset = HISTORY_HEADER.size
+    time_offsets = struct.unpack_from('<{}i'.format(count), encoded, offset)
+    columns = _unpack_floats(encoded, offset + 4 * count, (3 + num_food) * count)
+
+    data = {}
+    for index, time_offset in enumerate(time_offsets):
+        data[time_offset] = {
+            'pit_temp': columns[index],
+            'food_temp': [columns[(3 + food) * count + index] for food in range(num_food)],
+            'setpoint': columns[count + index],
+            'blower_speed': columns[2 * count + index]}
+
+    return {
+        'type': message_type,
+        'session': session,
+        'latest': latest,
+        'more': bool(more),
+        'data': data}
+
+def _pack_float(value):
+    """
+    Returns a value to pack as a float, NaN if it is missing
+
+    :param value: The value or None
+    :type value: float
+    :returns: The value to pack
+    :rtype: float
+    """
+    return NAN if value is None else value
+
+def _unpack_float(value):
+    """
+    Returns an unpacked float, None if it is NaN
+
+    :param value: The unpacked value
+    :type value: float
+    :returns: The value or None
+    :rtype: float
+    """
+    return None if value != value else value
+
+def _pack_floats(values):
+    """
+    Packs values as float32s
+
+    :param values: The values, None where missing
+    :type values: list
+    :returns: The packed values
+    :rtype: bytes
+    """
+    return struct.pack('<{}f'.format(len(values)), *[_pack_float(value) for value in values])
+
+def _unpack_floats(encoded, offset, count):
+    """
+    Unpacks float32s
+
+    :param encoded: The serialized message
+    :type encoded: bytes
+    :param offset: The byte offset of the first value
+    :type offset: int
+    :param count: The number of values
+    :type count: int
+    :returns: The values, None where missing
+    :rtype: list
+    """
+    return [_unpack_float(value) for value in struct.unpack_from('<{}f'.format(count), encoded, offset)]
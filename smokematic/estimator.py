@@ -0,0 +1,187 @@
+EMA_WINDOW = 60
+
+# Standard deviation of a reduced probe sample in degrees fahrenheit
+MEASUREMENT_NOISE = 1.0
+
+# Standard deviation of the change in the rate of temperature change in
+# degrees fahrenheit per second squared
+PROCESS_NOISE = 0.002
+
+class EmaEstimator(object):
+    """
+    Estimates the temperature with an exponential moving average of the
+    samples from the last :attr:`_window` seconds
+
+    It does not estimate the rate of change.
+    """
+    def __init__(self, window=EMA_WINDOW):
+        """
+        Initializes the estimator
+
+        :param window: The number of seconds of samples averaged
+        :type window: float
+        :raises: ValueError
+        """
+        if window <= 0:
+            raise ValueError('EMA window must be positive')
+
+        self._window = window
+        self._temp = None
+        self._last_time = None
+
+    def update(self, timestamp, temp):
+        """
+        Adds a temperature sample
+
+        :param timestamp: The monotonic time of the sample in seconds
+        :type timestamp: float
+        :param temp: The sampled temperature
+        :type temp: float
+        """
+        if self._temp is None:
+            self._temp = temp
+        elif timestamp > self._last_time:
+            multiplier = 2.0 / ((self._window / (timestamp - self._last_time)) + 1.0)
+            self._temp = (temp - self._temp) * multiplier + self._temp
+
+        self._last_time = timestamp
+
+    def get_temp(self):
+        """
+        Returns the estimated temperature
+
+        :returns: The temperature or None if there were no samples
+        :rtype: float
+        """
+        return self._temp
+
+    def get_slope(self):
+        """
+        Returns None as the rate of change is not estimated
+
+        :returns: None
+        :rtype: NoneType
+        """
+        return None
+
+class KalmanEstimator(object):
+    """
+    Estimates the temperature and its rate of change with a Kalman filter
+    that models the temperature as changing at a rate that drifts randomly
+
+    ``process_noise`` sets how quickly the rate is allowed to change and
+    ``measurement_noise`` how much a single sample is trusted; raising their
+    ratio makes the estimate follow trends sooner at the cost of more noise.
+    """
+    def __init__(self, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE):
+        """
+        Initializes the estimator
+
+        :param process_noise: The standard deviation of the change in the
+            rate, in degrees per second squared
+        :type process_noise: float
+        :param measurement_noise: The standard deviation of a sample in degrees
+        :type measurement_noise: float
+        :raises: ValueError
+        """
+        if process_noise <= 0 or measurement_noise <= 0:
+            raise ValueError('Kalman process and measurement noise must be positive')
+
+        self._q = process_noise ** 2
+        self._r = measurement_noise ** 2
+
+        self._temp = None
+        self._slope = 0.0
+        self._last_time = None
+
+        # Covariance of the temperature and slope estimates
+        self._p_tt = 0.0
+        self._p_ts = 0.0
+        self._p_ss = 0.0
+
+    def update(self, timestamp, temp):
+        """
+        Adds a temperature sample
+
+        :param timestamp: The monotonic time of the sample in seconds
+        :type timestamp: float
+        :param temp: The sampled temperature
+        :type temp: float
+        """
+        if self._temp is None:
+            # Start from the first sample with an unknown slope
+            self._temp = temp
+            self._slope = 0.0
+            self._p_tt = self._r
+            self._p_ts = 0.0
+            self._p_ss = 1.0
+            self._last_time = timestamp
+            return
+
+        dt = timestamp - self._last_time
+        if dt <= 0:
+            return
+        self._last_time = timestamp
+
+        # Predict
+        temp_prior = self._temp + self._slope * dt
+        p_tt = (
+            self._p_tt + 2 * dt * self._p_ts + dt * dt * self._p_ss +
+            self._q * dt ** 3 / 3)
+        p_ts = self._p_ts + dt * self._p_ss + self._q * dt ** 2 / 2
+        p_ss = self._p_ss + self._q * dt
+
+        # Correct
+        innovation = temp - temp_prior
+        innovation_var = p_tt + self._r
+        gain_t = p_tt / innovation_var
+        gain_s = p_ts / innovation_var
+
+        self._temp = temp_prior + gain_t * innovation
+        self._slope += gain_s * innovation
+
+        self._p_tt = (1 - gain_t) * p_tt
+        self._p_ts = (1 - gain_t) * p_ts
+        self._p_ss = p_ss - gain_s * p_ts
+
+    def get_temp(self):
+        """
+        Returns the estimated temperature
+
+        :returns: The temperature or None if there were no samples
+        :rtype: float
+        """
+        return self._temp
+
+    def get_slope(self):
+        """
+        Returns the estimated rate of change of the temperature
+
+        :returns: The rate in degrees per second or None if there were no
+            samples
+        :rtype: float
+        """
+        return None if self._temp is None else self._slope
+
+ESTIMATORS = {
+    'ema': EmaEstimator,
+    'kalman': KalmanEstimator}
+
+def create_estimator(config):
+    """
+    Creates the estimator described by a probe's ``estimator`` configuration,
+    which holds the estimator ``type`` and its parameters, defaulting to an
+    EMA
+
+    :param config: The estimator configuration or None
+    :type config: dict
+    :returns: The estimator
+    :rtype: object
+    :raises: ValueError
+    """
+    parameters = dict(config or {})
+    name = parameters.pop('type', 'ema')
+    if name not in ESTIMATORS:
+        raise ValueError('Unknown estimator {}'.format(name))
+
+    return ESTIMATORS[name](**parameters)
@@ -0,0 +1,218 @@
+import math
+
+# Seconds between the recorded stat points the model is fitted to
+STATS_INTERVAL = 60
+
+# The longest dead time, in seconds, tried when fitting
+MAX_DEAD_TIME = 600
+
+# The fewest usable stat points a fit needs
+MIN_POINTS = 30
+
+# The range of plausible gains in degrees per percent of blower speed
+MIN_GAIN = 1.0
+MAX_GAIN = 10.0
+
+# The smallest share of the variance of the minute-to-minute pit temperature
+# changes a fit must explain
+MIN_R_SQUARED = 0.5
+
+class FopdtModel(object):
+    """
+    First-order-plus-dead-time model of how the pit temperature responds to
+    the blower speed
+
+    After :attr:`_dead_time` seconds the pit approaches
+    ``bias + gain * blower_speed`` with a time constant of
+    :attr:`_time_constant` seconds.
+    """
+    def __init__(self, gain, time_constant, dead_time, bias):
+        """
+        Initializes the model
+
+        :param gain: The steady temperature rise per percent of blower speed
+        :type gain: float
+        :param time_constant: The seconds the pit takes to reach 63% of a
+            change
+        :type time_constant: float
+        :param dead_time: The seconds before the pit starts responding
+        :type dead_time: float
+        :param bias: The steady temperature with the blower off
+        :type bias: float
+        :raises: ValueError
+        """
+        if gain <= 0 or time_constant <= 0 or dead_time < 0:
+            raise ValueError('Model gain and time constant must be positive and dead time >= 0')
+
+        self._gain = gain
+        self._time_constant = time_constant
+        self._dead_time = dead_time
+        self._bias = bias
+
+    def get_dead_time(self):
+        """
+        Returns the time before the pit starts responding to the blower
+
+        :returns: The dead time in seconds
+        :rtype: float
+        """
+        return self._dead_time
+
+    def get_steady_output(self, temp):
+        """
+        Returns the blower speed that holds the pit at a temperature
+
+        :param temp: The pit temperature
+        :type temp: float
+        :returns: The blower speed from 0-100
+        :rtype: float
+        """
+        return min(100.0, max(0.0, (temp - self._bias) / self._gain))
+
+    def get_parameters(self):
+        """
+        Returns the model parameters
+
+        :returns: Dictionary containing the gain, time constant, dead time,
+            and bias
+        :rtype: dict
+        """
+        return {
+            'gain': self._gain,
+            'time_constant': self._time_constant,
+            'dead_time': self._dead_time,
+            'bias': self._bias}
+
+def fit_fopdt(
+        stat_points,
+        interval=STATS_INTERVAL,
+        max_dead_time=MAX_DEAD_TIME,
+        min_points=MIN_POINTS,
+        min_gain=MIN_GAIN,
+        max_gain=MAX_GAIN,
+        min_r_squared=MIN_R_SQUARED):
+    """
+    Fits a :class:`FopdtModel` to recorded pit temperatures and blower speeds
+
+    Every whole number of intervals up to ``max_dead_time`` is tried as the
+    dead time with a least squares fit of
+    ``pit[k + 1] = a * pit[k] + b * blower[k - delay] + c`` and the delay
+    with the smallest mean squared error wins.  Every delay is fit over the
+    same steps so a longer one isn't favored for having fewer rows.
+
+    The fit is rejected unless it explains at least ``min_r_squared`` of the
+    variance of the pit's temperature changes, its gain is between
+    ``min_gain`` and ``max_gain``, and its dead time is shorter than
+    ``max_dead_time`` as the pit may really respond even later.
+
+    :param stat_points: Consecutive (time offset, StatPoint) pairs
+    :type stat_points: list
+    :param interval: The seconds between the points
+    :type interval: float
+    :param max_dead_time: The longest dead time in seconds to try
+    :type max_dead_time: float
+    :param min_points: The fewest usable points to fit
+    :type min_points: int
+    :param min_gain: The smallest plausible gain in degrees per percent of
+        blower speed
+    :type min_gain: float
+    :param max_gain: The largest plausible gain in degrees per percent of
+        blower speed
+    :type max_gain: float
+    :param min_r_squared: The smallest coefficient of determination of the
+        temperature changes to accept
+    :type min_r_squared: float
+    :returns: The fitted model
+    :rtype: FopdtModel
+    :raises: ValueError
+    """
+    temps = [stat_point.pit_temp for _, stat_point in stat_points]
+    speeds = [stat_point.blower_speed for _, stat_point in stat_points]
+
+    max_delay = int(max_dead_time // interval)
+
+    best = None
+    for delay in range(max_delay + 1):
+        rows = []
+        for k in range(max_delay, len(temps) - 1):
+            row = (temps[k], speeds[k - delay], temps[k + 1])
+            if None not in row:
+                rows.append(row)
+
+        if len(rows) < min_points:
+            continue
+
+        solution = _least_squares(rows)
+        if solution is None:
+            continue
+
+        a, b, c = solution
+        error = sum((temp * a + speed * b + c - next_temp) ** 2 for temp, speed, next_temp in rows) / len(rows)
+        if best is None or error < best[0]:
+            best = (error, delay, a, b, c, rows)
+
+    if best is None:
+        raise ValueError('Not enough varied blower history to fit a model')
+
+    error, delay, a, b, c, rows = best
+    if not 0 < a < 1 or b <= 0:
+        raise ValueError('Blower history does not fit a first order response')
+
+    # Predicting the next temperature as the current one already scores
+    # well, so the fit is judged by how much of the change it explains
+    changes = [next_temp - temp for temp, _, next_temp in rows]
+    mean_change = sum(changes) / float(len(changes))
+    variance = sum((change - mean_change) ** 2 for change in changes) / len(changes)
+    r_squared = 1 - error / variance if variance else 0
+    if r_squared < min_r_squared:
+        raise ValueError('Model only explains {:.0%} of the pit temperature changes'.format(r_squared))
+
+    if delay and delay == max_delay:
+        raise ValueError('Dead time is at the {:.0f} second search limit'.format(delay * interval))
+
+    gain = b / (1 - a)
+    if not min_gain <= gain <= max_gain:
+        raise ValueError('Implausible gain of {:.2f} degrees per percent of blower speed'.format(gain))
+
+    return FopdtModel(
+        gain,
+        -interval / math.log(a),
+        delay * interval,
+        c / (1 - a))
+
+def _least_squares(rows):
+    """
+    Solves the normal equations of ``y = a * x1 + b * x2 + c``
+
+    :param rows: Tuples containing x1, x2, and y
+    :type rows: list
+    :returns: Tuple containing a, b, and c or None if the rows don't
+        determine them
+    :rtype: tuple
+    """
+    # Center the data so the pit temperature doesn't swamp the blower speed
+    n = float(len(rows))
+    mean_x1 = sum(row[0] for row in rows) / n
+    mean_x2 = sum(row[1] for row in rows) / n
+    mean_y = sum(row[2] for row in rows) / n
+
+    s11 = s12 = s22 = s1y = s2y = 0.0
+    for x1, x2, y in rows:
+        x1 -= mean_x1
+        x2 -= mean_x2
+        y -= mean_y
+        s11 += x1 * x1
+        s12 += x1 * x2
+        s22 += x2 * x2
+        s1y += x1 * y
+        s2y += x2 * y
+
+    determinant = s11 * s22 - s12 * s12
+    if determinant <= 1e-9 * s11 * s22:
+        return None
+
+    a = (s1y * s22 - s2y * s12) / determinant
+    b = (s2y * s11 - s1y * s12) / determinant
+    c = mean_y - a * mean_x1 - b * mean_x2
+
+    return (a, b, c)
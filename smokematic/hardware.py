@@ -0,0 +1,266 @@
+import random
+import time
+
+from smokematic.plant import ThermalModel
+from smokematic import thermistor
+
+# Resolution of the BBB ADC
+ADC_MAX = 4095
+
+class BbioBackend(object):
+    """
+    Hardware backend that drives the BBB through Adafruit_BBIO
+
+    :attr:`ADC`, :attr:`PWM`, and :attr:`GPIO` are the Adafruit_BBIO modules
+    themselves.
+    """
+    def __init__(self, config):
+        """
+        Imports Adafruit_BBIO, which is only available on a BBB
+
+        :param config: The smokematic configuration
+        :type config: dict
+        """
+        import Adafruit_BBIO.ADC
+        import Adafruit_BBIO.GPIO
+        import Adafruit_BBIO.PWM
+
+        self.ADC = Adafruit_BBIO.ADC
+        self.PWM = Adafruit_BBIO.PWM
+        self.GPIO = Adafruit_BBIO.GPIO
+
+class SimulatedADC(object):
+    """
+    Stand-in for Adafruit_BBIO.ADC that reads the probe temperatures of a
+    ThermalModel
+    """
+    def __init__(self, probes, noise, rng):
+        """
+        Initializes the simulated ADC
+
+        :param probes: Dictionary with pin keys and values of a function
+            returning the probe temperature and the probe's Steinhart-Hart
+            coefficients
+        :type probes: dict
+        :param noise: The standard deviation of the read noise in degrees
+            fahrenheit
+        :type noise: float
+        :param rng: The random number generator of the read noise
+        :type rng: random.Random
+        """
+        self._probes = probes
+        self._noise = noise
+        self._rng = rng
+
+    def setup(self):
+        """
+        Does nothing as the simulated ADC needs no setup
+        """
+        pass
+
+    def read(self, pin):
+        """
+        Reads the temperature of the probe on a pin
+
+        :param pin: The probe pin
+        :type pin: str
+        :returns: The ADC read, from 0-1, quantized to the ADC resolution
+        :rtype: float
+        """
+        get_temp, coefficients = self._probes[pin]
+        temp = get_temp()
+        if self._noise:
+            temp += self._rng.gauss(0, self._noise)
+
+        value = thermistor.to_read(temp, *coefficients)
+        return min(max(round(value * ADC_MAX), 1), ADC_MAX - 1) / float(ADC_MAX)
+
+class SimulatedPWM(object):
+    """
+    Stand-in for Adafruit_BBIO.PWM that sets the airflow of a ThermalModel
+    """
+    def __init__(self, model, blower_pin):
+        """
+        Initializes the simulated PWM
+
+        :param model: The model the blower feeds
+        :type model: ThermalModel
+        :param blower_pin: The blower pin
+        :type blower_pin: str
+        """
+        self._model = model
+        self._blower_pin = blower_pin
+
+    def start(self, pin, duty_cycle, frequency=2000, polarity=0):
+        """
+        Sets the duty cycle of a pin
+
+        :param pin: The PWM pin
+        :type pin: str
+        :param duty_cycle: The duty cycle from 0-100
+        :type duty_cycle: float
+        :param frequency: The PWM frequency, which is ignored
+        :type frequency: int
+        :param polarity: The PWM polarity, which is ignored
+        :type polarity: int
+        """
+        if pin == self._blower_pin:
+            self._model.set_airflow(duty_cycle / 100.0)
+
+    def stop(self, pin):
+        """
+        Stops the PWM of a pin
+
+        :param pin: The PWM pin
+        :type pin: str
+        """
+        if pin == self._blower_pin:
+            self._model.set_airflow(0)
+
+    def cleanup(self):
+        """
+        Does nothing as the simulated PWM holds no resources
+        """
+        pass
+
+class SimulatedGPIO(object):
+    """
+    Stand-in for Adafruit_BBIO.GPIO that remembers the pin outputs
+    """
+    OUT = 'out'
+    IN = 'in'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        """
+        Initializes the simulated GPIO with every pin low
+        """
+        self._outputs = {}
+
+    def setup(self, pin, direction):
+        """
+        Sets up a pin
+
+        :param pin: The GPIO pin
+        :type pin: str
+        :param direction: The pin direction
+        :type direction: str
+        """
+        self._outputs[pin] = self.LOW
+
+    def output(self, pin, value):
+        """
+        Sets the output of a pin
+
+        :param pin: The GPIO pin
+        :type pin: str
+        :param value: The output value
+        :type value: int
+        """
+        self._outputs[pin] = value
+
+    def input(self, pin):
+        """
+        Returns the output of a pin
+
+        :param pin: The GPIO pin
+        :type pin: str
+        :returns: The last output value
+        :rtype: int
+        """
+        return self._outputs.get(pin, self.LOW)
+
+class SimulatedBackend(object):
+    """
+    Hardware backend that runs a ThermalModel of a smoker instead of
+    touching any hardware
+
+    The optional ``simulation`` section of the hardware configuration holds
+    ``noise``, the standard deviation of the probe noise in degrees
+    fahrenheit, and any of the ThermalModel parameters.
+    """
+    def __init__(self, config, clock=time.time, rng=None):
+        """
+        Builds the model and the simulated peripherals
+
+        :param config: The smokematic configuration
+        :type config: dict
+        :param clock: Returns the current time in seconds
+        :type clock: callable
+        :param rng: The random number generator of the probe noise or None
+            for an unseeded one
+        :type rng: random.Random
+        """
+        parameters = dict(config.get('hardware', {}).get('simulation', {}))
+        noise = parameters.pop('noise', 0.5)
+
+        self._model = ThermalModel(
+            len(config['food_probes']),
+            clock=clock,
+            **parameters)
+
+        probes = {
+            config['pit_probe']['pin']: (
+                self._model.get_pit_temp,
+                self._get_coefficients(config['pit_probe']))}
+        for i, food_probe in enumerate(config['food_probes']):
+            probes[food_probe['pin']] = (
+                self._make_food_getter(i),
+                self._get_coefficients(food_probe))
+
+        self.ADC = SimulatedADC(probes, noise, rng or random.Random())
+        self.PWM = SimulatedPWM(self._model, config['blower']['pin'])
+        self.GPIO = SimulatedGPIO()
+
+    def get_model(self):
+        """
+        Returns the simulated smoker
+
+        :returns: The thermal model
+        :rtype: ThermalModel
+        """
+        return self._model
+
+    def _get_coefficients(self, probe):
+        """
+        Returns the Steinhart-Hart coefficients of a probe configuration
+
+        :param probe: The probe configuration
+        :type probe: dict
+        :returns: The A, B, and C coefficients
+        :rtype: tuple
+        """
+        return (probe['sh_a'], probe['sh_b'], probe['sh_c'])
+
+    def _make_food_getter(self, index):
+        """
+        Returns a function that returns the temperature of a single food
+
+        :param index: The index of the food
+        :type index: int
+        :returns: The temperature function
+        :rtype: callable
+        """
+        return lambda: self._model.get_food_temps()[index]
+
+BACKENDS = {
+    'bbio': BbioBackend,
+    'simulated': SimulatedBackend}
+
+def create_backend(config):
+    """
+    Creates the hardware backend named by the ``hardware`` section of the
+    configuration, defaulting to the BBB
+
+    :param config: The smokematic configuration
+    :type config: dict
+    :returns: The hardware backend
+    :rtype: object
+    :raises: ValueError
+    """
+    name = config.get('hardware', {}).get('backend', 'bbio')
+    if name not in BACKENDS:
+        raise ValueError('Unknown hardware backend {}'.format(name))
+
+    return BACKENDS[name](config)
@@ -0,0 +1,417 @@
+from array import array
+from collections import namedtuple, OrderedDict
+
+DEFAULT_MAX_MEMORY = 1024 * 1024
+MAX_CACHED_BUDGETS = 4
+
+StatPoint = namedtuple(
+    'StatPoint',
+    ['pit_temp', 'setpoint', 'blower_speed', 'food_temps']
+)
+
+def _to_array_value(value):
+    """
+    Converts a stat value to a value storable in a float array
+
+    :param value: The value to convert
+    :type value: float
+    :returns: The value or NaN if the value is None
+    :rtype: float
+    """
+    return float('nan') if value is None else value
+
+def _from_array_value(value):
+    """
+    Converts a value read from a float array back to a stat value
+
+    :param value: The value to convert
+    :type value: float
+    :returns: The value or None if the value is NaN
+    :rtype: float
+    """
+    return None if value != value else value
+
+class MinMaxDownsampler(object):
+    """
+    Incrementally reduces a series to at most a fixed number of points
+
+    The series is split into equal-width buckets of minute offsets and only
+    the offsets of the minimum and maximum value of each bucket are kept so
+    short peaks and dips survive the reduction.  Whenever there are too many
+    buckets, neighbouring buckets are merged and the bucket width doubles.
+    """
+    def __init__(self, max_points):
+        """
+        Initializes the downsampler
+
+        :param max_points: The maximum number of points to return
+        :type max_points: int
+        :raises: ValueError
+        """
+        if max_points < 3:
+            raise ValueError('Point budget must be at least 3 points')
+
+        # The newest point is always returned on top of the buckets
+        self._max_buckets = (max_points - 1) // 2
+        self._width = 1
+        self._base_offset = None
+        self._last_offset = None
+
+        # Each bucket is [min offset, min value, max offset, max value]
+        self._buckets = []
+
+    def add(self, offset, value):
+        """
+        Adds the next value of the series
+
+        :param offset: The minute offset of the value, newer than any
+            previously added offset
+        :type offset: int
+        :param value: The value or None if it is unknown
+        :type value: float
+        """
+        if self._base_offset is None:
+            self._base_offset = offset
+
+        self._last_offset = offset
+        bucket_index = (offset - self._base_offset) // self._width
+
+        if bucket_index < len(self._buckets):
+            bucket = self._buckets[-1]
+            if value is not None:
+                if bucket[1] is None or value < bucket[1]:
+                    bucket[0:2] = [offset, value]
+                if bucket[3] is None or value > bucket[3]:
+                    bucket[2:4] = [offset, value]
+            return
+
+        self._buckets.append([offset, value, offset, value])
+
+        if len(self._buckets) > self._max_buckets:
+            self._merge_buckets()
+
+    def get_offsets(self, first_offset=None):
+        """
+        Returns the offsets of the points kept to represent the series
+
+        :param first_offset: The oldest offset that may be returned
+        :type first_offset: int
+        :returns: Sorted list of minute offsets
+        :rtype: list
+        """
+        offsets = set()
+        for bucket in self._buckets:
+            offsets.add(bucket[0])
+            offsets.add(bucket[2])
+
+        if self._last_offset is not None:
+            offsets.add(self._last_offset)
+
+        if first_offset is not None:
+            offsets = [offset for offset in offsets if offset >= first_offset]
+
+        return sorted(offsets)
+
+    def _merge_buckets(self):
+        """
+        Doubles the bucket width by merging every pair of buckets
+        """
+        merged = []
+        for i in range(0, len(self._buckets), 2):
+            bucket = self._buckets[i]
+            if i + 1 < len(self._buckets):
+                other = self._buckets[i + 1]
+                if other[1] is not None and (bucket[1] is None or other[1] < bucket[1]):
+                    bucket[0:2] = other[0:2]
+                if other[3] is not None and (bucket[3] is None or other[3] > bucket[3]):
+                    bucket[2:4] = other[2:4]
+            merged.append(bucket)
+
+        self._buckets = merged
+        self._width *= 2
+
+class StatHistory(object):
+    """
+    Fixed-capacity ring buffer of minute-by-minute smoker stats
+
+    Each stat is stored in its own typed array so a point costs a few bytes
+    per value instead of a tuple and list of Python floats.  Points are
+    addressed by their minute offset; once the buffer is full each append
+    overwrites the oldest point.
+    """
+    TYPECODE = 'd'
+
+    def __init__(self, num_food_probes, max_memory=DEFAULT_MAX_MEMORY):
+        """
+        Initializes the stats history
+
+        :param num_food_probes: The number of food probes recorded per point
+        :type num_food_probes: int
+        :param max_memory: The maximum number of bytes to use for the stats
+        :type max_memory: int
+        :raises: ValueError
+        """
+        self._num_food_probes = num_food_probes
+
+        self._point_size = array(self.TYPECODE).itemsize * (3 + num_food_probes)
+        self._capacity = max_memory // self._point_size
+
+        if self._capacity < 1:
+            raise ValueError('History memory must hold at least one stat point')
+
+        self._pit_temps = self._new_column()
+        self._setpoints = self._new_column()
+        self._blower_speeds = self._new_column()
+        self._food_temps = [self._new_column() for _ in range(num_food_probes)]
+
+        self._base_offset = 0
+        self._next_offset = 0
+
+        self._downsamplers = OrderedDict()
+
+    def _new_column(self):
+        """
+        Creates an array to hold a single stat for every point
+
+        :returns: An array of :attr:`_capacity` NaN values
+        :rtype: array
+        """
+        return array(self.TYPECODE, [float('nan')]) * self._capacity
+
+    def get_capacity(self):
+        """
+        Returns the maximum number of stat points retained
+
+        :returns: The capacity in stat points
+        :rtype: int
+        """
+        return self._capacity
+
+    def get_memory_usage(self):
+        """
+        Returns the number of bytes used by the stat arrays
+
+        :returns: The memory used in bytes
+        :rtype: int
+        """
+        return self._capacity * self._point_size
+
+    def __len__(self):
+        return min(self._next_offset - self._base_offset, self._capacity)
+
+    def get_first_offset(self):
+        """
+        Returns the minute offset of the oldest retained point
+
+        :returns: The oldest offset or None if the history is empty
+        :rtype: int
+        """
+        if self._next_offset == self._base_offset:
+            return None
+
+        return max(self._base_offset, self._next_offset - self._capacity)
+
+    def get_last_offset(self):
+        """
+        Returns the minute offset of the newest point
+
+        :returns: The newest offset or None if the history is empty
+        :rtype: int
+        """
+        if self._next_offset == self._base_offset:
+            return None
+
+        return self._next_offset - 1
+
+    def clear(self, next_offset=0):
+        """
+        Removes all points from the history
+
+        :param next_offset: The minute offset of the next appended point
+        :type next_offset: int
+        """
+        self._base_offset = next_offset
+        self._next_offset = next_offset
+        self._downsamplers.clear()
+
+    def append(self, stat_point):
+        """
+        Records a new point one minute after the newest point
+
+        :param stat_point: The stats to record
+        :type stat_point: StatPoint
+        :returns: The minute offset of the new point
+        :rtype: int
+        """
+        offset = self._next_offset
+        index = offset % self._capacity
+
+        self._pit_temps[index] = _to_array_value(stat_point.pit_temp)
+        self._setpoints[index] = _to_array_value(stat_point.setpoint)
+        self._blower_speeds[index] = _to_array_value(stat_point.blower_speed)
+        for column, food_temp in zip(self._food_temps, stat_point.food_temps):
+            column[index] = _to_array_value(food_temp)
+
+        for downsampler in self._downsamplers.values():
+            downsampler.add(offset, stat_point.pit_temp)
+
+        self._next_offset += 1
+        return offset
+
+    def get_range(self, start=None, stop=None, step=1):
+        """
+        Returns the retained points between ``start`` and ``stop`` whose
+        offsets are a multiple of ``step``
+
+        :param start: The first minute offset to include, defaults to the
+            oldest retained point
+        :type start: int
+        :param stop: The minute offset to stop before, defaults to after the
+            newest point
+        :type stop: int
+        :param step: Only include offsets that are a multiple of this
+        :type step: int
+        :returns: List of (minute offset, StatPoint) tuples in time order
+        :rtype: list
+        """
+        first_offset = self.get_first_offset()
+        if first_offset is None:
+            return []
+
+        start = first_offset if start is None else max(start, first_offset)
+        stop = self._next_offset if stop is None else min(stop, self._next_offset)
+
+        # Align the start with the multiples of step
+        start += -start % step
+
+        offsets = range(start, stop, step)
+        if not len(offsets):
+            return []
+
+        columns = [self._pit_temps, self._setpoints, self._blower_speeds] + self._food_temps
+        pit_temps, setpoints, blower_speeds = [
+            self._ring_slice(column, start, len(offsets), step) for column in columns[:3]]
+        food_temps = [
+            self._ring_slice(column, start, len(offsets), step) for column in columns[3:]]
+
+        points = []
+        for i, offset in enumerate(offsets):
+            points.append((offset, StatPoint(
+                _from_array_value(pit_temps[i]),
+                _from_array_value(setpoints[i]),
+                _from_array_value(blower_speeds[i]),
+                [_from_array_value(column[i]) for column in food_temps])))
+
+        return points
+
+    def get_point(self, offset):
+        """
+        Returns a single retained point
+
+        :param offset: The minute offset of the point
+        :type offset: int
+        :returns: The stats recorded at that minute
+        :rtype: StatPoint
+        :raises: KeyError
+        """
+        first_offset = self.get_first_offset()
+        if first_offset is None or not first_offset <= offset < self._next_offset:
+            raise KeyError(offset)
+
+        return self._read_point(offset)
+
+    def get_downsampled(self, max_points):
+        """
+        Returns at most ``max_points`` retained points that keep the shape of
+        the pit temperature, including its peaks and dips
+
+        The reduction for each point budget is cached and kept up to date as
+        new points are appended.
+
+        :param max_points: The maximum number of points to return
+        :type max_points: int
+        :returns: List of (minute offset, StatPoint) tuples in time order
+        :rtype: list
+        :raises: ValueError
+        """
+        downsampler = self._downsamplers.pop(max_points, None)
+
+        if downsampler is None:
+            downsampler = MinMaxDownsampler(max_points)
+            for offset, stat_point in self.get_range():
+                downsampler.add(offset, stat_point.pit_temp)
+
+            while len(self._downsamplers) >= MAX_CACHED_BUDGETS:
+                self._downsamplers.popitem(last=False)
+
+        self._downsamplers[max_points] = downsampler
+
+        return [
+            (offset, self._read_point(offset))
+            for offset in downsampler.get_offsets(self.get_first_offset())]
+
+    def resize(self, max_memory):
+        """
+        Changes the memory limit, keeping as many of the newest points as fit
+
+        :param max_memory: The maximum number of bytes to use for the stats
+        :type max_memory: int
+        :raises: ValueError
+        """
+        points = self.get_range()
+
+        resized = StatHistory(self._num_food_probes, max_memory)
+        if points:
+            points = points[-resized.get_capacity():]
+            resized.clear(points[0][0])
+            for _, stat_point in points:
+                resized.append(stat_point)
+        else:
+            resized.clear(self._next_offset)
+
+        self.__dict__.update(resized.__dict__)
+
+    def _read_point(self, offset):
+        """
+        Reads a single point without checking that it is still retained
+
+        :param offset: The minute offset of the point
+        :type offset: int
+        :returns: The stats recorded at that minute
+        :rtype: StatPoint
+        """
+        index = offset % self._capacity
+
+        return StatPoint(
+            _from_array_value(self._pit_temps[index]),
+            _from_array_value(self._setpoints[index]),
+            _from_array_value(self._blower_speeds[index]),
+            [_from_array_value(column[index]) for column in self._food_temps])
+
+    def _ring_slice(self, column, start, count, step):
+        """
+        Reads ``count`` values spaced ``step`` apart from a column, wrapping
+        around the end of the ring
+
+        :param column: The column to read from
+        :type column: array
+        :param start: The minute offset of the first value
+        :type start: int
+        :param count: The number of values to read
+        :type count: int
+        :param step: The distance between values
+        :type step: int
+        :returns: The values read
+        :rtype: array
+        """
+        first_index = start % self._capacity
+        end_index = first_index + (count - 1) * step + 1
+
+        if end_index <= self._capacity:
+            return column[first_index:end_index:step]
+
+        head = column[first_index::step]
+        next_index = first_index + len(head) * step - self._capacity
+        remaining = count - len(head)
+
+        return head + column[next_index:next_index + (remaining - 1) * step + 1:step]
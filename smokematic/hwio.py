@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+import tornado.ioloop
+
+from smokematic.metrics import Family, LatencyHistogram
+from smokematic.scheduler import Scheduler
+
+MAX_QUEUE_DEPTH = 16
+
+class HardwareIO(object):
+    """
+    Runs blocking device file operations on a single worker thread so the
+    IOLoop never waits on them
+
+    Operations run in the order they are submitted.  Write operations given
+    a ``key`` replace a previously submitted operation with the same key
+    that has not started yet, so only the newest state of a device is
+    written.  Once :attr:`_max_queue_depth` operations are waiting, further
+    operations are dropped.
+
+    An inline instance instead runs every operation as soon as it is
+    submitted and delivers its result through the Scheduler, which keeps a
+    simulation deterministic.
+    """
+    def __init__(self, max_queue_depth=MAX_QUEUE_DEPTH, inline=False):
+        """
+        Initializes the worker thread
+
+        :param max_queue_depth: The maximum number of waiting operations
+        :type max_queue_depth: int
+        :param inline: Whether to run operations on the calling thread
+        :type inline: bool
+        """
+        self._max_queue_depth = max_queue_depth
+        self._executor = None if inline else ThreadPoolExecutor(1)
+
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._pending = 0
+
+        self._dropped = 0
+        self._coalesced = 0
+        self._histograms = {}
+
+    def submit(self, name, func, args=(), callback=None, key=None, error_callback=None):
+        """
+        Queues ``func(*args)`` to run on the worker thread
+
+        :param name: The operation name used for the latency histograms
+        :type name: str
+        :param func: The blocking function to run
+        :type func: callable
+        :param args: The arguments to ``func``
+        :type args: tuple
+        :param callback: Called on the IOLoop with the result of ``func``
+        :type callback: callable
+        :param key: Identifies the device state written by the operation
+        :type key: str
+        :param error_callback: Called on the IOLoop with the exception if
+            ``func`` raises
+        :type error_callback: callable
+        :returns: Whether the operation was queued
+        :rtype: bool
+        """
+        with self._lock:
+            if key is not None and key in self._waiting:
+                self._waiting[key][1] = args
+                self._coalesced += 1
+                return True
+
+            if self._pending >= self._max_queue_depth:
+                self._dropped += 1
+                logging.warning('Hardware I/O queue full, dropping {}'.format(name))
+                return False
+
+            operation = [func, args]
+            if key is not None:
+                self._waiting[key] = operation
+            self._pending += 1
+
+        if self._executor is None:
+            Scheduler.instance().call_later(
+                0,
+                self._finish,
+                name,
+                callback,
+                error_callback,
+                self._run(key, operation))
+        else:
+            future = self._executor.submit(self._run, key, operation)
+            tornado.ioloop.IOLoop.instance().add_future(
+                future,
+                lambda future: self._finish(
+                    name,
+                    callback,
+                    error_callback,
+                    future.result()))
+
+        return True
+
+    def get_queue_depth(self):
+        """
+        Returns the number of operations waiting or running
+
+        :returns: The queue depth
+        :rtype: int
+        """
+        return self._pending
+
+    def get_stats(self):
+        """
+        Returns the queue statistics and per-operation latency histograms
+
+        :returns: Dictionary with the queue depth, the number of dropped and
+            coalesced operations, and a latency histogram per operation name
+        :rtype: dict
+        """
+        return {
+            'queue_depth': self._pending,
+            'dropped': self._dropped,
+            'coalesced': self._coalesced,
+            'latency': {
+                name: histogram.get_stats()
+                for name, histogram in self._histograms.items()}}
+
+    def collect_metrics(self):
+        """
+        Returns the queue statistics and latency histograms as metrics
+
+        :returns: List of the metrics
+        :rtype: list
+        """
+        latency_samples = []
+        for name in sorted(self._histograms):
+            latency_samples.extend(self._histograms[name].get_samples(
+                'smokematic_hwio_operation_seconds',
+                {'operation': name}))
+
+        return [
+            Family(
+                'smokematic_hwio_queue_depth',
+                'gauge',
+                'Hardware operations waiting or running',
+                [('smokematic_hwio_queue_depth', {}, self._pending)]),
+            Family(
+                'smokematic_hwio_dropped_total',
+                'counter',
+                'Hardware operations dropped because the queue was full',
+                [('smokematic_hwio_dropped_total', {}, self._dropped)]),
+            Family(
+                'smokematic_hwio_coalesced_total',
+                'counter',
+                'Hardware writes replaced by a newer write before running',
+                [('smokematic_hwio_coalesced_total', {}, self._coalesced)]),
+            Family(
+                'smokematic_hwio_operation_seconds',
+                'histogram',
+                'Time hardware operations took on the worker thread',
+                latency_samples)]
+
+    def shutdown(self):
+        """
+        Waits for the queued operations and stops the worker thread
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _run(self, key, operation):
+        """
+        Runs an operation on the worker thread
+
+        :param key: The operation key or None
+        :type key: str
+        :param operation: The function and its arguments
+        :type operation: list
+        :returns: Tuple containing the result, the latency in seconds, and the
+            exception raised or None
+        :rtype: tuple
+        """
+        with self._lock:
+            if key is not None and self._waiting.get(key) is operation:
+                del self._waiting[key]
+            func, args = operation
+
+        start_time = time.time()
+        try:
+            return (func(*args), time.time() - start_time, None)
+        except Exception as e:
+            return (None, time.time() - start_time, e)
+
+    def _finish(self, name, callback, error_callback, outcome):
+        """
+        Records the latency of a finished operation and calls its callback on
+        the IOLoop
+
+        :param name: The operation name
+        :type name: str
+        :param callback: The operation callback or None
+        :type callback: callable
+        :param error_callback: The operation error callback or None
+        :type error_callback: callable
+        :param outcome: The result, latency, and exception of the operation
+        :type outcome: tuple
+        """
+        with self._lock:
+            self._pending -= 1
+
+        result, latency, error = outcome
+
+        if name not in self._histograms:
+            self._histograms[name] = LatencyHistogram()
+        self._histograms[name].observe(latency)
+
+        if error is not None:
+            logging.error('Hardware operation {} failed: {}'.format(name, error))
+            if error_callback:
+                error_callback(error)
+            return
+
+        if callback:
+            callback(result)
@@ -0,0 +1,363 @@
+import errno
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from smokematic.history import StatPoint
+from smokematic.scheduler import Scheduler
+
+FLUSH_INTERVAL = 300
+MAX_SIZE = 1024 * 1024
+
+MAGIC = b'SMKJ\x01'
+
+# Every record is a type, payload length, and payload CRC32 followed by
+# the payload itself
+RECORD_HEADER = struct.Struct('<BII')
+
+PROFILE = 1
+STATS = 2
+OVERRIDE = 3
+RESUME = 4
+PID_STATE = 5
+COEFFICIENTS = 6
+
+def _pack_float(value):
+    """
+    Converts a possibly missing value to a float for packing
+
+    :param value: The value to convert
+    :type value: float
+    :returns: The value or NaN if the value is None
+    :rtype: float
+    """
+    return float('nan') if value is None else value
+
+def _unpack_float(value):
+    """
+    Converts an unpacked float back to a possibly missing value
+
+    :param value: The value to convert
+    :type value: float
+    :returns: The value or None if the value is NaN
+    :rtype: float
+    """
+    return None if value != value else value
+
+class JournalState(object):
+    """
+    Controller state rebuilt from a journal
+    """
+    def __init__(self):
+        self.profile = None
+        self.profile_time_start = None
+        self.override_setpoint = None
+        self.stat_points = []
+        self.pid_state = None
+        self.coefficients = None
+
+class Journal(object):
+    """
+    Append-only binary log of stats and controller state changes used to
+    resume a cook after a restart
+
+    Stats are buffered and written every ``flush_interval`` seconds while
+    user-initiated state changes are written immediately.  Writes are only
+    synced to disk when the journal is compacted or stopped, as an fsync on
+    the BBB's SD card can block the IOLoop for hundreds of milliseconds; a
+    power loss may lose the writes the kernel has yet to write back.  Once
+    the file grows past ``max_size`` bytes, or twice the size of the last
+    compacted journal if that is larger, it is rewritten with only the
+    current state.
+    """
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, max_size=MAX_SIZE):
+        """
+        Initializes the journal
+
+        :param path: The path of the journal file
+        :type path: str
+        :param flush_interval: The number of seconds between buffered writes
+        :type flush_interval: float
+        :param max_size: The file size in bytes that triggers a compaction
+        :type max_size: int
+        """
+        self._path = path
+        self._flush_interval = flush_interval
+        self._max_size = max_size
+
+        self._file = None
+        self._buffer = []
+        self._flush_periodic_handle = None
+        self._snapshot_callback = None
+        self._snapshot_size = 0
+
+    def replay(self):
+        """
+        Reads the journal file and rebuilds the state it records, discarding
+        any partially written record at its end
+
+        :returns: The recorded state or None if there is no cook to resume
+        :rtype: JournalState
+        """
+        try:
+            f = open(self._path, 'r+b')
+        except IOError as e:
+            if errno.ENOENT == e.errno:
+                return None
+            raise
+
+        state = JournalState()
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC):
+                return None
+
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                if data[:len(MAGIC)] != MAGIC:
+                    logging.warning('Ignoring journal {} with unknown format'.format(self._path))
+                    return None
+
+                position = len(MAGIC)
+                while position + RECORD_HEADER.size <= size:
+                    record_type, length, crc = RECORD_HEADER.unpack_from(data, position)
+                    payload_start = position + RECORD_HEADER.size
+                    payload = data[payload_start:payload_start + length]
+
+                    if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc:
+                        break
+
+                    self._apply_record(state, record_type, payload)
+                    position = payload_start + length
+            finally:
+                data.close()
+
+            if position != size:
+                logging.warning('Discarding {} bytes of partial journal records'.format(
+                    size - position))
+                f.truncate(position)
+
+        if state.profile is None:
+            return None
+
+        return state
+
+    def _apply_record(self, state, record_type, payload):
+        """
+        Updates the rebuilt state with a single record
+
+        :param state: The state to update
+        :type state: JournalState
+        :param record_type: The record type
+        :type record_type: int
+        :param payload: The record payload
+        :type payload: bytes
+        """
+        if PROFILE == record_type:
+            state.profile_time_start = struct.unpack_from('<d', payload)[0]
+            state.profile = {
+                int(k): v for k, v in json.loads(payload[8:].decode('utf-8')).items()}
+            state.override_setpoint = None
+            state.stat_points = []
+            state.pid_state = None
+        elif STATS == record_type:
+            offset = struct.unpack_from('<I', payload)[0]
+            values = [
+                _unpack_float(value)
+                for value in struct.unpack_from('<{}d'.format((len(payload) - 4) // 8), payload, 4)]
+            state.stat_points.append((
+                offset,
+                StatPoint(values[0], values[1], values[2], values[3:])))
+        elif OVERRIDE == record_type:
+            state.override_setpoint = struct.unpack('<d', payload)[0]
+        elif RESUME == record_type:
+            state.override_setpoint = None
+        elif PID_STATE == record_type:
+            state.pid_state = tuple(
+                _unpack_float(value) for value in struct.unpack('<dd', payload))
+        elif COEFFICIENTS == record_type:
+            state.coefficients = struct.unpack('<ddd', payload)
+
+    def start(self, snapshot_callback):
+        """
+        Opens the journal for appending and starts the periodic writes
+
+        :param snapshot_callback: Called with the journal to record the
+            complete current state when the journal is compacted
+        :type snapshot_callback: callable
+        """
+        self._snapshot_callback = snapshot_callback
+
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._file = open(self._path, 'ab')
+        if 0 == self._get_size():
+            self._file.write(MAGIC)
+
+        self._flush_periodic_handle = Scheduler.instance().periodic(
+            self.flush,
+            self._flush_interval,
+            'journal_flush')
+        self._flush_periodic_handle.start()
+
+    def stop(self):
+        """
+        Writes any buffered records and closes the journal
+        """
+        if self._flush_periodic_handle:
+            self._flush_periodic_handle.stop()
+            self._flush_periodic_handle = None
+
+        if self._file:
+            self.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def record_profile(self, profile, profile_time_start):
+        """
+        Records a new cooking profile, which also starts a new stats history
+
+        :param profile: A dictionary with numeric minute keys and temperature
+            values
+        :type profile: dict
+        :param profile_time_start: The time the profile started in seconds
+            since the epoch
+        :type profile_time_start: float
+        """
+        self._append(
+            PROFILE,
+            struct.pack('<d', profile_time_start) + json.dumps(profile).encode('utf-8'))
+
+    def record_stats(self, time_offset, stat_point):
+        """
+        Records the stats for a minute
+
+        :param time_offset: The minute offset of the stats
+        :type time_offset: int
+        :param stat_point: The recorded stats
+        :type stat_point: StatPoint
+        """
+        values = [stat_point.pit_temp, stat_point.setpoint, stat_point.blower_speed]
+        values.extend(stat_point.food_temps)
+
+        self._append(
+            STATS,
+            struct.pack('<I', time_offset) + struct.pack(
+                '<{}d'.format(len(values)),
+                *[_pack_float(value) for value in values]))
+
+    def record_override(self, setpoint):
+        """
+        Records a manual temperature override
+
+        :param setpoint: The manual temperature
+        :type setpoint: float
+        """
+        self._append(OVERRIDE, struct.pack('<d', setpoint))
+
+    def record_resume(self):
+        """
+        Records the cooking profile resuming after a manual override
+        """
+        self._append(RESUME, b'')
+
+    def record_pid_state(self, integral, last_error):
+        """
+        Records the internal state of the PID controller
+
+        :param integral: The accumulated integral error
+        :type integral: float
+        :param last_error: The error of the last PID calculation
+        :type last_error: float
+        """
+        self._append(
+            PID_STATE,
+            struct.pack('<dd', _pack_float(integral), _pack_float(last_error)))
+
+    def record_coefficients(self, p, i, d):
+        """
+        Records new PID coefficients
+
+        :param p: The P coefficient
+        :type p: float
+        :param i: The I coefficient
+        :type i: float
+        :param d: The D coefficient
+        :type d: float
+        """
+        self._append(COEFFICIENTS, struct.pack('<ddd', p, i, d))
+
+    def _append(self, record_type, payload):
+        """
+        Buffers a record to be written by the next flush
+
+        :param record_type: The record type
+        :type record_type: int
+        :param payload: The record payload
+        :type payload: bytes
+        """
+        self._buffer.append(RECORD_HEADER.pack(
+            record_type,
+            len(payload),
+            zlib.crc32(payload) & 0xffffffff))
+        self._buffer.append(payload)
+
+    def flush(self):
+        """
+        Writes the buffered records to the journal file without syncing it
+        to disk, compacting the journal first if it has grown too large
+        """
+        if not self._file:
+            return
+
+        # A snapshot alone may outgrow max_size, which would otherwise
+        # compact the journal again on every flush
+        if self._get_size() > max(self._max_size, 2 * self._snapshot_size) and self._snapshot_callback:
+            self.compact()
+            return
+
+        if not self._buffer:
+            return
+
+        self._file.write(b''.join(self._buffer))
+        self._file.flush()
+        self._buffer = []
+
+    def _get_size(self):
+        """
+        Returns the size of the journal file
+
+        :returns: The size in bytes
+        :rtype: int
+        """
+        return os.fstat(self._file.fileno()).st_size
+
+    def compact(self):
+        """
+        Replaces the journal with one holding only the current state
+        """
+        if not self._file:
+            return
+
+        self._buffer = []
+        self._snapshot_callback(self)
+
+        temp_path = '{}.tmp'.format(self._path)
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(b''.join(self._buffer))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._file.close()
+        os.rename(temp_path, self._path)
+        self._file = open(self._path, 'ab')
+        self._buffer = []
+        self._snapshot_size = self._get_size()
@@ -0,0 +1,167 @@
+# Rate, in degrees per second, the pit must fall at to count as the lid
+# opening; a fire dying down cools far slower
+OPEN_RATE = 0.5
+
+# Rate the pit must rise at again to count as the lid closing
+CLOSE_RATE = 0.0
+
+# Seconds after which an open lid is assumed closed
+MAX_OPEN_TIME = 600
+
+# Degrees below the setpoint the pit must reach to end the recovery
+RECOVERY_BAND = 5
+
+# Seconds after which the recovery ends regardless of temperature
+MAX_RECOVERY_TIME = 900
+
+class LidDetector(object):
+    """
+    Detects the lid opening from the pit temperature falling faster than a
+    fire can cool and tracks the recovery after it closes
+
+    The lid is considered closed again once the pit stops falling.  The
+    recovery lasts until the pit is back within :attr:`_recovery_band`
+    degrees of the setpoint.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    RECOVERING = 'recovering'
+
+    def __init__(
+            self,
+            open_rate=OPEN_RATE,
+            close_rate=CLOSE_RATE,
+            max_open_time=MAX_OPEN_TIME,
+            recovery_band=RECOVERY_BAND,
+            max_recovery_time=MAX_RECOVERY_TIME):
+        """
+        Initializes the detector with the lid closed
+
+        :param open_rate: The falling rate in degrees per second that signals
+            the lid opening
+        :type open_rate: float
+        :param close_rate: The rising rate in degrees per second that signals
+            the lid closing
+        :type close_rate: float
+        :param max_open_time: The seconds after which the lid is assumed
+            closed
+        :type max_open_time: float
+        :param recovery_band: The degrees below the setpoint that end the
+            recovery
+        :type recovery_band: float
+        :param max_recovery_time: The seconds after which the recovery ends
+        :type max_recovery_time: float
+        :raises: ValueError
+        """
+        if open_rate <= 0:
+            raise ValueError('Lid open rate must be positive')
+
+        self._open_rate = open_rate
+        self._close_rate = close_rate
+        self._max_open_time = max_open_time
+        self._recovery_band = recovery_band
+        self._max_recovery_time = max_recovery_time
+
+        self._state = LidDetector.CLOSED
+        self._state_time = None
+        self._last_reading = None
+        self._subscribers = []
+
+    def get_state(self):
+        """
+        Returns the state of the lid
+
+        :returns: One of :attr:`CLOSED`, :attr:`OPEN`, or :attr:`RECOVERING`
+        :rtype: str
+        """
+        return self._state
+
+    def subscribe(self, callback):
+        """
+        Calls ``callback`` with the new state and the time of the reading
+        that caused it whenever the state changes
+
+        :param callback: The function to call
+        :type callback: callable
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Stops calling ``callback`` on state changes
+
+        :param callback: The function to stop calling
+        :type callback: callable
+        """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def update(self, reading, setpoint):
+        """
+        Updates the lid state with a new probe reading
+
+        :param reading: The probe reading
+        :type reading: Reading
+        :param setpoint: The current setpoint or None
+        :type setpoint: float
+        :returns: The lid state
+        :rtype: str
+        """
+        slope = self._get_slope(reading)
+        self._last_reading = reading
+
+        if slope is None:
+            return self._state
+
+        # The wall clock can step when NTP syncs so elapsed times come from
+        # the monotonic clock
+        elapsed = reading.monotonic - self._state_time if self._state_time is not None else 0
+
+        if LidDetector.CLOSED == self._state:
+            if slope <= -self._open_rate:
+                self._set_state(LidDetector.OPEN, reading)
+        elif LidDetector.OPEN == self._state:
+            if slope >= self._close_rate or elapsed >= self._max_open_time:
+                self._set_state(LidDetector.RECOVERING, reading)
+        elif slope <= -self._open_rate:
+            self._set_state(LidDetector.OPEN, reading)
+        elif (setpoint is None or
+                reading.pit_temp >= setpoint - self._recovery_band or
+                elapsed >= self._max_recovery_time):
+            self._set_state(LidDetector.CLOSED, reading)
+
+        return self._state
+
+    def _get_slope(self, reading):
+        """
+        Returns the rate of change of the pit temperature, preferring the
+        estimate from the pit probe
+
+        :param reading: The probe reading
+        :type reading: Reading
+        :returns: The rate in degrees per second or None if it is unknown
+        :rtype: float
+        """
+        if reading.pit_slope is not None:
+            return reading.pit_slope
+
+        if self._last_reading is None or reading.monotonic <= self._last_reading.monotonic:
+            return None
+
+        return (reading.pit_temp - self._last_reading.pit_temp) / (
+            reading.monotonic - self._last_reading.monotonic)
+
+    def _set_state(self, state, reading):
+        """
+        Changes the lid state and notifies the subscribers
+
+        :param state: The new state
+        :type state: str
+        :param reading: The probe reading that changed the state
+        :type reading: Reading
+        """
+        self._state = state
+        self._state_time = reading.monotonic
+
+        for callback in list(self._subscribers):
+            callback(state, reading.time)
@@ -0,0 +1,523 @@
+import bisect
+from collections import namedtuple
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Upper bounds, in bytes, of the payload size histogram buckets
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A metric in the exposition: its name, type, help text, and a list of
+# (sample name, labels dictionary, value) samples
+Family = namedtuple('Family', ['name', 'type', 'documentation', 'samples'])
+
+class LatencyHistogram(object):
+    """
+    Histogram of operation latencies with fixed bucket boundaries
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Initializes an empty histogram
+
+        :param buckets: The sorted upper bounds of the buckets in seconds
+        :type buckets: tuple
+        """
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, latency):
+        """
+        Adds a latency to the histogram
+
+        :param latency: The latency in seconds
+        :type latency: float
+        """
+        self._counts[bisect.bisect_left(self._buckets, latency)] += 1
+        self._count += 1
+        self._sum += latency
+        self._max = max(self._max, latency)
+
+    def get_stats(self):
+        """
+        Returns the histogram contents
+
+        :returns: Dictionary with the number of observations, their sum and
+            maximum, and the count of each bucket keyed by its upper bound
+        :rtype: dict
+        """
+        return {
+            'count': self._count,
+            'sum': self._sum,
+            'max': self._max,
+            'buckets': [
+                [bound, count]
+                for bound, count in zip(list(self._buckets) + ['+Inf'], self._counts)]}
+
+    def get_samples(self, name, labels):
+        """
+        Returns the histogram as exposition samples with cumulative buckets
+
+        :param name: The metric name
+        :type name: str
+        :param labels: The labels of the histogram
+        :type labels: dict
+        :returns: List of (sample name, labels, value) tuples
+        :rtype: list
+        """
+        samples = []
+        cumulative = 0
+        for bound, count in zip(list(self._buckets) + ['+Inf'], self._counts):
+            cumulative += count
+            bucket_labels = dict(labels)
+            bucket_labels['le'] = bound
+            samples.append((name + '_bucket', bucket_labels, cumulative))
+
+        samples.append((name + '_sum', labels, self._sum))
+        samples.append((name + '_count', labels, self._count))
+        return samples
+
+class CounterValue(object):
+    """
+    Value that only goes up
+    """
+    def __init__(self):
+        """
+        Initializes the value at 0
+        """
+        self._value = 0
+
+    def inc(self, amount=1):
+        """
+        Increments the value
+
+        :param amount: The non-negative amount to add
+        :type amount: float
+        """
+        self._value += amount
+
+    def get(self):
+        """
+        Returns the value
+
+        :returns: The value
+        :rtype: float
+        """
+        return self._value
+
+    def get_samples(self, name, labels):
+        """
+        Returns the value as an exposition sample
+
+        :param name: The metric name
+        :type name: str
+        :param labels: The labels of the value
+        :type labels: dict
+        :returns: List containing one (sample name, labels, value) tuple
+        :rtype: list
+        """
+        return [(name, labels, self._value)]
+
+class GaugeValue(CounterValue):
+    """
+    Value that can go up and down
+    """
+    def set(self, value):
+        """
+        Sets the value
+
+        :param value: The new value, None if it is unknown
+        :type value: float
+        """
+        self._value = value
+
+    def dec(self, amount=1):
+        """
+        Decrements the value
+
+        :param amount: The amount to subtract
+        :type amount: float
+        """
+        self._value -= amount
+
+class Metric(object):
+    """
+    Named metric with a value for every combination of label values
+
+    A metric without labels forwards ``inc``, ``set``, ``dec``, and
+    ``observe`` to its single value.  Hot paths should keep the value
+    returned by :meth:`labels` instead of looking it up on every update.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Initializes the metric with no values
+
+        :param name: The metric name
+        :type name: str
+        :param documentation: The help text
+        :type documentation: str
+        :param labelnames: The names of the labels
+        :type labelnames: tuple
+        """
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._values = {}
+
+        # A metric without labels is exposed, at 0, before it is first used
+        if not self._labelnames:
+            self.labels()
+
+    def get_name(self):
+        """
+        Returns the metric name
+
+        :returns: The metric name
+        :rtype: str
+        """
+        return self._name
+
+    def labels(self, *labelvalues):
+        """
+        Returns the value for a combination of label values, creating it if
+        needed
+
+        :param labelvalues: A value for each label name
+        :type labelvalues: tuple
+        :returns: The value
+        :rtype: object
+        :raises: ValueError
+        """
+        value = self._values.get(labelvalues)
+        if value is None:
+            if len(labelvalues) != len(self._labelnames):
+                raise ValueError('{} takes the labels {}'.format(
+                    self._name,
+                    ', '.join(self._labelnames)))
+            value = self._values.setdefault(labelvalues, self._create_value())
+        return value
+
+    def inc(self, amount=1):
+        """
+        Increments the value of a metric without labels
+
+        :param amount: The amount to add
+        :type amount: float
+        """
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        """
+        Decrements the value of a gauge without labels
+
+        :param amount: The amount to subtract
+        :type amount: float
+        """
+        self.labels().dec(amount)
+
+    def set(self, value):
+        """
+        Sets the value of a gauge without labels
+
+        :param value: The new value
+        :type value: float
+        """
+        self.labels().set(value)
+
+    def observe(self, value):
+        """
+        Adds an observation to a histogram without labels
+
+        :param value: The observed value
+        :type value: float
+        """
+        self.labels().observe(value)
+
+    def collect(self):
+        """
+        Returns the metric for the exposition
+
+        :returns: The metric and its samples
+        :rtype: Family
+        """
+        samples = []
+        for labelvalues, value in sorted(self._values.items()):
+            samples.extend(value.get_samples(
+                self._name,
+                dict(zip(self._labelnames, labelvalues))))
+
+        return Family(self._name, self.TYPE, self._documentation, samples)
+
+    def _create_value(self):
+        """
+        Returns a new value
+
+        :returns: The value
+        :rtype: object
+        """
+        raise NotImplementedError()
+
+class Counter(Metric):
+    """
+    Metric that only goes up, e.g. a number of events
+    """
+    TYPE = 'counter'
+
+    def _create_value(self):
+        """
+        Returns a new value
+
+        :returns: The value
+        :rtype: CounterValue
+        """
+        return CounterValue()
+
+class Gauge(Metric):
+    """
+    Metric that goes up and down, e.g. a temperature
+    """
+    TYPE = 'gauge'
+
+    def _create_value(self):
+        """
+        Returns a new value
+
+        :returns: The value
+        :rtype: GaugeValue
+        """
+        return GaugeValue()
+
+class Histogram(Metric):
+    """
+    Metric that counts observations into buckets, e.g. latencies
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Initializes the metric with no values
+
+        :param name: The metric name
+        :type name: str
+        :param documentation: The help text
+        :type documentation: str
+        :param labelnames: The names of the labels
+        :type labelnames: tuple
+        :param buckets: The sorted upper bounds of the buckets
+        :type buckets: tuple
+        """
+        self._buckets = buckets
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _create_value(self):
+        """
+        Returns a new value
+
+        :returns: The value
+        :rtype: LatencyHistogram
+        """
+        return LatencyHistogram(self._buckets)
+
+class Registry(object):
+    """
+    Holds every metric and collector of the process and renders them in the
+    Prometheus text format
+
+    Metrics are plain counters updated in place; collectors are functions
+    that read statistics kept elsewhere and only run when the metrics are
+    rendered, so nothing is spent on them until someone scrapes.
+    """
+    _instance = None
+
+    def __init__(self):
+        """
+        Initializes an empty registry
+        """
+        self._metrics = {}
+        self._collectors = []
+
+    @classmethod
+    def instance(cls):
+        """
+        Returns the global registry
+
+        :returns: The global registry
+        :rtype: Registry
+        """
+        if Registry._instance is None:
+            Registry._instance = Registry()
+        return Registry._instance
+
+    def register(self, metric):
+        """
+        Adds a metric, or returns the metric already added under its name
+
+        :param metric: The metric
+        :type metric: Metric
+        :returns: The registered metric
+        :rtype: Metric
+        :raises: ValueError
+        """
+        existing = self._metrics.get(metric.get_name())
+        if existing is None:
+            self._metrics[metric.get_name()] = metric
+            return metric
+
+        if type(existing) is not type(metric):
+            raise ValueError('Metric {} is already registered as a {}'.format(
+                metric.get_name(),
+                existing.TYPE))
+
+        return existing
+
+    def add_collector(self, collector):
+        """
+        Adds a function returning a list of :class:`Family` to render
+
+        :param collector: The collector function
+        :type collector: callable
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        """
+        Removes a collector function
+
+        :param collector: The collector function
+        :type collector: callable
+        """
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format
+
+        :returns: The exposition
+        :rtype: str
+        """
+        families = [self._metrics[name].collect() for name in sorted(self._metrics)]
+        for collector in self._collectors:
+            families.extend(collector())
+
+        lines = []
+        for family in families:
+            lines.append('# HELP {} {}'.format(
+                family.name,
+                family.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE {} {}'.format(family.name, family.type))
+            for sample_name, labels, value in family.samples:
+                lines.append('{}{} {}'.format(
+                    sample_name,
+                    _format_labels(labels),
+                    _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+def counter(name, documentation, labelnames=()):
+    """
+    Returns the global counter named ``name``, creating it if needed
+
+    :param name: The metric name
+    :type name: str
+    :param documentation: The help text
+    :type documentation: str
+    :param labelnames: The names of the labels
+    :type labelnames: tuple
+    :returns: The counter
+    :rtype: Counter
+    """
+    return Registry.instance().register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()):
+    """
+    Returns the global gauge named ``name``, creating it if needed
+
+    :param name: The metric name
+    :type name: str
+    :param documentation: The help text
+    :type documentation: str
+    :param labelnames: The names of the labels
+    :type labelnames: tuple
+    :returns: The gauge
+    :rtype: Gauge
+    """
+    return Registry.instance().register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    """
+    Returns the global histogram named ``name``, creating it if needed
+
+    :param name: The metric name
+    :type name: str
+    :param documentation: The help text
+    :type documentation: str
+    :param labelnames: The names of the labels
+    :type labelnames: tuple
+    :param buckets: The sorted upper bounds of the buckets
+    :type buckets: tuple
+    :returns: The histogram
+    :rtype: Histogram
+    """
+    return Registry.instance().register(
+        Histogram(name, documentation, labelnames, buckets))
+
+def _format_labels(labels):
+    """
+    Formats a labels dictionary for the exposition
+
+    :param labels: The labels
+    :type labels: dict
+    :returns: The formatted labels or an empty string if there are none
+    :rtype: str
+    """
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            _format_label_value(labels[name]))
+        for name in sorted(labels)))
+
+def _format_label_value(value):
+    """
+    Formats and escapes a label value
+
+    :param value: The label value
+    :type value: object
+    :returns: The escaped value
+    :rtype: str
+    """
+    if isinstance(value, float):
+        value = _format_value(value)
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    """
+    Formats a sample value for the exposition
+
+    :param value: The value, None if it is unknown
+    :type value: float
+    :returns: The formatted value
+    :rtype: str
+    """
+    if value is None or value != value:
+        return 'NaN'
+
+    if isinstance(value, bool):
+        return '1' if value else '0'
+
+    if isinstance(value, float):
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+
+    return str(value)
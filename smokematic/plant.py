@@ -0,0 +1,169 @@
+import threading
+import time
+
+AMBIENT_TEMP = 70
+FOOD_START_TEMP = 40
+
+# Lumped thermal parameters; heat flows are in watts and temperatures in
+# degrees fahrenheit so thermal masses are in joules per degree fahrenheit
+PIT_THERMAL_MASS = 20000.0
+AMBIENT_LOSS = 20.0
+IDLE_HEAT = 1200.0
+BLOWER_HEAT = 8000.0
+FIRE_TIME_CONSTANT = 120.0
+FOOD_THERMAL_MASS = 15000.0
+FOOD_CONDUCTANCE = 1.0
+LID_LOSS = 300.0
+
+# The largest integration step in seconds
+MAX_STEP = 1.0
+
+class ThermalModel(object):
+    """
+    Lumped model of a smoker's pit and the food in it
+
+    The fire produces :attr:`_idle_heat` watts with the blower off plus up to
+    :attr:`_blower_heat` more with the blower at full speed, following
+    changes in airflow with a first-order lag.  The pit loses heat to the
+    ambient air, far faster while the lid is open, and to the food, which
+    heats with its own thermal mass.  The model is integrated up to the
+    current time of ``clock`` whenever it is read or the airflow changes.
+    """
+    def __init__(
+            self,
+            num_food,
+            ambient_temp=AMBIENT_TEMP,
+            food_start_temp=FOOD_START_TEMP,
+            pit_thermal_mass=PIT_THERMAL_MASS,
+            ambient_loss=AMBIENT_LOSS,
+            idle_heat=IDLE_HEAT,
+            blower_heat=BLOWER_HEAT,
+            fire_time_constant=FIRE_TIME_CONSTANT,
+            food_thermal_mass=FOOD_THERMAL_MASS,
+            food_conductance=FOOD_CONDUCTANCE,
+            lid_loss=LID_LOSS,
+            clock=time.time):
+        """
+        Initializes the model with the pit at ambient temperature and the
+        fire smouldering
+
+        :param num_food: The number of food items
+        :type num_food: int
+        :param ambient_temp: The outside air temperature
+        :type ambient_temp: float
+        :param food_start_temp: The temperature of the food when put on
+        :type food_start_temp: float
+        :param pit_thermal_mass: The heat needed to raise the pit one degree
+        :type pit_thermal_mass: float
+        :param ambient_loss: The heat lost per degree above ambient
+        :type ambient_loss: float
+        :param idle_heat: The heat of the fire with the blower off
+        :type idle_heat: float
+        :param blower_heat: The added heat of the fire with the blower at
+            full speed
+        :type blower_heat: float
+        :param fire_time_constant: The seconds the fire takes to reach 63% of
+            a change in airflow
+        :type fire_time_constant: float
+        :param food_thermal_mass: The heat needed to raise a food one degree
+        :type food_thermal_mass: float
+        :param food_conductance: The heat flowing into a food per degree it is
+            below the pit
+        :type food_conductance: float
+        :param lid_loss: The extra heat lost per degree above ambient while
+            the lid is open
+        :type lid_loss: float
+        :param clock: Returns the current time in seconds
+        :type clock: callable
+        """
+        self._ambient_temp = ambient_temp
+        self._pit_thermal_mass = pit_thermal_mass
+        self._ambient_loss = ambient_loss
+        self._idle_heat = idle_heat
+        self._blower_heat = blower_heat
+        self._fire_time_constant = fire_time_constant
+        self._food_thermal_mass = food_thermal_mass
+        self._food_conductance = food_conductance
+        self._lid_loss = lid_loss
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._last_time = clock()
+        self._airflow = 0.0
+        self._lid_open = False
+        self._fire_heat = idle_heat
+        self._pit_temp = float(ambient_temp)
+        self._food_temps = [float(food_start_temp)] * num_food
+
+    def set_airflow(self, airflow):
+        """
+        Changes the blower airflow
+
+        :param airflow: The airflow as a fraction of full speed, from 0-1
+        :type airflow: float
+        """
+        with self._lock:
+            self._advance()
+            self._airflow = min(max(airflow, 0.0), 1.0)
+
+    def set_lid_open(self, lid_open):
+        """
+        Opens or closes the lid
+
+        :param lid_open: Whether the lid is open
+        :type lid_open: bool
+        """
+        with self._lock:
+            self._advance()
+            self._lid_open = lid_open
+
+    def get_pit_temp(self):
+        """
+        Returns the current pit temperature
+
+        :returns: The pit temperature
+        :rtype: float
+        """
+        with self._lock:
+            self._advance()
+            return self._pit_temp
+
+    def get_food_temps(self):
+        """
+        Returns the current food temperatures
+
+        :returns: The food temperatures
+        :rtype: list
+        """
+        with self._lock:
+            self._advance()
+            return list(self._food_temps)
+
+    def _advance(self):
+        """
+        Integrates the model up to the current time
+        """
+        now = self._clock()
+        remaining = now - self._last_time
+        self._last_time = now
+
+        while remaining > 0:
+            step = min(remaining, MAX_STEP)
+            remaining -= step
+
+            target_heat = self._idle_heat + self._blower_heat * self._airflow
+            self._fire_heat += (
+                (target_heat - self._fire_heat) * step / self._fire_time_constant)
+
+            food_heat = 0.0
+            for i, food_temp in enumerate(self._food_temps):
+                heat = self._food_conductance * (self._pit_temp - food_temp)
+                self._food_temps[i] += heat * step / self._food_thermal_mass
+                food_heat += heat
+
+            ambient_loss = self._ambient_loss
+            if self._lid_open:
+                ambient_loss += self._lid_loss
+            ambient_heat = ambient_loss * (self._pit_temp - self._ambient_temp)
+            self._pit_temp += (
+                (self._fire_heat - ambient_heat - food_heat) * step / self._pit_thermal_mass)
@@ -1,21 +1,106 @@
+from collections import namedtuple
+import logging
 import math
+import time
 
-import Adafruit_BBIO.ADC as ADC
-import tornado.ioloop
+from smokematic import metrics
+from smokematic.estimator import EmaEstimator, create_estimator
+from smokematic.samples import SampleStore
+from smokematic.scheduler import Scheduler
+from smokematic import thermistor
 
 SAMPLE_PERIOD = 3
 
-HIGH_RESIST = 10000
 EMA_MULT = (2.0 / ((60.0 / SAMPLE_PERIOD) + 1.0))
 
+TRIM_FRACTION = 0.25
+
+READ_SECONDS = metrics.histogram(
+    'smokematic_probe_read_seconds',
+    'Time taken to read a burst of ADC samples from a probe',
+    ('pin',))
+
+TEMPERATURE = metrics.gauge(
+    'smokematic_probe_temperature_degrees',
+    'Estimated probe temperature in degrees fahrenheit',
+    ('pin',))
+
+SKIPPED_ROUNDS = metrics.counter(
+    'smokematic_probe_rounds_skipped_total',
+    'Probe sampling rounds skipped because the previous reads had not finished')
+
+FAILED_ROUNDS = metrics.counter(
+    'smokematic_probe_rounds_failed_total',
+    'Probe sampling rounds whose reads failed')
+
+def median(values):
+    """
+    Returns the median of the values
+
+    :param values: The values
+    :type values: list
+    :returns: The median
+    :rtype: float
+    """
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+
+    if len(ordered) % 2:
+        return ordered[middle]
+
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def trimmed_mean(values):
+    """
+    Returns the mean of the values after discarding :const:`TRIM_FRACTION`
+    of the values from each end
+
+    :param values: The values
+    :type values: list
+    :returns: The trimmed mean
+    :rtype: float
+    """
+    ordered = sorted(values)
+    trim = int(len(ordered) * TRIM_FRACTION)
+    kept = ordered[trim:len(ordered) - trim]
+
+    return sum(kept) / float(len(kept))
+
+REDUCERS = {
+    'median': median,
+    'trimmed_mean': trimmed_mean
+}
+
+# time is the wall clock time of the reads, for timestamps, and monotonic
+# the Scheduler's monotonic time the reads completed, for measuring intervals
+Reading = namedtuple(
+    'Reading',
+    ['time', 'pit_temp', 'food_temps', 'pit_slope', 'food_slopes', 'monotonic'])
+
 class Probe(object):
     """
     Controller for a temperature probe
     """
-    def __init__(self, probe_pin, sh_a, sh_b, sh_c):
+    def __init__(
+            self,
+            probe_pin,
+            sh_a,
+            sh_b,
+            sh_c,
+            oversample=1,
+            reducer='median',
+            table_resolution=thermistor.DEFAULT_RESOLUTION,
+            estimator=None):
         """
         Initializes the controller for a temperature probe
 
+        Every sample is a burst of ``oversample`` back-to-back ADC reads
+        reduced to a single temperature with ``reducer``, either "median" or
+        "trimmed_mean".  Reads are converted with a Steinhart-Hart lookup
+        table of ``table_resolution`` steps, or with the exact equation if
+        ``table_resolution`` is 0.  The reduced samples feed ``estimator``,
+        which produces the probe temperature.
+
         :param probe_pin: The BBB ADC pin to use, e.g. P9_39
         :type probe_pin: str
         :param sh_a: The Steinhart-Hart A coefficient
@@ -24,52 +109,383 @@ class Probe(object):
         :type sh_b: float
         :param sh_c: The Steinhart-Hart C coefficient
         :type sh_c: float
+        :param oversample: The number of ADC reads per sample
+        :type oversample: int
+        :param reducer: The name of the function reducing a burst of reads
+        :type reducer: str
+        :param table_resolution: The number of steps in the lookup table
+        :type table_resolution: int
+        :param estimator: The temperature estimator or None for an EMA of the
+            last minute
+        :type estimator: object
+        :raises: ValueError
         """
+        if oversample < 1:
+            raise ValueError('Probe must oversample at least 1 time')
+
+        if reducer not in REDUCERS:
+            raise ValueError('Probe reducer must be one of {}'.format(
+                ', '.join(sorted(REDUCERS))))
+
+        self._oversample = oversample
+        self._reducer = REDUCERS[reducer]
+
         self._sh_a = sh_a
         self._sh_b = sh_b
         self._sh_c = sh_c
 
+        if table_resolution:
+            self._table = thermistor.LookupTable(sh_a, sh_b, sh_c, table_resolution)
+            logging.info('Probe {} lookup table maximum error is {:.6f} degrees'.format(
+                probe_pin,
+                self._table.get_max_error()))
+        else:
+            self._table = None
+
         self._probe_pin = probe_pin
-        self._ema_temp = None
+        self._read_seconds = READ_SECONDS.labels(probe_pin)
+        self._temperature = TEMPERATURE.labels(probe_pin)
+        self._estimator = estimator if estimator else EmaEstimator()
         self._last_temp = None
+        self._samples = SampleStore(SAMPLE_PERIOD)
+        self._burst_noise = None
+        self._jitter = None
 
-        ADC.setup()
-
-        # Take a temperature immediately
-        self._take_temperature()
+    def get_pin(self):
+        """
+        Returns the BBB ADC pin of the probe
 
-        # Setup a periodic call every 1 second to take the temperature
-        self._periodic_temp = tornado.ioloop.PeriodicCallback(
-            self._take_temperature,
-            SAMPLE_PERIOD * 1000)
-        self._periodic_temp.start()
+        :returns: The pin, e.g. P9_39
+        :rtype: str
+        """
+        return self._probe_pin
 
     def get_temp(self):
         """
-        Returns the exponential moving average temperature from the last minute
+        Returns the estimated temperature
+
+        :returns: The estimated temperature
+        :rtype: float
+        """
+        return self._estimator.get_temp()
+
+    def get_slope(self):
+        """
+        Returns the estimated rate of change of the temperature
 
-        :returns: The EMA temperature
+        :returns: The rate in degrees per second or None if the estimator
+            does not estimate it
         :rtype: float
         """
-        return self._ema_temp
+        return self._estimator.get_slope()
 
-    def _take_temperature(self):
+    def get_noise(self):
         """
-        Takes a temperature reading from the probe
+        Returns the exponential moving averages of the standard deviation
+        within each burst of reads and of the change between reduced samples
 
-        Reads the ADC and uses the Steinhart-Hart equation to convert the read
-        voltage to degrees fahrenheit.
+        :returns: Dictionary with the burst noise and sample jitter in degrees
+        :rtype: dict
         """
-        value = ADC.read(self._probe_pin)
-        resistance = (HIGH_RESIST * value) / (1 - value)
-        log_resistance = math.log(resistance)
-        invert_temp_k = self._sh_a + self._sh_b * log_resistance + self._sh_c * math.pow(log_resistance, 3)
-        temp_k = 1 / invert_temp_k
-        temp_f = (9.0 / 5.0) * (temp_k - 273.15) + 32
+        return {
+            'burst': self._burst_noise,
+            'jitter': self._jitter}
+
+    def get_conversion_error(self):
+        """
+        Returns the maximum error of the lookup table against the exact
+        Steinhart-Hart equation
+
+        :returns: The maximum error in degrees fahrenheit
+        :rtype: float
+        """
+        return self._table.get_max_error() if self._table else 0.0
+
+    def get_sample_history(self, start_time):
+        """
+        Returns the unsmoothed temperature samples taken since ``start_time``
+        at the finest resolution still retained for that time range
+
+        :param start_time: The oldest time to return in seconds since the
+            epoch
+        :type start_time: float
+        :returns: Tuple containing the number of seconds each returned Rollup
+            covers and the list of Rollups in time order
+        :rtype: tuple
+        """
+        return self._samples.get_history(start_time)
+
+    def read_burst(self, adc):
+        """
+        Reads the ADC :attr:`_oversample` times back-to-back
+
+        This blocks on the ADC device files so it is only called from the
+        hardware I/O thread.
+
+        :param adc: The ADC module of the hardware backend
+        :type adc: Adafruit_BBIO.ADC
+        :returns: The ADC reads, from 0-1
+        :rtype: list
+        """
+        start_time = time.time()
+        values = [adc.read(self._probe_pin) for _ in range(self._oversample)]
+        self._read_seconds.observe(time.time() - start_time)
+
+        return values
+
+    def add_burst(self, timestamp, values, monotonic):
+        """
+        Converts a burst of reads to degrees fahrenheit, reduces it to a
+        single temperature, and updates the estimated temperature
+
+        As the Steinhart-Hart equation is monotonic the median temperature is
+        the temperature of the median read.
+
+        :param timestamp: The time of the reads in seconds since the epoch
+        :type timestamp: float
+        :param values: The ADC reads, from 0-1
+        :type values: list
+        :param monotonic: The Scheduler's monotonic time of the reads, which
+            the estimator measures intervals with as the wall clock can step
+        :type monotonic: float
+        """
+        temps = self._convert(values)
+        temp_f = self._reducer(temps)
+
+        burst_mean = sum(temps) / len(temps)
+        burst_noise = math.sqrt(sum((temp - burst_mean) ** 2 for temp in temps) / len(temps))
+
+        if self._burst_noise is None:
+            self._burst_noise = burst_noise
+        self._burst_noise = (burst_noise - self._burst_noise) * EMA_MULT + self._burst_noise
+
+        if self._last_temp is not None:
+            jitter = abs(temp_f - self._last_temp)
+            if self._jitter is None:
+                self._jitter = jitter
+            self._jitter = (jitter - self._jitter) * EMA_MULT + self._jitter
 
         self._last_temp = temp_f
+        self._samples.add(timestamp, temp_f)
+        self._estimator.update(monotonic, temp_f)
+        self._temperature.set(self._estimator.get_temp())
+
+    def _convert(self, values):
+        """
+        Converts a burst of read voltages to degrees fahrenheit
+
+        :param values: The ADC reads, from 0-1
+        :type values: list
+        :returns: The temperatures
+        :rtype: list
+        """
+        if self._table:
+            return self._table.convert(values)
+
+        return thermistor.convert(values, self._sh_a, self._sh_b, self._sh_c)
+
+def create_probe(probe_config):
+    """
+    Creates a Probe from its section of the configuration
+
+    :param probe_config: The probe configuration
+    :type probe_config: dict
+    :returns: The probe
+    :rtype: Probe
+    :raises: ValueError
+    """
+    return Probe(
+        probe_config['pin'],
+        probe_config['sh_a'],
+        probe_config['sh_b'],
+        probe_config['sh_c'],
+        probe_config.get('oversample', 1),
+        probe_config.get('reducer', 'median'),
+        probe_config.get('table_resolution', thermistor.DEFAULT_RESOLUTION),
+        create_estimator(probe_config.get('estimator')))
+
+class ProbeBank(object):
+    """
+    Samples every probe together on a single schedule aligned to multiples
+    of :const:`SAMPLE_PERIOD` and publishes each round as one Reading
+
+    The ADC reads of a round run as a single operation on the hardware I/O
+    thread; a round is skipped if the previous one has not finished.
+    """
+    def __init__(self, pit_probe, food_probes, hwio, adc):
+        """
+        Initializes the probe bank
+
+        :param pit_probe: The pit probe
+        :type pit_probe: Probe
+        :param food_probes: The food probes
+        :type food_probes: list
+        :param hwio: The hardware I/O queue that performs all ADC reads
+        :type hwio: HardwareIO
+        :param adc: The ADC module of the hardware backend
+        :type adc: Adafruit_BBIO.ADC
+        """
+        self._hwio = hwio
+        self._adc = adc
+        self._pit_probe = pit_probe
+        self._food_probes = list(food_probes)
+        self._probes = [pit_probe] + self._food_probes
+
+        self._subscribers = []
+        self._reading = None
+        self._periodic_sample = None
+        self._read_pending = False
+        self._skipped = 0
+
+    def get_pit_probe(self):
+        """
+        Returns the pit probe
+
+        :returns: The pit probe
+        :rtype: Probe
+        """
+        return self._pit_probe
+
+    def get_food_probes(self):
+        """
+        Returns the food probes
+
+        :returns: The food probes
+        :rtype: list
+        """
+        return self._food_probes
+
+    def get_skipped(self):
+        """
+        Returns the number of rounds skipped because the previous round's
+        reads had not finished
+
+        :returns: The number of skipped rounds
+        :rtype: int
+        """
+        return self._skipped
+
+    def get_reading(self):
+        """
+        Returns the most recent reading of every probe
+
+        :returns: The latest reading or None if nothing was sampled yet
+        :rtype: Reading
+        """
+        return self._reading
+
+    def subscribe(self, callback):
+        """
+        Calls ``callback`` with every new Reading
+
+        :param callback: The function to call
+        :type callback: callable
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Stops calling ``callback`` with new Readings
+
+        :param callback: The function to stop calling
+        :type callback: callable
+        """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        """
+        Takes a reading immediately and then starts sampling at the next
+        multiple of :const:`SAMPLE_PERIOD`
+
+        The ADC setup and first reading are done on the calling thread so a
+        reading is always available once this returns.
+        """
+        scheduler = Scheduler.instance()
+
+        self._adc.setup()
+        self._publish(self._read_all())
+
+        self._periodic_sample = scheduler.periodic(
+            self._sample,
+            SAMPLE_PERIOD,
+            'probe_sample')
+        self._periodic_sample.start(SAMPLE_PERIOD - scheduler.time() % SAMPLE_PERIOD)
+
+    def stop(self):
+        """
+        Stops sampling
+        """
+        if self._periodic_sample:
+            self._periodic_sample.stop()
+            self._periodic_sample = None
+
+    def _sample(self):
+        """
+        Queues the reads of every probe on the hardware I/O thread
+        """
+        if self._read_pending:
+            self._skipped += 1
+            SKIPPED_ROUNDS.inc()
+            logging.warning('Skipping probe readings as the previous reads have not finished')
+            return
+
+        self._read_pending = True
+        if not self._hwio.submit(
+                'adc_read',
+                self._read_all,
+                callback=self._publish,
+                error_callback=self._read_failed):
+            self._read_pending = False
+
+    def _read_all(self):
+        """
+        Reads every probe back-to-back
+
+        :returns: Tuple containing the time of the reads in seconds since the
+            epoch and the list of bursts in probe order
+        :rtype: tuple
+        """
+        timestamp = Scheduler.instance().time()
+        return (timestamp, [probe.read_burst(self._adc) for probe in self._probes])
+
+    def _read_failed(self, error):
+        """
+        Allows the next round to be read after the reads of a round failed
+
+        :param error: The exception raised by the reads
+        :type error: Exception
+        """
+        self._read_pending = False
+        FAILED_ROUNDS.inc()
+        logging.warning('Reading probes {} failed: {}'.format(
+            ', '.join(probe.get_pin() for probe in self._probes),
+            error))
+
+    def _publish(self, result):
+        """
+        Processes the reads of every probe and publishes the reading
+
+        :param result: The time of the reads and the bursts in probe order
+        :type result: tuple
+        """
+        timestamp, bursts = result
+        self._read_pending = False
+
+        # Stamped when the reads complete rather than when they were queued
+        # as a backed up hardware I/O queue can delay them
+        monotonic = Scheduler.instance().monotonic()
+
+        for probe, burst in zip(self._probes, bursts):
+            probe.add_burst(timestamp, burst, monotonic)
 
-        if not self._ema_temp:
-            self._ema_temp = temp_f
+        self._reading = Reading(
+            timestamp,
+            self._pit_probe.get_temp(),
+            [probe.get_temp() for probe in self._food_probes],
+            self._pit_probe.get_slope(),
+            [probe.get_slope() for probe in self._food_probes],
+            monotonic)
 
-        self._ema_temp = (self._last_temp - self._ema_temp) * EMA_MULT + self._ema_temp
+        for callback in list(self._subscribers):
+            callback(self._reading)
@@ -0,0 +1,268 @@
+from array import array
+from collections import namedtuple
+
+RAW_RETENTION = 60 * 60
+MINUTE_RETENTION = 24 * 60 * 60
+FIVE_MINUTE_RETENTION = 7 * 24 * 60 * 60
+
+Rollup = namedtuple('Rollup', ['time', 'min', 'max', 'mean'])
+
+class RollupRing(object):
+    """
+    Fixed-capacity ring buffer of time-ordered rollups
+    """
+    def __init__(self, capacity):
+        """
+        Initializes the ring buffer
+
+        :param capacity: The maximum number of rollups retained
+        :type capacity: int
+        """
+        self._capacity = capacity
+        self._times = array('d', [0]) * capacity
+        self._mins = array('d', [0]) * capacity
+        self._maxes = array('d', [0]) * capacity
+        self._means = array('d', [0]) * capacity
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def append(self, rollup):
+        """
+        Adds a rollup newer than every retained rollup, overwriting the oldest
+        rollup once full
+
+        :param rollup: The rollup to add
+        :type rollup: Rollup
+        """
+        index = self._count % self._capacity
+
+        self._times[index] = rollup.time
+        self._mins[index] = rollup.min
+        self._maxes[index] = rollup.max
+        self._means[index] = rollup.mean
+
+        self._count += 1
+
+    def get_oldest_time(self):
+        """
+        Returns the time of the oldest retained rollup
+
+        :returns: The oldest time or None if the ring is empty
+        :rtype: float
+        """
+        if not self._count:
+            return None
+
+        return self._times[self._index(0)]
+
+    def covers(self, start_time):
+        """
+        Returns whether every rollup since ``start_time`` is still retained
+
+        :param start_time: The oldest time of interest
+        :type start_time: float
+        :returns: Whether no rollups since ``start_time`` were overwritten
+        :rtype: bool
+        """
+        return self._count <= self._capacity or self.get_oldest_time() <= start_time
+
+    def get_since(self, start_time):
+        """
+        Returns the retained rollups at or after ``start_time``
+
+        :param start_time: The oldest time to return
+        :type start_time: float
+        :returns: List of rollups in time order
+        :rtype: list
+        """
+        # Binary search for the first rollup at or after start_time
+        low = 0
+        high = len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._times[self._index(middle)] < start_time:
+                low = middle + 1
+            else:
+                high = middle
+
+        rollups = []
+        for position in range(low, len(self)):
+            index = self._index(position)
+            rollups.append(Rollup(
+                self._times[index],
+                self._mins[index],
+                self._maxes[index],
+                self._means[index]))
+
+        return rollups
+
+    def _index(self, position):
+        """
+        Converts a position counted from the oldest rollup to an array index
+
+        :param position: The position from the oldest rollup
+        :type position: int
+        :returns: The index into the arrays
+        :rtype: int
+        """
+        return (max(0, self._count - self._capacity) + position) % self._capacity
+
+class RollupTier(object):
+    """
+    Rolls values up into fixed-length periods as they arrive and retains a
+    fixed number of periods
+    """
+    def __init__(self, period, retention):
+        """
+        Initializes the tier
+
+        :param period: The length of each rollup in seconds
+        :type period: int
+        :param retention: The number of seconds of rollups to retain
+        :type retention: int
+        """
+        self._period = period
+        self._rollups = RollupRing(retention // period)
+
+        # The rollup in progress as [start time, min, max, sum, count]
+        self._pending = None
+
+    def get_period(self):
+        """
+        Returns the length of each rollup
+
+        :returns: The rollup length in seconds
+        :rtype: int
+        """
+        return self._period
+
+    def covers(self, start_time):
+        """
+        Returns whether every rollup since ``start_time`` is still retained
+
+        :param start_time: The oldest time of interest
+        :type start_time: float
+        :returns: Whether no rollups since ``start_time`` were overwritten
+        :rtype: bool
+        """
+        return self._rollups.covers(start_time)
+
+    def add(self, timestamp, low, high, total, count):
+        """
+        Adds ``count`` values summing to ``total`` within ``low`` and
+        ``high`` to the rollup for ``timestamp``
+
+        :param timestamp: The time of the values in seconds since the epoch
+        :type timestamp: float
+        :param low: The lowest value
+        :type low: float
+        :param high: The highest value
+        :type high: float
+        :param total: The sum of the values
+        :type total: float
+        :param count: The number of values
+        :type count: int
+        :returns: The previous rollup as [start time, min, max, sum, count]
+            if this value completed it, otherwise None
+        :rtype: list
+        """
+        period_start = timestamp - timestamp % self._period
+        completed = None
+
+        if self._pending and self._pending[0] != period_start:
+            completed = self._pending
+            self._rollups.append(Rollup(
+                completed[0],
+                completed[1],
+                completed[2],
+                completed[3] / completed[4]))
+            self._pending = None
+
+        if self._pending:
+            self._pending[1] = min(self._pending[1], low)
+            self._pending[2] = max(self._pending[2], high)
+            self._pending[3] += total
+            self._pending[4] += count
+        else:
+            self._pending = [period_start, low, high, total, count]
+
+        return completed
+
+    def get_since(self, start_time):
+        """
+        Returns the rollups at or after ``start_time``, including the rollup
+        still in progress
+
+        :param start_time: The oldest time to return
+        :type start_time: float
+        :returns: List of rollups in time order
+        :rtype: list
+        """
+        rollups = self._rollups.get_since(start_time)
+
+        if self._pending and self._pending[0] >= start_time:
+            rollups.append(Rollup(
+                self._pending[0],
+                self._pending[1],
+                self._pending[2],
+                self._pending[3] / self._pending[4]))
+
+        return rollups
+
+class SampleStore(object):
+    """
+    Tiered store of temperature samples
+
+    Raw samples are kept for :const:`RAW_RETENTION` seconds, one minute
+    min/max/mean rollups for :const:`MINUTE_RETENTION` seconds, and five
+    minute rollups for :const:`FIVE_MINUTE_RETENTION` seconds.  Rollups are
+    updated as each sample arrives and every tier has a fixed size.
+    """
+    def __init__(self, sample_period):
+        """
+        Initializes the sample store
+
+        :param sample_period: The number of seconds between samples
+        :type sample_period: float
+        """
+        self._sample_period = sample_period
+        self._raw = RollupRing(int(RAW_RETENTION // sample_period))
+        self._minutes = RollupTier(60, MINUTE_RETENTION)
+        self._five_minutes = RollupTier(5 * 60, FIVE_MINUTE_RETENTION)
+
+    def add(self, timestamp, value):
+        """
+        Adds a sample to every tier
+
+        :param timestamp: The time of the sample in seconds since the epoch
+        :type timestamp: float
+        :param value: The sample value
+        :type value: float
+        """
+        self._raw.append(Rollup(timestamp, value, value, value))
+
+        completed = self._minutes.add(timestamp, value, value, value, 1)
+        if completed:
+            self._five_minutes.add(*completed)
+
+    def get_history(self, start_time):
+        """
+        Returns the samples since ``start_time`` from the finest tier that
+        still covers that time
+
+        :param start_time: The oldest time to return in seconds since the
+            epoch
+        :type start_time: float
+        :returns: Tuple containing the number of seconds each returned rollup
+            covers and the list of rollups in time order
+        :rtype: tuple
+        """
+        if self._raw.covers(start_time):
+            return (self._sample_period, self._raw.get_since(start_time))
+
+        if self._minutes.covers(start_time):
+            return (self._minutes.get_period(), self._minutes.get_since(start_time))
+
+        return (self._five_minutes.get_period(), self._five_minutes.get_since(start_time))
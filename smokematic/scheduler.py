@@ -0,0 +1,532 @@
+import functools
+import heapq
+import logging
+import time
+
+import tornado.ioloop
+
+from smokematic.metrics import Family
+
+# Seconds past its deadline a periodic call must run to count as late
+LATE_THRESHOLD = 0.1
+
+class Scheduler(object):
+    """
+    Runs timed callbacks for every subsystem
+
+    All timers go through :meth:`instance` so the IOLoop can be swapped for a
+    :class:`VirtualScheduler` that runs the same callbacks against a virtual
+    clock.  Deadlines are kept on a monotonic clock so setting the wall clock,
+    e.g. when the BBB first syncs with NTP, doesn't shift them.  The scheduler
+    tracks every pending callback and running periodic task so
+    :meth:`shutdown` can stop them all, and keeps deadline statistics for
+    each periodic task by name.
+    """
+    _instance = None
+
+    def __init__(self):
+        """
+        Initializes the scheduler with nothing scheduled
+        """
+        # Pending callbacks keyed by the id of their handle
+        self._pending = {}
+        self._tasks = set()
+        self._task_stats = {}
+
+    @classmethod
+    def instance(cls):
+        """
+        Returns the global scheduler, creating an :class:`IOLoopScheduler` if
+        none was installed
+
+        :returns: The global scheduler
+        :rtype: Scheduler
+        """
+        if Scheduler._instance is None:
+            Scheduler._instance = IOLoopScheduler()
+        return Scheduler._instance
+
+    @classmethod
+    def install(cls, scheduler):
+        """
+        Makes ``scheduler`` the global scheduler
+
+        :param scheduler: The scheduler to install
+        :type scheduler: Scheduler
+        """
+        Scheduler._instance = scheduler
+
+    def time(self):
+        """
+        Returns the current time, for timestamps
+
+        :returns: The current time in seconds since the epoch
+        :rtype: float
+        """
+        raise NotImplementedError()
+
+    def monotonic(self):
+        """
+        Returns the time of the clock deadlines are kept on, which never goes
+        backwards
+
+        :returns: The time in seconds since an arbitrary point
+        :rtype: float
+        """
+        raise NotImplementedError()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Calls ``callback(*args)`` after ``delay`` seconds
+
+        :param delay: The delay in seconds
+        :type delay: float
+        :param callback: The function to call
+        :type callback: callable
+        :returns: A handle that can be passed to :meth:`cancel`
+        :rtype: object
+        """
+        return self.call_at(self.monotonic() + delay, callback, *args)
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Calls ``callback(*args)`` once the monotonic clock reaches
+        ``deadline``
+
+        :param deadline: The time from :meth:`monotonic` to call at
+        :type deadline: float
+        :param callback: The function to call
+        :type callback: callable
+        :returns: A handle that can be passed to :meth:`cancel`
+        :rtype: object
+        """
+        call = [callback, args, None]
+        call[2] = self._add_timer(deadline, functools.partial(self._run_call, call))
+        self._pending[id(call)] = call
+        return call
+
+    def cancel(self, handle):
+        """
+        Cancels a callback scheduled by :meth:`call_later` or :meth:`call_at`
+
+        :param handle: The handle returned when the callback was scheduled
+        :type handle: object
+        """
+        if self._pending.pop(id(handle), None) is not None:
+            self._remove_timer(handle[2])
+
+    def periodic(self, callback, interval, name=None):
+        """
+        Returns a stopped task that calls ``callback`` every ``interval``
+        seconds once started
+
+        :param callback: The function to call
+        :type callback: callable
+        :param interval: The number of seconds between calls
+        :type interval: float
+        :param name: The name the task's deadline statistics are kept under,
+            defaults to the name of ``callback``
+        :type name: str
+        :returns: The periodic task
+        :rtype: PeriodicTask
+        """
+        if name is None:
+            name = getattr(callback, '__name__', 'periodic')
+
+        if name not in self._task_stats:
+            self._task_stats[name] = DeadlineStats()
+
+        return PeriodicTask(self, callback, interval, self._task_stats[name])
+
+    def get_stats(self):
+        """
+        Returns the deadline statistics of every periodic task that was
+        created
+
+        :returns: Dictionary with task name keys and values of the
+            :meth:`DeadlineStats.get_stats` dictionaries
+        :rtype: dict
+        """
+        return {name: stats.get_stats() for name, stats in self._task_stats.items()}
+
+    def collect_metrics(self):
+        """
+        Returns the deadline statistics and pending callbacks as metrics
+
+        :returns: List of the metrics
+        :rtype: list
+        """
+        stats = self.get_stats()
+        families = [
+            Family(
+                'smokematic_scheduler_pending_callbacks',
+                'gauge',
+                'Callbacks waiting to run',
+                [('smokematic_scheduler_pending_callbacks', {}, len(self._pending))])]
+
+        for key, metric_type, documentation in (
+                ('runs', 'counter', 'Calls of each periodic task'),
+                ('late', 'counter', 'Periodic task calls later than {} seconds'.format(LATE_THRESHOLD)),
+                ('missed', 'counter', 'Periodic task calls skipped as they were missed entirely'),
+                ('mean_lateness', 'gauge', 'Mean seconds periodic task calls ran after their deadline'),
+                ('max_lateness', 'gauge', 'Most seconds a periodic task call ran after its deadline')):
+            name = 'smokematic_scheduler_task_{}{}'.format(
+                key.replace('lateness', 'lateness_seconds'),
+                '_total' if 'counter' == metric_type else '')
+            families.append(Family(
+                name,
+                metric_type,
+                documentation,
+                [(name, {'task': task}, stats[task][key]) for task in sorted(stats)]))
+
+        return families
+
+    def get_pending_count(self):
+        """
+        Returns the number of callbacks waiting to run, including the next
+        call of every running periodic task
+
+        :returns: The number of pending callbacks
+        :rtype: int
+        """
+        return len(self._pending)
+
+    def shutdown(self):
+        """
+        Stops every periodic task and cancels every pending callback
+        """
+        logging.info('Stopping {} periodic tasks and {} pending callbacks'.format(
+            len(self._tasks),
+            len(self._pending) - len(self._tasks)))
+
+        for task in list(self._tasks):
+            task.stop()
+
+        for call in list(self._pending.values()):
+            self.cancel(call)
+
+    def _run_call(self, call):
+        """
+        Runs a scheduled callback that is due
+
+        :param call: The handle of the callback
+        :type call: list
+        """
+        del self._pending[id(call)]
+        call[0](*call[1])
+
+    def _add_timer(self, deadline, callback):
+        """
+        Arranges for ``callback`` to be called at ``deadline``
+
+        :param deadline: The time from :meth:`monotonic` to call at
+        :type deadline: float
+        :param callback: The function to call
+        :type callback: callable
+        :returns: The timer handle
+        :rtype: object
+        """
+        raise NotImplementedError()
+
+    def _remove_timer(self, timer):
+        """
+        Removes a timer added by :meth:`_add_timer`
+
+        :param timer: The timer handle
+        :type timer: object
+        """
+        raise NotImplementedError()
+
+class DeadlineStats(object):
+    """
+    Statistics of how late the calls of a periodic task ran
+    """
+    def __init__(self):
+        """
+        Initializes empty statistics
+        """
+        self._interval = None
+        self._runs = 0
+        self._late = 0
+        self._missed = 0
+        self._total_lateness = 0.0
+        self._max_lateness = 0.0
+
+    def set_interval(self, interval):
+        """
+        Sets the interval of the task
+
+        :param interval: The number of seconds between calls
+        :type interval: float
+        """
+        self._interval = interval
+
+    def record_run(self, lateness):
+        """
+        Records a call
+
+        :param lateness: The seconds the call ran after its deadline
+        :type lateness: float
+        """
+        self._runs += 1
+        self._total_lateness += lateness
+        self._max_lateness = max(self._max_lateness, lateness)
+        if lateness > LATE_THRESHOLD:
+            self._late += 1
+
+    def record_missed(self, missed):
+        """
+        Records calls skipped because they were missed entirely
+
+        :param missed: The number of skipped calls
+        :type missed: int
+        """
+        self._missed += missed
+
+    def get_stats(self):
+        """
+        Returns the statistics
+
+        :returns: Dictionary containing the task interval, the number of
+            calls, of calls later than :const:`LATE_THRESHOLD`, and of skipped
+            calls, and the mean and maximum lateness in seconds
+        :rtype: dict
+        """
+        return {
+            'interval': self._interval,
+            'runs': self._runs,
+            'late': self._late,
+            'missed': self._missed,
+            'mean_lateness': self._total_lateness / self._runs if self._runs else 0.0,
+            'max_lateness': self._max_lateness}
+
+class PeriodicTask(object):
+    """
+    Calls a function on a fixed interval, skipping any calls that were
+    missed entirely
+
+    Every deadline is a whole number of intervals after the first one so
+    late calls don't push the following ones back.
+    """
+    def __init__(self, scheduler, callback, interval, stats):
+        """
+        Initializes the task without starting it
+
+        :param scheduler: The scheduler that runs the task
+        :type scheduler: Scheduler
+        :param callback: The function to call
+        :type callback: callable
+        :param interval: The number of seconds between calls
+        :type interval: float
+        :param stats: The statistics the calls are recorded in
+        :type stats: DeadlineStats
+        :raises: ValueError
+        """
+        if interval <= 0:
+            raise ValueError('Periodic interval must be positive')
+
+        self._scheduler = scheduler
+        self._callback = callback
+        self._interval = interval
+        self._stats = stats
+        self._stats.set_interval(interval)
+        self._handle = None
+        self._next_time = None
+
+    def start(self, delay=None):
+        """
+        Starts the task
+
+        :param delay: The seconds until the first call, defaults to the
+            interval
+        :type delay: float
+        """
+        if self._handle:
+            return
+
+        if delay is None:
+            delay = self._interval
+
+        self._next_time = self._scheduler.monotonic() + delay
+        self._scheduler._tasks.add(self)
+        self._schedule()
+
+    def stop(self):
+        """
+        Stops the task
+        """
+        if self._handle:
+            self._scheduler.cancel(self._handle)
+            self._handle = None
+            self._scheduler._tasks.discard(self)
+
+    def is_running(self):
+        """
+        Returns whether the task is started
+
+        :returns: Whether the task is started
+        :rtype: bool
+        """
+        return self._handle is not None
+
+    def _schedule(self):
+        """
+        Schedules the next call
+        """
+        self._handle = self._scheduler.call_at(self._next_time, self._run)
+
+    def _run(self):
+        """
+        Calls the function and schedules the next call
+        """
+        handle = self._handle
+        self._stats.record_run(max(0.0, self._scheduler.monotonic() - self._next_time))
+
+        try:
+            self._callback()
+        finally:
+            # The callback may have stopped or restarted the task
+            if self._handle is handle:
+                now = self._scheduler.monotonic()
+                self._next_time += self._interval
+                if self._next_time <= now:
+                    missed = int((now - self._next_time) // self._interval) + 1
+                    self._next_time += missed * self._interval
+                    self._stats.record_missed(missed)
+                self._schedule()
+
+class IOLoopScheduler(Scheduler):
+    """
+    Scheduler that runs callbacks on the Tornado IOLoop in real time
+    """
+    def time(self):
+        """
+        Returns the wall clock time
+
+        :returns: The current time in seconds since the epoch
+        :rtype: float
+        """
+        return time.time()
+
+    def monotonic(self):
+        """
+        Returns the IOLoop's time, which is monotonic where Python provides
+        a monotonic clock
+
+        :returns: The IOLoop time in seconds
+        :rtype: float
+        """
+        return tornado.ioloop.IOLoop.instance().time()
+
+    def _add_timer(self, deadline, callback):
+        """
+        Adds a timeout to the IOLoop
+
+        :param deadline: The IOLoop time to call at
+        :type deadline: float
+        :param callback: The function to call
+        :type callback: callable
+        :returns: The IOLoop timeout handle
+        :rtype: object
+        """
+        return tornado.ioloop.IOLoop.instance().call_at(deadline, callback)
+
+    def _remove_timer(self, timer):
+        """
+        Removes a timeout from the IOLoop
+
+        :param timer: The IOLoop timeout handle
+        :type timer: object
+        """
+        tornado.ioloop.IOLoop.instance().remove_timeout(timer)
+
+class VirtualScheduler(Scheduler):
+    """
+    Scheduler with a virtual clock that only moves when :meth:`run_until` runs
+    the callbacks in deadline order, as fast as they can execute
+    """
+    def __init__(self, start_time=0.0):
+        """
+        Initializes the scheduler
+
+        :param start_time: The initial virtual time in seconds since the epoch
+        :type start_time: float
+        """
+        super(VirtualScheduler, self).__init__()
+        self._now = float(start_time)
+        self._queue = []
+        self._sequence = 0
+        self._callback_count = 0
+
+    def time(self):
+        """
+        Returns the virtual time
+
+        :returns: The virtual time in seconds since the epoch
+        :rtype: float
+        """
+        return self._now
+
+    def monotonic(self):
+        """
+        Returns the virtual time, which only moves forwards
+
+        :returns: The virtual time in seconds since the epoch
+        :rtype: float
+        """
+        return self._now
+
+    def get_callback_count(self):
+        """
+        Returns the number of callbacks run so far
+
+        :returns: The number of callbacks run
+        :rtype: int
+        """
+        return self._callback_count
+
+    def run_until(self, end_time):
+        """
+        Runs every callback due up to ``end_time`` and then moves the clock
+        to ``end_time``
+
+        :param end_time: The virtual time to run until
+        :type end_time: float
+        """
+        while self._queue and self._queue[0][0] <= end_time:
+            deadline, _, callback = heapq.heappop(self._queue)
+            if callback is None:
+                continue
+
+            self._now = deadline
+            self._callback_count += 1
+            callback()
+
+        self._now = max(self._now, end_time)
+
+    def _add_timer(self, deadline, callback):
+        """
+        Queues a callback
+
+        :param deadline: The virtual time to call at
+        :type deadline: float
+        :param callback: The function to call
+        :type callback: callable
+        :returns: The queue entry
+        :rtype: list
+        """
+        # Entries are [deadline, sequence, callback]; removing clears the
+        # callback so the entry is skipped when it comes up
+        self._sequence += 1
+        entry = [max(self._now, deadline), self._sequence, callback]
+        heapq.heappush(self._queue, entry)
+        return entry
+
+    def _remove_timer(self, timer):
+        """
+        Marks a queued callback so it is skipped
+
+        :param timer: The queue entry
+        :type timer: list
+        """
+        timer[2] = None
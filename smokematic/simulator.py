@@ -0,0 +1,318 @@
+import argparse
+import json
+import logging
+import pkg_resources
+import random
+import time
+
+from smokematic.baster import Baster
+from smokematic.blower import Blower
+from smokematic.controller import Controller
+from smokematic.hardware import SimulatedBackend
+from smokematic.hwio import HardwareIO
+from smokematic.lid import LidDetector
+from smokematic.probe import ProbeBank, create_probe
+from smokematic.scheduler import Scheduler, VirtualScheduler
+
+# Seconds between recorded simulation points
+RECORD_INTERVAL = 10
+
+# Degrees from the setpoint the pit must stay within to count as settled
+SETTLE_TOLERANCE = 5
+
+DEFAULT_DURATION = 12 * 60
+
+def simulate(
+        config,
+        profile,
+        duration=DEFAULT_DURATION,
+        coefficients=None,
+        lid_openings=(),
+        feed_forward=None,
+        baste=None,
+        seed=None):
+    """
+    Runs a cook on the simulated smoker with a virtual clock, as fast as the
+    scheduled callbacks can run
+
+    The Blower, Baster, ProbeBank, and Controller are the same classes used
+    by the web application; only the hardware backend and the scheduler
+    differ.
+    The simulation's VirtualScheduler stays installed as the global
+    Scheduler afterwards.
+
+    :param config: The smokematic configuration
+    :type config: dict
+    :param profile: A dictionary with numeric minute keys and temperature
+        values
+    :type profile: dict
+    :param duration: The length of the cook in minutes
+    :type duration: float
+    :param coefficients: The P, I, and D coefficients or None to use the
+        configured ones
+    :type coefficients: tuple
+    :param lid_openings: Tuples of the minute offset the lid opens at and
+        the number of seconds it stays open
+    :type lid_openings: list
+    :param feed_forward: Whether to use model feed-forward or None to use the
+        configured setting
+    :type feed_forward: bool
+    :param baste: The baste frequency in minutes and duration in seconds or
+        None to leave the baster off
+    :type baste: tuple
+    :param seed: The seed of the probe noise or None to pick one at random;
+        the same seed and arguments always simulate the same cook
+    :type seed: int
+    :returns: Tuple containing the report from :func:`analyze` and the list
+        of recorded points, each containing the minute offset, true pit
+        temperature, setpoint, and blower speed
+    :rtype: tuple
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+
+    scheduler = VirtualScheduler()
+    Scheduler.install(scheduler)
+
+    backend = SimulatedBackend(config, clock=scheduler.time, rng=random.Random(seed))
+    model = backend.get_model()
+    hwio = HardwareIO(inline=True)
+
+    blower = Blower(config['blower']['pin'], hwio, backend.PWM)
+    baster = Baster(config['baster']['pin'], hwio, backend.GPIO)
+    if baste:
+        baster.config(*baste)
+    probe_bank = ProbeBank(
+        create_probe(config['pit_probe']),
+        [create_probe(food_probe) for food_probe in config['food_probes']],
+        hwio,
+        backend.ADC)
+    probe_bank.start()
+
+    if coefficients is None:
+        coefficients = (
+            config['pid_coefficients']['k_p'],
+            config['pid_coefficients']['k_i'],
+            config['pid_coefficients']['k_d'])
+
+    controller = Controller(blower, probe_bank)
+    controller.set_pid_coefficients(*coefficients)
+    if 'pid' in config:
+        controller.set_pid_timing(
+            config['pid']['interval'],
+            config['pid']['derivative_filter'])
+
+    feed_forward_config = dict(config.get('feed_forward', {'enabled': False}))
+    if feed_forward is not None:
+        feed_forward_config['enabled'] = feed_forward
+    controller.set_feed_forward(**feed_forward_config)
+
+    lid_events = []
+    if 'lid' in config:
+        lid_detector = LidDetector(**config['lid'])
+        lid_detector.subscribe(
+            lambda state, timestamp: lid_events.append((timestamp / 60, state)))
+        controller.set_lid_detector(lid_detector)
+
+    for minute, seconds in lid_openings:
+        scheduler.call_later(minute * 60, model.set_lid_open, True)
+        scheduler.call_later(minute * 60 + seconds, model.set_lid_open, False)
+
+    controller.set_profile(profile)
+
+    points = []
+
+    def record():
+        points.append((
+            scheduler.time() / 60,
+            model.get_pit_temp(),
+            controller.get_setpoint(),
+            blower.get_speed()))
+
+    record()
+    recorder = scheduler.periodic(record, RECORD_INTERVAL)
+    recorder.start()
+
+    scheduler.run_until(duration * 60)
+
+    report = analyze(points, profile, duration)
+    report['lid_events'] = lid_events
+    report['plant_model'] = controller.get_plant_model()
+    report['baste'] = baster.get_settings()
+    report['seed'] = seed
+
+    return (report, points)
+
+def analyze(points, profile, duration):
+    """
+    Measures how well the pit followed each step of the profile
+
+    For every step the overshoot is the furthest the pit went past the
+    setpoint in the direction of the step and the settling time is the time
+    until the pit stayed within :const:`SETTLE_TOLERANCE` degrees of the
+    setpoint, or None if it never did.
+
+    :param points: The recorded simulation points
+    :type points: list
+    :param profile: The cooking profile
+    :type profile: dict
+    :param duration: The length of the cook in minutes
+    :type duration: float
+    :returns: Dictionary containing the overall blower duty and a list of
+        per-step results
+    :rtype: dict
+    """
+    step_times = sorted(t for t in profile.keys() if t < duration)
+    steps = []
+
+    for i, step_time in enumerate(step_times):
+        end_time = step_times[i + 1] if i + 1 < len(step_times) else duration
+        setpoint = profile[step_time]
+        step_points = [point for point in points if step_time <= point[0] < end_time]
+        if not step_points:
+            continue
+
+        # Falling steps overshoot below the setpoint
+        direction = 1 if step_points[0][1] <= setpoint else -1
+
+        overshoot = max(
+            0,
+            max(direction * (pit_temp - setpoint) for _, pit_temp, _, _ in step_points))
+
+        settling_time = None
+        for offset, pit_temp, _, _ in step_points:
+            if abs(pit_temp - setpoint) > SETTLE_TOLERANCE:
+                settling_time = None
+            elif settling_time is None:
+                settling_time = offset - step_time
+
+        steps.append({
+            'time': step_time,
+            'setpoint': setpoint,
+            'overshoot': overshoot,
+            'settling_time': settling_time,
+            'blower_duty': _mean([speed for _, _, _, speed in step_points])})
+
+    return {
+        'duration': duration,
+        'blower_duty': _mean([speed for _, _, _, speed in points]),
+        'steps': steps}
+
+def _mean(values):
+    """
+    Returns the mean of a list of values
+
+    :param values: The values
+    :type values: list
+    :returns: The mean or None if there are no values
+    :rtype: float
+    """
+    return float(sum(values)) / len(values) if values else None
+
+def entry():
+    """
+    Runs a simulated cook from the command line and prints its report
+    """
+    parser = argparse.ArgumentParser(
+        description='Simulate a cook faster than real time')
+    parser.add_argument(
+        'config',
+        nargs='?',
+        help='Path to the configuration file, defaults to the skeleton config')
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=DEFAULT_DURATION,
+        help='Length of the cook in minutes')
+    parser.add_argument(
+        '--profile',
+        help='JSON object of minute:temperature pairs, defaults to the initial setpoint')
+    parser.add_argument(
+        '--pid',
+        type=float,
+        nargs=3,
+        metavar=('P', 'I', 'D'),
+        help='PID coefficients, defaults to the configured ones')
+    parser.add_argument(
+        '--lid',
+        action='append',
+        default=[],
+        metavar='MINUTE:SECONDS',
+        help='Open the lid at a minute offset for a number of seconds, may be repeated')
+    parser.add_argument(
+        '--feed-forward',
+        action='store_true',
+        default=None,
+        help='Use model feed-forward on setpoint changes')
+    parser.add_argument(
+        '--baste',
+        metavar='MINUTES:SECONDS',
+        help='Baste for a number of seconds every number of minutes')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Seed of the probe noise, defaults to a random one')
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the report as JSON')
+    args = parser.parse_args()
+
+    config_filename = args.config or pkg_resources.resource_filename(
+        __name__,
+        '/skel/config.json')
+    with open(config_filename) as f:
+        config = json.load(f)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.profile:
+        profile = {float(k): v for k, v in json.loads(args.profile).items()}
+    else:
+        profile = {0: config['initial_setpoint']}
+
+    lid_openings = [
+        tuple(float(value) for value in opening.split(':')) for opening in args.lid]
+    baste = tuple(float(value) for value in args.baste.split(':')) if args.baste else None
+
+    start_time = time.time()
+    report, _ = simulate(
+        config,
+        profile,
+        args.duration,
+        args.pid,
+        lid_openings,
+        args.feed_forward,
+        baste,
+        args.seed)
+    elapsed = time.time() - start_time
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+
+    print('Simulated {:.0f} minutes in {:.2f} seconds ({:.0f}x real time)'.format(
+        args.duration,
+        elapsed,
+        args.duration * 60 / elapsed))
+    print('Noise seed: {}'.format(report['seed']))
+    print('Overall blower duty: {:.1f}%'.format(report['blower_duty']))
+    for step in report['steps']:
+        print('{:>7.1f} min {:>5.0f}F: overshoot {:.1f}F, settling time {}, blower duty {:.1f}%'.format(
+            step['time'],
+            step['setpoint'],
+            step['overshoot'],
+            'never' if step['settling_time'] is None else '{:.1f} min'.format(
+                step['settling_time']),
+            step['blower_duty']))
+    if report['baste'][0]:
+        print('Basted for {1:.0f}s every {0:.0f} minutes'.format(*report['baste']))
+    for minute, state in report['lid_events']:
+        print('{:>7.1f} min lid {}'.format(minute, state))
+    if report['plant_model']:
+        print('Pit model: {gain:.2f}F per % blower, {time_constant:.0f}s time constant, '
+              '{dead_time:.0f}s dead time, {bias:.0f}F with the blower off'.format(
+                  **report['plant_model']))
+
+if '__main__' == __name__:
+    entry()
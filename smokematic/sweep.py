@@ -0,0 +1,293 @@
+import argparse
+import json
+import pkg_resources
+import time
+
+import numpy
+
+from smokematic.controller import DERIVATIVE_FILTER, INTEGRAL_DECAY, PID_INTERVAL
+from smokematic.fopdt import STATS_INTERVAL, fit_fopdt
+from smokematic.journal import Journal
+
+# Number of values tried for each coefficient by default
+DEFAULT_STEPS = 20
+
+# Factor the default ranges extend below and above the configured
+# coefficients
+DEFAULT_SPAN = 4.0
+
+DEFAULT_TOP = 10
+
+METRICS = ('overshoot', 'iae', 'wear')
+
+def sweep(
+        model,
+        setpoints,
+        start_temp,
+        coefficients,
+        interval=PID_INTERVAL,
+        derivative_filter=DERIVATIVE_FILTER):
+    """
+    Replays a cook against a pit model for every set of PID coefficients at
+    once
+
+    Each coefficient set gets its own PID, with the same control law and
+    anti-windup as :class:`smokematic.controller.Pid` using the filtered
+    error derivative, driving its own copy of the model.  All of them are
+    stepped together as NumPy arrays.
+
+    :param model: The pit model
+    :type model: FopdtModel
+    :param setpoints: The setpoint of every recorded minute, None where it is
+        unknown
+    :type setpoints: list
+    :param start_temp: The pit temperature at the start of the cook
+    :type start_temp: float
+    :param coefficients: Array with a row of P, I, and D coefficients per set
+    :type coefficients: numpy.ndarray
+    :param interval: The number of seconds between PID calculations
+    :type interval: float
+    :param derivative_filter: The time constant in seconds of the
+        derivative low-pass filter
+    :type derivative_filter: float
+    :returns: Dictionary of arrays with a value per coefficient set of the
+        largest overshoot past a setpoint in degrees, the integrated absolute
+        error in degree-minutes, and the blower wear as the total change in
+        blower speed
+    :rtype: dict
+    """
+    parameters = model.get_parameters()
+    alpha = 1 - numpy.exp(-interval / parameters['time_constant'])
+    delay = int(round(parameters['dead_time'] / float(interval)))
+    decay = INTEGRAL_DECAY ** (interval / 60.0)
+    weight = interval / (derivative_filter + interval)
+
+    k_p, k_i, k_d = (numpy.asarray(column, dtype=float) for column in numpy.transpose(coefficients))
+    count = len(k_p)
+
+    temp = numpy.full(count, float(start_temp))
+    blower = numpy.zeros(count)
+    ci = numpy.zeros(count)
+    derivative = numpy.zeros(count)
+    last_error = None
+    direction = numpy.ones(count)
+
+    # The blower speeds still on their way through the dead time
+    pending = numpy.zeros((delay + 1, count))
+
+    overshoot = numpy.zeros(count)
+    iae = numpy.zeros(count)
+    wear = numpy.zeros(count)
+
+    setpoint = None
+    steps = int(len(setpoints) * STATS_INTERVAL / interval)
+    for step in range(steps):
+        recorded = setpoints[int(step * interval / STATS_INTERVAL)]
+        if recorded is None:
+            recorded = setpoint
+        if recorded is None:
+            continue
+
+        if recorded != setpoint:
+            # A new setpoint resets the PID like Pid.set_setpoint does
+            setpoint = recorded
+            ci[:] = 0
+            derivative[:] = 0
+            last_error = None
+            direction = numpy.where(temp <= setpoint, 1.0, -1.0)
+
+        error = setpoint - temp
+
+        ci = numpy.where(temp >= setpoint, ci * decay, ci)
+        p_part = k_p * error
+
+        # Anti-windup check
+        ci += numpy.where(
+            ((error > 0) & (blower < 100)) | ((error < 0) & (blower > 0)),
+            error * interval,
+            0)
+        i_part = k_i * ci
+
+        if last_error is not None:
+            derivative += ((error - last_error) / interval - derivative) * weight
+            d_part = k_d * derivative
+        else:
+            d_part = 0
+        last_error = error
+
+        speed = numpy.floor(numpy.clip(p_part + i_part + d_part, 0, 100))
+        wear += numpy.abs(speed - blower)
+        blower = speed
+
+        pending[step % (delay + 1)] = blower
+        delayed = pending[(step + 1) % (delay + 1)]
+        temp += (parameters['bias'] + parameters['gain'] * delayed - temp) * alpha
+
+        overshoot = numpy.maximum(overshoot, direction * (temp - setpoint))
+        iae += numpy.abs(setpoint - temp) * interval / 60.0
+
+    return {'overshoot': overshoot, 'iae': iae, 'wear': wear}
+
+def rank(results, weights=(1, 1, 1)):
+    """
+    Orders coefficient sets by their weighted rank in each metric
+
+    :param results: The metrics returned by :func:`sweep`
+    :type results: dict
+    :param weights: The weights of the overshoot, integrated absolute error,
+        and blower wear ranks
+    :type weights: tuple
+    :returns: The indices of the coefficient sets, best first
+    :rtype: numpy.ndarray
+    """
+    score = numpy.zeros(len(results[METRICS[0]]))
+    for metric, metric_weight in zip(METRICS, weights):
+        score += metric_weight * numpy.argsort(numpy.argsort(results[metric], kind='mergesort'))
+
+    return numpy.argsort(score, kind='mergesort')
+
+def _coefficient_range(values, default):
+    """
+    Returns the values of one coefficient to try
+
+    :param values: The minimum, maximum, and number of values or None
+    :type values: list
+    :param default: The configured coefficient the default range is around
+    :type default: float
+    :returns: The geometrically spaced values
+    :rtype: numpy.ndarray
+    """
+    if values is None:
+        values = (default / DEFAULT_SPAN, default * DEFAULT_SPAN, DEFAULT_STEPS)
+
+    return numpy.geomspace(values[0], values[1], int(values[2]))
+
+def entry():
+    """
+    Sweeps PID coefficients over a journaled cook from the command line and
+    prints the best ones
+    """
+    parser = argparse.ArgumentParser(
+        description='Find the PID coefficients that would have done best on a recorded cook')
+    parser.add_argument('journal', help='Path to the journal of the recorded cook')
+    parser.add_argument(
+        'config',
+        nargs='?',
+        help='Path to the configuration file, defaults to the skeleton config')
+    for name in ('p', 'i', 'd'):
+        parser.add_argument(
+            '--{}'.format(name),
+            type=float,
+            nargs=3,
+            metavar=('MIN', 'MAX', 'COUNT'),
+            help='{} coefficients to try, defaults to {} values from 1/{:.0f} to {:.0f}x the configured one'.format(
+                name.upper(),
+                DEFAULT_STEPS,
+                DEFAULT_SPAN,
+                DEFAULT_SPAN))
+    parser.add_argument(
+        '--weights',
+        type=float,
+        nargs=3,
+        default=(1, 1, 1),
+        metavar=('OVERSHOOT', 'IAE', 'WEAR'),
+        help='Weights of the overshoot, integrated absolute error, and blower wear ranks')
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=DEFAULT_TOP,
+        help='Number of coefficient sets to print')
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the results as JSON')
+    args = parser.parse_args()
+
+    config_filename = args.config or pkg_resources.resource_filename(
+        __name__,
+        '/skel/config.json')
+    with open(config_filename) as f:
+        config = json.load(f)
+
+    state = Journal(args.journal).replay()
+    if state is None or not state.stat_points:
+        parser.error('{} holds no recorded cook'.format(args.journal))
+
+    try:
+        model = fit_fopdt(state.stat_points)
+    except ValueError as e:
+        parser.error('Could not fit a pit model: {}'.format(e))
+
+    configured = state.coefficients or (
+        config['pid_coefficients']['k_p'],
+        config['pid_coefficients']['k_i'],
+        config['pid_coefficients']['k_d'])
+
+    grids = numpy.meshgrid(
+        _coefficient_range(args.p, configured[0]),
+        _coefficient_range(args.i, configured[1]),
+        _coefficient_range(args.d, configured[2]),
+        indexing='ij')
+    coefficients = numpy.vstack([
+        numpy.array([configured]),
+        numpy.column_stack([grid.ravel() for grid in grids])])
+
+    pid_config = config.get('pid', {})
+
+    start_time = time.time()
+    results = sweep(
+        model,
+        [stat_point.setpoint for _, stat_point in state.stat_points],
+        next(
+            stat_point.pit_temp for _, stat_point in state.stat_points
+            if stat_point.pit_temp is not None),
+        coefficients,
+        pid_config.get('interval', PID_INTERVAL),
+        pid_config.get('derivative_filter', DERIVATIVE_FILTER))
+    elapsed = time.time() - start_time
+
+    def describe(index):
+        row = {
+            'p': coefficients[index][0],
+            'i': coefficients[index][1],
+            'd': coefficients[index][2]}
+        for metric in METRICS:
+            row[metric] = results[metric][index]
+        return row
+
+    order = rank(results, args.weights)
+    best = [describe(index) for index in order[:args.top]]
+
+    if args.json:
+        print(json.dumps(
+            {
+                'plant_model': model.get_parameters(),
+                'configured': describe(0),
+                'best': best},
+            indent=4))
+        return
+
+    print('Pit model: {gain:.2f}F per % blower, {time_constant:.0f}s time constant, '
+          '{dead_time:.0f}s dead time, {bias:.0f}F with the blower off'.format(
+              **model.get_parameters()))
+    print('Replayed {} minutes with {} coefficient sets in {:.2f} seconds'.format(
+        len(state.stat_points),
+        len(coefficients),
+        elapsed))
+
+    row_format = '{:>10} {:>10.4g} {:>10.4g} {:>10.4g} {:>9.1f}F {:>10.0f} {:>10.0f}'
+    print('{:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        '', 'P', 'I', 'D', 'Overshoot', 'IAE', 'Wear'))
+    for label, row in [('configured', describe(0))] + [
+            ('#{}'.format(position + 1), row) for position, row in enumerate(best)]:
+        print(row_format.format(
+            label,
+            row['p'],
+            row['i'],
+            row['d'],
+            row['overshoot'],
+            row['iae'],
+            row['wear']))
+
+if '__main__' == __name__:
+    entry()
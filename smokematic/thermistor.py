@@ -0,0 +1,189 @@
+from array import array
+import math
+
+HIGH_RESIST = 10000
+
+DEFAULT_RESOLUTION = 4096
+
+# Range of temperatures, in degrees fahrenheit, the table error is reported for
+ERROR_MIN_TEMP = 32
+ERROR_MAX_TEMP = 600
+
+def convert(values, sh_a, sh_b, sh_c):
+    """
+    Uses the Steinhart-Hart equation to convert read voltages to degrees
+    fahrenheit
+
+    :param values: The ADC reads, from 0-1
+    :type values: list
+    :param sh_a: The Steinhart-Hart A coefficient
+    :type sh_a: float
+    :param sh_b: The Steinhart-Hart B coefficient
+    :type sh_b: float
+    :param sh_c: The Steinhart-Hart C coefficient
+    :type sh_c: float
+    :returns: The temperatures
+    :rtype: list
+    """
+    log = math.log
+
+    temps = []
+    for value in values:
+        log_resistance = log((HIGH_RESIST * value) / (1 - value))
+        temp_k = 1 / (sh_a + sh_b * log_resistance + sh_c * log_resistance ** 3)
+        temps.append((9.0 / 5.0) * (temp_k - 273.15) + 32)
+
+    return temps
+
+def to_read(temp, sh_a, sh_b, sh_c):
+    """
+    Inverts the Steinhart-Hart equation to find the ADC read of a temperature
+
+    :param temp: The temperature in degrees fahrenheit
+    :type temp: float
+    :param sh_a: The Steinhart-Hart A coefficient
+    :type sh_a: float
+    :param sh_b: The Steinhart-Hart B coefficient
+    :type sh_b: float
+    :param sh_c: The Steinhart-Hart C coefficient
+    :type sh_c: float
+    :returns: The ADC read, from 0-1
+    :rtype: float
+    """
+    temp_k = (temp - 32) * (5.0 / 9.0) + 273.15
+
+    # Solves sh_c * x^3 + sh_b * x + (sh_a - 1 / temp_k) = 0 for the log of
+    # the resistance, which has a single real root as both B and C are positive
+    p = sh_b / sh_c
+    q = (sh_a - 1 / temp_k) / sh_c
+    root = math.sqrt(q * q / 4 + p ** 3 / 27)
+    log_resistance = _cbrt(-q / 2 + root) + _cbrt(-q / 2 - root)
+
+    resistance = math.exp(log_resistance)
+    return resistance / (HIGH_RESIST + resistance)
+
+def _cbrt(value):
+    """
+    Returns the real cube root of a value
+
+    :param value: The value
+    :type value: float
+    :returns: The cube root
+    :rtype: float
+    """
+    return math.copysign(abs(value) ** (1.0 / 3), value)
+
+class LookupTable(object):
+    """
+    Converts ADC reads to degrees fahrenheit by linearly interpolating a
+    table of the Steinhart-Hart equation evaluated at ``resolution`` evenly
+    spaced reads
+
+    Reads outside of the table, i.e. within one step of 0 or 1, use the
+    exact equation.  The largest difference from the exact equation for
+    temperatures between :const:`ERROR_MIN_TEMP` and :const:`ERROR_MAX_TEMP`
+    is measured when the table is built; with the default resolution and the
+    skeleton config probes it is below 0.02 degrees.
+    """
+    def __init__(self, sh_a, sh_b, sh_c, resolution=DEFAULT_RESOLUTION):
+        """
+        Builds the lookup table
+
+        :param sh_a: The Steinhart-Hart A coefficient
+        :type sh_a: float
+        :param sh_b: The Steinhart-Hart B coefficient
+        :type sh_b: float
+        :param sh_c: The Steinhart-Hart C coefficient
+        :type sh_c: float
+        :param resolution: The number of table steps between reads of 0 and 1
+        :type resolution: int
+        :raises: ValueError
+        """
+        if resolution < 4:
+            raise ValueError('Lookup table resolution must be at least 4')
+
+        self._sh_a = sh_a
+        self._sh_b = sh_b
+        self._sh_c = sh_c
+        self._resolution = resolution
+
+        # Reads of exactly 0 and 1 have no temperature so pad the ends
+        self._table = array('d', [0.0])
+        self._table.extend(convert(
+            [float(i) / resolution for i in range(1, resolution)],
+            sh_a,
+            sh_b,
+            sh_c))
+        self._table.append(0.0)
+
+        # Slope to the next entry so an interpolation is a single multiply-add
+        self._slopes = array(
+            'd',
+            [self._table[i + 1] - self._table[i] for i in range(resolution)])
+        self._slopes.append(0.0)
+
+        self._max_error = self._measure_error()
+
+    def get_max_error(self):
+        """
+        Returns the largest measured difference from the exact equation for
+        temperatures between :const:`ERROR_MIN_TEMP` and
+        :const:`ERROR_MAX_TEMP`
+
+        :returns: The maximum error in degrees fahrenheit
+        :rtype: float
+        """
+        return self._max_error
+
+    def convert(self, values):
+        """
+        Converts read voltages to degrees fahrenheit
+
+        :param values: The ADC reads, from 0-1
+        :type values: list
+        :returns: The temperatures
+        :rtype: list
+        """
+        table = self._table
+        slopes = self._slopes
+        resolution = self._resolution
+        last_index = resolution - 2
+
+        temps = []
+        append = temps.append
+        for value in values:
+            position = value * resolution
+            index = int(position)
+
+            if 1 <= index <= last_index:
+                append(table[index] + slopes[index] * (position - index))
+            else:
+                temps.extend(convert([value], self._sh_a, self._sh_b, self._sh_c))
+
+        return temps
+
+    def _measure_error(self):
+        """
+        Compares the interpolated and exact temperatures between every pair
+        of table entries within the reported temperature range
+
+        :returns: The maximum error in degrees fahrenheit
+        :rtype: float
+        """
+        fractions = (0.25, 0.5, 0.75)
+        values = []
+
+        for index in range(1, self._resolution - 1):
+            low = self._table[index]
+            high = self._table[index + 1]
+            if ERROR_MIN_TEMP <= min(low, high) and max(low, high) <= ERROR_MAX_TEMP:
+                values.extend(
+                    (index + fraction) / self._resolution for fraction in fractions)
+
+        if not values:
+            return 0.0
+
+        exact = convert(values, self._sh_a, self._sh_b, self._sh_c)
+        return max(
+            abs(interpolated - expected)
+            for interpolated, expected in zip(self.convert(values), exact))
@@ -0,0 +1,282 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import tornado.ioloop
+
+from smokematic import metrics
+from smokematic.probe import SAMPLE_PERIOD
+from smokematic.scheduler import Scheduler
+
+# Seconds between IOLoop heartbeats
+HEARTBEAT_INTERVAL = 0.25
+
+# Seconds the IOLoop may go without a heartbeat before its stack is logged
+STALL_THRESHOLD = 1.0
+
+# Seconds the IOLoop or the probe readings may stall before the blower is
+# forced off
+FAILSAFE_TIMEOUT = 30.0
+
+LAG_SECONDS = metrics.histogram(
+    'smokematic_ioloop_lag_seconds',
+    'Time IOLoop heartbeats ran after they were due')
+
+STALLS = metrics.counter(
+    'smokematic_ioloop_stalls_total',
+    'IOLoop stalls longer than the stall threshold')
+
+FAILSAFE_TRIPS = metrics.counter(
+    'smokematic_watchdog_failsafe_trips_total',
+    'Times the watchdog forced the blower off')
+
+# time.monotonic only exists on Python 3
+_clock = getattr(time, 'monotonic', time.time)
+
+class LoopWatchdog(object):
+    """
+    Measures IOLoop lag with a heartbeat and checks it, along with the probe
+    readings that drive the PID, from a separate thread
+
+    When the IOLoop misses heartbeats for :attr:`_stall_threshold` seconds
+    the thread logs the IOLoop thread's stack, showing the callback that is
+    blocking it.  When the IOLoop or the probe readings stall for
+    :attr:`_failsafe_timeout` seconds the PID can no longer control the pit,
+    so the thread writes the blower off straight to the PWM, bypassing the
+    IOLoop and the hardware I/O queue, and keeps it off until both recover.
+    It also has the Controller hold the blower off on the IOLoop so the PID,
+    an auto-tune experiment, or the "low speed" pulses of a still running
+    IOLoop don't turn it back on.
+    """
+    def __init__(
+            self,
+            controller,
+            blower,
+            probe_bank,
+            stall_threshold=STALL_THRESHOLD,
+            failsafe_timeout=FAILSAFE_TIMEOUT,
+            heartbeat_interval=HEARTBEAT_INTERVAL):
+        """
+        Initializes the watchdog without starting it
+
+        :param controller: The Controller driving the blower
+        :type controller: Controller
+        :param blower: The blower to force off
+        :type blower: Blower
+        :param probe_bank: The ProbeBank whose readings drive the PID
+        :type probe_bank: ProbeBank
+        :param stall_threshold: The seconds without a heartbeat before the
+            IOLoop stack is logged
+        :type stall_threshold: float
+        :param failsafe_timeout: The seconds without a heartbeat or probe
+            reading before the blower is forced off, longer than
+            :const:`smokematic.probe.SAMPLE_PERIOD`
+        :type failsafe_timeout: float
+        :param heartbeat_interval: The seconds between heartbeats
+        :type heartbeat_interval: float
+        :raises: ValueError
+        """
+        if not 0 < heartbeat_interval < stall_threshold <= failsafe_timeout:
+            raise ValueError('Watchdog heartbeat interval must be below the stall threshold and the stall threshold at most the failsafe timeout')
+
+        if failsafe_timeout <= SAMPLE_PERIOD:
+            raise ValueError('Watchdog failsafe timeout must be longer than the {} second probe sample period'.format(SAMPLE_PERIOD))
+
+        self._controller = controller
+        self._blower = blower
+        self._probe_bank = probe_bank
+        self._stall_threshold = stall_threshold
+        self._failsafe_timeout = failsafe_timeout
+        self._heartbeat_interval = heartbeat_interval
+
+        self._lock = threading.Lock()
+        self._last_beat = None
+        self._last_reading = None
+        self._stalled = False
+        self._tripped = False
+
+        self._loop_thread_id = None
+        self._io_loop = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._heartbeat = None
+
+        self._max_lag = 0.0
+        self._last_lag = 0.0
+        self._stall_count = 0
+        self._trip_count = 0
+
+    def start(self):
+        """
+        Starts the heartbeat and the watchdog thread; must be called on the
+        IOLoop thread
+        """
+        if self._thread:
+            return
+
+        now = _clock()
+        self._last_beat = now
+        self._last_reading = now
+        self._loop_thread_id = threading.current_thread().ident
+        self._io_loop = tornado.ioloop.IOLoop.current()
+
+        self._probe_bank.subscribe(self._on_reading)
+        self._heartbeat = Scheduler.instance().periodic(
+            self._beat,
+            self._heartbeat_interval,
+            'watchdog_heartbeat')
+        self._heartbeat.start()
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name='smokematic-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the heartbeat and the watchdog thread
+        """
+        if not self._thread:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+        self._heartbeat.stop()
+        self._probe_bank.unsubscribe(self._on_reading)
+
+    def get_stats(self):
+        """
+        Returns the IOLoop lag statistics
+
+        :returns: Dictionary containing the last and maximum heartbeat lag in
+            seconds, the number of stalls and fail-safe trips, and whether the
+            fail-safe is holding the blower off
+        :rtype: dict
+        """
+        return {
+            'last_lag': self._last_lag,
+            'max_lag': self._max_lag,
+            'stalls': self._stall_count,
+            'failsafe_trips': self._trip_count,
+            'tripped': self._tripped}
+
+    def collect_metrics(self):
+        """
+        Returns the lag statistics kept outside the metric registry
+
+        :returns: List of the metrics
+        :rtype: list
+        """
+        return [
+            metrics.Family(
+                'smokematic_ioloop_lag_seconds_max',
+                'gauge',
+                'Longest time an IOLoop heartbeat ran after it was due',
+                [('smokematic_ioloop_lag_seconds_max', {}, self._max_lag)]),
+            metrics.Family(
+                'smokematic_watchdog_failsafe_active',
+                'gauge',
+                'Whether the watchdog is holding the blower off',
+                [('smokematic_watchdog_failsafe_active', {}, self._tripped)])]
+
+    def _on_reading(self, reading):
+        """
+        Records that the probe readings are flowing
+
+        :param reading: The new probe reading
+        :type reading: Reading
+        """
+        self._last_reading = _clock()
+
+    def _beat(self):
+        """
+        Records the IOLoop lag and hands the blower back once the IOLoop and
+        probe readings have recovered
+        """
+        now = _clock()
+        lag = max(0.0, now - self._last_beat - self._heartbeat_interval)
+        self._last_beat = now
+
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+        LAG_SECONDS.observe(lag)
+
+        if not self._tripped or now - self._last_reading >= self._failsafe_timeout:
+            return
+
+        with self._lock:
+            self._tripped = False
+
+        logging.warning('IOLoop and probe readings recovered, returning the blower to the PID')
+        self._controller.release_blower()
+
+    def _hold_blower_off(self):
+        """
+        Has the Controller hold the blower off unless the control loop
+        recovered before this ran
+        """
+        if self._tripped:
+            self._controller.hold_blower_off()
+
+    def _watch(self):
+        """
+        Checks the heartbeat and probe readings until stopped
+        """
+        while not self._stop_event.wait(self._heartbeat_interval):
+            now = _clock()
+            beat_age = now - self._last_beat
+            reading_age = now - self._last_reading
+
+            if beat_age >= self._stall_threshold:
+                if not self._stalled:
+                    self._stalled = True
+                    self._stall_count += 1
+                    STALLS.inc()
+                    logging.warning('IOLoop blocked for {:.1f} seconds in:\n{}'.format(
+                        beat_age,
+                        self._get_loop_stack()))
+            elif self._stalled:
+                self._stalled = False
+                logging.warning('IOLoop unblocked')
+
+            if max(beat_age, reading_age) >= self._failsafe_timeout:
+                with self._lock:
+                    if not self._tripped:
+                        self._tripped = True
+                        self._trip_count += 1
+                        FAILSAFE_TRIPS.inc()
+                        logging.critical(
+                            'Control loop stalled ({:.1f}s since IOLoop heartbeat, {:.1f}s since probe reading), forcing the blower off'.format(
+                                beat_age,
+                                reading_age))
+                        self._io_loop.add_callback(self._hold_blower_off)
+
+                    # Writes queued before the stall may still turn the
+                    # blower back on so it is forced off on every check
+                    self._force_blower_off()
+
+    def _force_blower_off(self):
+        """
+        Writes the blower off straight to the PWM
+        """
+        try:
+            self._blower.write_failsafe()
+        except Exception as e:
+            logging.error('Watchdog could not turn the blower off: {}'.format(e))
+
+    def _get_loop_stack(self):
+        """
+        Returns the current stack of the IOLoop thread
+
+        :returns: The formatted stack
+        :rtype: str
+        """
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return '(IOLoop thread not found)'
+
+        return ''.join(traceback.format_stack(frame))
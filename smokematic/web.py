@@ -1,31 +1,111 @@
+import datetime
+import itertools
 import json
 import logging
 import os.path
+import signal
+import time
 
+import tornado
+import tornado.gen
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
 
+from smokematic import metrics
 from smokematic.baster import Baster
 from smokematic.blower import Blower
-from smokematic.probe import Probe
+from smokematic.broadcaster import STALL_TIMEOUT, SendQueue, StatusBroadcaster, encode_message
+from smokematic.probe import ProbeBank, create_probe
 from smokematic.controller import Controller
+from smokematic.encoding import ENCODINGS
+from smokematic.hardware import create_backend
+from smokematic.hwio import HardwareIO
+from smokematic.journal import Journal
+from smokematic.lid import LidDetector
+from smokematic.scheduler import Scheduler
+from smokematic.watchdog import LoopWatchdog
+
+HISTORY_CHUNK_SIZE = 120
+
+# Deflate level of HTTP responses and WebSocket messages; benchmarks/
+# compression.py shows level 1 gets most of the savings of higher levels
+# for a fraction of the CPU
+COMPRESSION_LEVEL = 1
+
+# Smallest HTTP response body, in bytes, worth compressing
+GZIP_MIN_LENGTH = 1024
+
+REQUEST_SECONDS = metrics.histogram(
+    'smokematic_http_request_seconds',
+    'Time taken to handle HTTP requests',
+    ('handler', 'method'))
+
+RESPONSES = metrics.counter(
+    'smokematic_http_responses_total',
+    'HTTP responses sent',
+    ('handler', 'code'))
+
+JSON_ENCODE_SECONDS = metrics.histogram(
+    'smokematic_http_json_encode_seconds',
+    'Time spent serializing JSON responses',
+    ('handler',))
+
+JSON_BYTES = metrics.histogram(
+    'smokematic_http_json_bytes',
+    'Size of serialized JSON responses',
+    ('handler',),
+    metrics.SIZE_BUCKETS)
 
 class StatusWebSocket(tornado.websocket.WebSocketHandler):
     """
     WebSocket that feeds status data to the remote web client
+
+    A reconnecting client may pass the ``session`` and ``since`` query
+    arguments from its last received history message to only receive the
+    data points recorded after ``since``.  A client doing a full sync may
+    pass the ``points`` query argument to receive a downsampled history of
+    at most that many data points.  A client may pass ``encoding=binary`` to
+    receive every message as a binary frame in the compact encoding of
+    :mod:`smokematic.encoding` instead of JSON.
     """
+    _connection_ids = itertools.count(1)
+
     def open(self):
         """
-        Sets up the periodic status sending and also sends all data points
-        collected this execution
+        Sends the data points collected this execution, or only those the
+        client is missing, and then subscribes to the shared status broadcast
         """
-        self._update_handle = tornado.ioloop.PeriodicCallback(
-            self.send_update_info,
-            5000
-        )
-        self._update_handle.start()
-        self.send_full_info()
+        controller = self.application.settings['controller']
+
+        self._encoding = self.get_argument('encoding', 'json')
+        if self._encoding not in ENCODINGS:
+            self._encoding = 'json'
+
+        self._send_queue = SendQueue(
+            self,
+            '{}-{}'.format(self.request.remote_ip, next(self._connection_ids)),
+            'binary' == self._encoding)
+
+        try:
+            session = int(self.get_argument('session'))
+            since = int(self.get_argument('since'))
+        except (tornado.web.MissingArgumentError, ValueError):
+            session = None
+            since = None
+
+        if session is None or session != controller.get_history_session():
+            since = None
+
+        try:
+            max_points = int(self.get_argument('points'))
+        except (tornado.web.MissingArgumentError, ValueError):
+            max_points = None
+
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            self.send_history,
+            since,
+            max_points)
 
     def on_message(self, message):
         """
@@ -33,46 +113,160 @@ class StatusWebSocket(tornado.websocket.WebSocketHandler):
         """
         pass
 
-    def send_full_info(self):
+    def get_compression_options(self):
         """
-        Sends all collected data points to initialize the client
+        Negotiates permessage-deflate with JSON clients when it is enabled;
+        binary messages barely compress so binary clients do without it
+
+        :returns: The compression options or None to disable compression
+        :rtype: dict
         """
-        controller = self.application.settings['controller']
-        stat_points = controller.get_stat_history(1)
+        if 'binary' == self.get_argument('encoding', 'json'):
+            return None
 
-        initial_message_data = {}
+        return self.application.settings['websocket_compression']
+
+    def get_encoding(self):
+        """
+        Returns the encoding the client asked for
 
-        for time_offset, data in stat_points.items():
-            initial_message_data[time_offset] = {
-                'pit_temp': data.pit_temp,
-                'food_temp': data.food_temps,
-                'setpoint': data.setpoint,
-                'blower_speed': data.blower_speed}
+        :returns: The encoding from :const:`smokematic.encoding.ENCODINGS`
+        :rtype: str
+        """
+        return self._encoding
 
-        self.write_message({
-            'type': 'initial',
-            'data': initial_message_data})
+    def get_send_queue(self):
+        """
+        Returns the queue of broadcast messages waiting to be sent
 
-    def send_update_info(self):
+        :returns: The queue of the client
+        :rtype: SendQueue
         """
-        Gets called periodically to send a data snapshot to the client
+        return self._send_queue
+
+    @tornado.gen.coroutine
+    def send_history(self, since, max_points=None):
         """
-        self.write_message({
-            'type': 'update',
-            'data': {
-                'pit_temp': self.application.settings['probes']['pit'].get_temp(),
-                'food_temp': [probe.get_temp() for probe in self.application.settings['probes']['food']],
-                'setpoint': self.application.settings['controller'].get_setpoint(),
-                'food_alarms': self.application.settings['food_alarms'],
-                'blower_speed': self.application.settings['blower'].get_speed()}})
+        Sends the collected data points in chunks of at most
+        :const:`HISTORY_CHUNK_SIZE` points, waiting for the client to accept
+        each chunk before the next, and then subscribes to the shared status
+        broadcast
+
+        :param since: The last minute offset the client has or None to send
+            every data point and have the client reset its history
+        :type since: int
+        :param max_points: The maximum number of data points to send when
+            resetting the client history, or None to send every data point
+        :type max_points: int
+        """
+        controller = self.application.settings['controller']
+        session = controller.get_history_session()
+        latest = controller.get_latest_offset()
+
+        if since is None and max_points:
+            try:
+                stat_points = controller.get_downsampled_history(max_points)
+            except ValueError:
+                stat_points = controller.get_stat_history(1)
+        elif since is None:
+            stat_points = controller.get_stat_history(1)
+        else:
+            stat_points = controller.get_stat_history_since(since)
+
+        time_offsets = sorted(stat_points.keys(), key=int)
+        message_type = 'initial' if since is None else 'history'
+
+        try:
+            chunk_start = 0
+            while True:
+                chunk_offsets = time_offsets[chunk_start:chunk_start + HISTORY_CHUNK_SIZE]
+                chunk_start += HISTORY_CHUNK_SIZE
+
+                message_data = {}
+                for time_offset in chunk_offsets:
+                    data = stat_points[time_offset]
+                    message_data[time_offset] = {
+                        'pit_temp': data.pit_temp,
+                        'food_temp': data.food_temps,
+                        'setpoint': data.setpoint,
+                        'blower_speed': data.blower_speed}
+
+                more = chunk_start < len(time_offsets)
+                yield tornado.gen.with_timeout(
+                    datetime.timedelta(seconds=STALL_TIMEOUT),
+                    self.write_message(
+                        encode_message(
+                            {
+                                'type': message_type,
+                                'session': session,
+                                'latest': latest,
+                                'more': more,
+                                'data': message_data},
+                            self._encoding),
+                        'binary' == self._encoding))
+
+                if not more:
+                    break
+
+                # Later chunks only append to the history the client has
+                message_type = 'history'
+        except tornado.websocket.WebSocketClosedError:
+            return
+        except tornado.gen.TimeoutError:
+            self._send_queue.drop('stalled')
+            return
+
+        self.application.settings['broadcaster'].subscribe(self)
 
     def on_close(self):
         """
-        Stops the periodic callback
+        Unsubscribes from the shared status broadcast
+        """
+        self.application.settings['broadcaster'].unsubscribe(self)
+
+class InstrumentedHandler(tornado.web.RequestHandler):
+    """
+    RequestHandler that records its request times, response codes, and the
+    time spent serializing its JSON responses
+    """
+    def encode_json(self, data):
+        """
+        Serializes a response to JSON, recording the time taken and its size
+
+        :param data: The response data
+        :type data: object
+        :returns: The serialized response
+        :rtype: str
+        """
+        start_time = time.time()
+        encoded = json.dumps(data)
+        handler = type(self).__name__
+        JSON_ENCODE_SECONDS.labels(handler).observe(time.time() - start_time)
+        JSON_BYTES.labels(handler).observe(len(encoded))
+
+        return encoded
+
+    def on_finish(self):
+        """
+        Records the request time and response code
         """
-        self._update_handle.stop()
+        handler = type(self).__name__
+        REQUEST_SECONDS.labels(handler, self.request.method).observe(
+            self.request.request_time())
+        RESPONSES.labels(handler, str(self.get_status())).inc()
 
-class AlarmsHandler(tornado.web.RequestHandler):
+class MetricsHandler(InstrumentedHandler):
+    """
+    RequestHandler that exposes the metrics in the Prometheus text format
+    """
+    def get(self):
+        """
+        Sends every metric
+        """
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.finish(metrics.Registry.instance().render())
+
+class AlarmsHandler(InstrumentedHandler):
     """
     RequestHandler that handles all operations related to the food item alarms
     """
@@ -82,7 +276,7 @@ class AlarmsHandler(tornado.web.RequestHandler):
         """
         self.content_type = 'application/json'
         self.finish('{}\n'.format(
-            json.dumps(
+            self.encode_json(
                 {
                     'status': 'success',
                     'data': {
@@ -120,9 +314,9 @@ class AlarmsHandler(tornado.web.RequestHandler):
             self.set_status(400)
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
-class BasteHandler(tornado.web.RequestHandler):
+class BasteHandler(InstrumentedHandler):
     """
     RequestHandler that handles all operations related to the basting/mopping
     """
@@ -135,7 +329,7 @@ class BasteHandler(tornado.web.RequestHandler):
 
         self.content_type = 'application/json'
         self.finish('{}\n'.format(
-            json.dumps(
+            self.encode_json(
                 {
                     'status': 'success',
                     'data': {
@@ -183,9 +377,9 @@ class BasteHandler(tornado.web.RequestHandler):
             self.set_status(400)
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
-class OverrideHandler(tornado.web.RequestHandler):
+class OverrideHandler(InstrumentedHandler):
     """
     RequestHandler that handles all operations related to the manual
     temperature override
@@ -199,7 +393,7 @@ class OverrideHandler(tornado.web.RequestHandler):
         override_status = controller.get_state() == Controller.OVERRIDE
         self.content_type = 'application/json'
         self.finish('{}\n'.format(
-            json.dumps(
+            self.encode_json(
                 {
                     'status': 'success',
                     'data': {
@@ -245,7 +439,7 @@ class OverrideHandler(tornado.web.RequestHandler):
             self.set_status(400)
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
     def delete(self):
         """
@@ -268,16 +462,17 @@ class OverrideHandler(tornado.web.RequestHandler):
             }
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
-class ProfileHandler(tornado.web.RequestHandler):
+class ProfileHandler(InstrumentedHandler):
     """
     RequestHandler that handles all operations related to the cooking profiles
     """
     def get(self):
         """
         Generates and sends a cooking profile generated off of observed pit
-        conditions sampled every 5 minutes
+        conditions sampled every 5 minutes, or downsampled to at most the
+        number of data points in the ``points`` query argument
         """
         controller = self.application.settings['controller']
 
@@ -286,8 +481,13 @@ class ProfileHandler(tornado.web.RequestHandler):
             'Content-Disposition',
             'attachment; filename=cooking_profile.json'
         )
-        stat_points = controller.get_stat_history(5)
-        self.finish('{}\n'.format(json.dumps({k:v.pit_temp for k, v in stat_points.items()})))
+        try:
+            stat_points = controller.get_downsampled_history(
+                int(self.get_argument('points')))
+        except (tornado.web.MissingArgumentError, ValueError):
+            stat_points = controller.get_stat_history(5)
+
+        self.finish('{}\n'.format(self.encode_json({k:v.pit_temp for k, v in stat_points.items()})))
 
     def put(self):
         """
@@ -330,9 +530,55 @@ class ProfileHandler(tornado.web.RequestHandler):
             self.set_status(400)
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
+
+class SamplesHandler(InstrumentedHandler):
+    """
+    RequestHandler that handles all operations related to the unsmoothed
+    probe samples
+    """
+    def get(self):
+        """
+        Sends the samples of the ``probe`` query argument, either "pit" or a
+        food probe number, from the last ``duration`` seconds
+        """
+        probes = self.application.settings['probes']
+
+        try:
+            probe_name = self.get_argument('probe')
+            duration = float(self.get_argument('duration', 3600))
+
+            if 'pit' == probe_name:
+                probe = probes['pit']
+            else:
+                probe = probes['food'][int(probe_name)]
+
+            period, samples = probe.get_sample_history(
+                Scheduler.instance().time() - duration)
+            ret_dict = {
+                'status': 'success',
+                'data': {
+                    'period': period,
+                    'noise': probe.get_noise(),
+                    'conversion_error': probe.get_conversion_error(),
+                    'samples': [list(sample) for sample in samples]}}
+            self.set_status(200)
+        except tornado.web.MissingArgumentError:
+            ret_dict = {
+                'status': 'fail',
+                'data': {'probe': 'probe argument must be present'}}
+            self.set_status(400)
+        except (IndexError, ValueError):
+            ret_dict = {
+                'status': 'fail',
+                'data': {
+                    'probe': 'probe must be pit or a food probe number and duration must be numeric'}}
+            self.set_status(400)
+
+        self.content_type = 'application/json'
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
-class PidHandler(tornado.web.RequestHandler):
+class PidHandler(InstrumentedHandler):
     """
     RequestHandler that handles all operations related to the PID controls
     """
@@ -342,17 +588,21 @@ class PidHandler(tornado.web.RequestHandler):
         """
         controller = self.application.settings['controller']
         coefficients = controller.get_pid_coefficients()
+        interval, derivative_filter = controller.get_pid_timing()
 
         self.content_type = 'application/json'
         self.finish('{}\n'.format(
-            json.dumps(
+            self.encode_json(
                 {
                 'status': 'success',
                 'data': {
                     'coefficients': {
                         'p': coefficients[0],
                         'i': coefficients[1],
-                        'd': coefficients[2]}}})))
+                        'd': coefficients[2]},
+                    'interval': interval,
+                    'derivative_filter': derivative_filter,
+                    'plant_model': controller.get_plant_model()}})))
 
     def put(self):
         """
@@ -400,8 +650,147 @@ class PidHandler(tornado.web.RequestHandler):
             self.set_status(400)
 
         self.content_type = 'application/json'
-        self.finish('{}\n'.format(json.dumps(ret_dict)))
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
+
+class AutoTuneHandler(InstrumentedHandler):
+    """
+    RequestHandler that runs the PID auto-tune experiment
+    """
+    def get(self):
+        """
+        Sends the progress and results of the latest experiment
+        """
+        controller = self.application.settings['controller']
+
+        self.content_type = 'application/json'
+        self.finish('{}\n'.format(
+            self.encode_json(
+                {
+                'status': 'success',
+                'data': {'autotune': controller.get_autotune_status()}})))
+
+    def put(self):
+        """
+        Starts an experiment around the current setpoint with the optional
+        hysteresis, cycles, rule, output_low, and output_high settings
+        """
+        settings_names = ('hysteresis', 'cycles', 'rule', 'output_low', 'output_high')
+
+        try:
+            data = json.loads(self.request.body) if self.request.body else {}
+            controller = self.application.settings['controller']
+
+            settings = {}
+            for k, v in data.items():
+                if k not in settings_names:
+                    raise KeyError(k)
+                settings[k] = v if 'rule' == k else float(v)
+            if 'cycles' in settings:
+                settings['cycles'] = int(settings['cycles'])
+
+            try:
+                controller.start_autotune(**settings)
+
+                ret_dict = {
+                    'status': 'success',
+                    'data': {'autotune': controller.get_autotune_status()}}
+                self.set_status(200)
+            except ValueError as e:
+                ret_dict = {
+                    'status': 'fail',
+                    'data': {'autotune': str(e)}}
+                self.set_status(400)
+            except RuntimeError as e:
+                ret_dict = {
+                    'status': 'fail',
+                    'data': {'autotune': str(e)}}
+                self.set_status(409)
+            except Exception as e:
+                ret_dict = {
+                    'status': 'error',
+                    'message': str(e)}
+                self.set_status(500)
+        except KeyError:
+            ret_dict = {
+                'status': 'fail',
+                'data': {
+                    'autotune': 'settings may only be {}'.format(', '.join(settings_names))}}
+            self.set_status(400)
+        except (ValueError, TypeError, AttributeError):
+            ret_dict = {
+                'status': 'fail',
+                'data': {'autotune': 'settings must be a numeric JSON object'}}
+            self.set_status(400)
+
+        self.content_type = 'application/json'
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
 
+    def delete(self):
+        """
+        Cancels a running experiment and hands the blower back to the PID
+        """
+        controller = self.application.settings['controller']
+        controller.cancel_autotune()
+
+        self.content_type = 'application/json'
+        self.finish('{}\n'.format(
+            self.encode_json(
+                {
+                'status': 'success',
+                'data': {'autotune': controller.get_autotune_status()}})))
+
+class AutoTuneApplyHandler(InstrumentedHandler):
+    """
+    RequestHandler that applies the auto-tuned PID coefficients
+    """
+    def put(self):
+        """
+        Sets the PID coefficients found by the latest experiment
+        """
+        controller = self.application.settings['controller']
+
+        try:
+            coefficients = controller.apply_autotune()
+
+            ret_dict = {
+                'status': 'success',
+                'data': {
+                    'coefficients': {
+                        'p': coefficients[0],
+                        'i': coefficients[1],
+                        'd': coefficients[2]}}}
+            self.set_status(200)
+        except RuntimeError as e:
+            ret_dict = {
+                'status': 'fail',
+                'data': {'autotune': str(e)}}
+            self.set_status(409)
+        except Exception as e:
+            ret_dict = {
+                'status': 'error',
+                'message': str(e)}
+            self.set_status(500)
+
+        self.content_type = 'application/json'
+        self.finish('{}\n'.format(self.encode_json(ret_dict)))
+
+
+def create_gzip_transform(min_length=GZIP_MIN_LENGTH, level=COMPRESSION_LEVEL):
+    """
+    Returns an output transform that gzips text and JSON responses of at
+    least ``min_length`` bytes for clients that accept it
+
+    :param min_length: The smallest response body in bytes to compress
+    :type min_length: int
+    :param level: The deflate level from 1-9
+    :type level: int
+    :returns: The output transform class
+    :rtype: type
+    """
+    return type(
+        'GZipContentEncoding',
+        (tornado.web.GZipContentEncoding,),
+        {'MIN_LENGTH': min_length, 'GZIP_LEVEL': level})
 
 def main(config):
     """
@@ -427,34 +816,24 @@ def main(config):
 
     current_path = os.path.dirname(__file__)
 
-    blower = Blower(config['blower']['pin'])
-    baster = Baster(config['baster']['pin'])
+    backend = create_backend(config)
+    hwio = HardwareIO()
+    blower = Blower(config['blower']['pin'], hwio, backend.PWM)
+    baster = Baster(config['baster']['pin'], hwio, backend.GPIO)
 
-    pit_probe = Probe(
-        config['pit_probe']['pin'],
-        config['pit_probe']['sh_a'],
-        config['pit_probe']['sh_b'],
-        config['pit_probe']['sh_c']
-    )
+    pit_probe = create_probe(config['pit_probe'])
 
     food_probes = []
     food_alarms = []
 
     for food_probe in config['food_probes']:
-        food_probes.append(
-            Probe(
-                food_probe['pin'],
-                food_probe['sh_a'],
-                food_probe['sh_b'],
-                food_probe['sh_c']
-            )
-        )
+        food_probes.append(create_probe(food_probe))
         food_alarms.append(None)
 
-    controller = Controller(
-        blower,
-        pit_probe,
-        *food_probes)
+    probe_bank = ProbeBank(pit_probe, food_probes, hwio, backend.ADC)
+    probe_bank.start()
+
+    controller = Controller(blower, probe_bank)
 
     controller.set_pid_coefficients(
         config['pid_coefficients']['k_p'],
@@ -462,7 +841,38 @@ def main(config):
         config['pid_coefficients']['k_d'],
     )
 
-    controller.set_profile({0: config['initial_setpoint']})
+    if 'pid' in config:
+        controller.set_pid_timing(
+            config['pid']['interval'],
+            config['pid']['derivative_filter'])
+
+    lid_detector = None
+    if 'lid' in config:
+        lid_detector = LidDetector(**config['lid'])
+        controller.set_lid_detector(lid_detector)
+
+    if 'feed_forward' in config:
+        controller.set_feed_forward(**config['feed_forward'])
+
+    if 'history' in config:
+        controller.set_history_memory(config['history']['max_memory'])
+
+    resumed = False
+    journal = None
+    if 'journal' in config:
+        journal = Journal(
+            config['journal']['path'],
+            config['journal']['flush_interval'],
+            config['journal']['max_size'])
+        resumed = controller.set_journal(journal)
+
+    if not resumed:
+        controller.set_profile({0: config['initial_setpoint']})
+
+    compression = config.get('compression')
+    websocket_compression = None
+    if compression and compression['websocket']:
+        websocket_compression = {'compression_level': compression['level']}
 
     application = tornado.web.Application(
         [
@@ -470,14 +880,69 @@ def main(config):
             (r'/profile', ProfileHandler),
             (r'/override', OverrideHandler),
             (r'/pid', PidHandler),
+            (r'/autotune', AutoTuneHandler),
+            (r'/autotune/apply', AutoTuneApplyHandler),
             (r'/alarms', AlarmsHandler),
-            (r'/baste', BasteHandler)],
+            (r'/baste', BasteHandler),
+            (r'/samples', SamplesHandler),
+            (r'/metrics', MetricsHandler)],
         static_path=os.path.join(current_path, 'webgui'),
         blower=blower,
         baster=baster,
         controller=controller,
         food_alarms=food_alarms,
-        probes={'food': food_probes, 'pit': pit_probe})
+        probes={'food': food_probes, 'pit': pit_probe},
+        probe_bank=probe_bank,
+        hwio=hwio,
+        backend=backend,
+        websocket_compression=websocket_compression)
+
+    if compression:
+        application.add_transform(create_gzip_transform(
+            compression['gzip_min_length'],
+            compression['level']))
+
+    broadcaster = StatusBroadcaster(application)
+    application.settings['broadcaster'] = broadcaster
+    if lid_detector:
+        lid_detector.subscribe(broadcaster.publish_lid_event)
+    broadcaster.start()
+
+    registry = metrics.Registry.instance()
+    registry.add_collector(Scheduler.instance().collect_metrics)
+    registry.add_collector(hwio.collect_metrics)
+    registry.add_collector(broadcaster.collect_metrics)
+
+    watchdog = LoopWatchdog(controller, blower, probe_bank, **config.get('watchdog', {}))
+    watchdog.start()
+    registry.add_collector(watchdog.collect_metrics)
+
+    def shutdown():
+        """
+        Stops every timer, turns the blower off, and writes out the journal
+        before stopping the IOLoop
+        """
+        logging.info('Shutting down')
+        watchdog.stop()
+        Scheduler.instance().shutdown()
+        blower.stop()
+        if journal:
+            journal.stop()
+        hwio.shutdown()
+        tornado.ioloop.IOLoop.instance().stop()
+
+    def handle_signal(signum, frame):
+        io_loop = tornado.ioloop.IOLoop.instance()
+
+        # add_callback is safe to call from a signal handler on Tornado 6,
+        # which deprecates add_callback_from_signal
+        if tornado.version_info >= (6,):
+            io_loop.add_callback(shutdown)
+        else:
+            io_loop.add_callback_from_signal(shutdown)
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
 
     application.listen(config['server']['port'])
     tornado.ioloop.IOLoop.instance().start()
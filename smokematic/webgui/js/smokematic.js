@@ -1,9 +1,83 @@
 (function(smokematic, $, undefined) {
     var infoCallback = null;
+    var historySession = null;
+    var historySince = null;
+
+    var MESSAGE_TYPES = ['initial', 'history', 'update', 'lid'];
+    var LID_STATES = [null, 'closed', 'open', 'recovering'];
+
+    /* Decodes a message in the binary encoding of smokematic/encoding.py */
+    var decodeBinary = function(buffer) {
+        var view = new DataView(buffer);
+        var type = MESSAGE_TYPES[view.getUint8(0)];
+        var readFloats = function(offset, count) {
+            var values = [];
+            for (var i = 0; i < count; i++) {
+                var value = view.getFloat32(offset + 4 * i, true);
+                values.push(isNaN(value) ? null : value);
+            }
+            return values;
+        };
+
+        if ("lid" == type) {
+            return {type: type, data: {state: LID_STATES[view.getUint8(1)], time: view.getFloat64(2, true)}};
+        }
+
+        if ("update" == type) {
+            var numFood = view.getUint8(22);
+            var values = readFloats(23, 2 * numFood);
+            var header = readFloats(9, 3);
+            return {type: type, data: {
+                time: view.getFloat64(1, true),
+                pit_temp: header[0],
+                setpoint: header[1],
+                blower_speed: header[2],
+                lid: LID_STATES[view.getUint8(21)],
+                food_temp: values.slice(0, numFood),
+                food_alarms: values.slice(numFood)}};
+        }
+
+        var count = view.getUint16(14, true);
+        var numFoodProbes = view.getUint8(16);
+        var columns = readFloats(17 + 4 * count, (3 + numFoodProbes) * count);
+        var data = {};
+        for (var j = 0; j < count; j++) {
+            var foodTemps = [];
+            for (var k = 0; k < numFoodProbes; k++) {
+                foodTemps.push(columns[(3 + k) * count + j]);
+            }
+            data[view.getInt32(17 + 4 * j, true)] = {
+                pit_temp: columns[j],
+                setpoint: columns[count + j],
+                blower_speed: columns[2 * count + j],
+                food_temp: foodTemps};
+        }
+
+        return {
+            type: type,
+            more: 1 == view.getUint8(1),
+            /* The session is milliseconds since the epoch so fits a double */
+            session: view.getUint32(2, true) + view.getInt32(6, true) * 4294967296,
+            latest: view.getInt32(10, true),
+            data: data};
+    };
     
     smokematic.connect = function(callback) {
         infoCallback = callback;
-        var socket = new WebSocket('ws://'+document.location.host+'/status');
+        var url = 'ws://'+document.location.host+'/status';
+
+        /* Only ask for the data points we are missing when reconnecting */
+        if (historySession !== null && historySince !== null) {
+            url += '?session=' + historySession + '&since=' + historySince;
+        }
+        else {
+            /* No need for more data points than the graph is wide */
+            url += '?points=' + Math.max(100, $('#graph').width());
+        }
+        url += '&encoding=binary';
+
+        var socket = new WebSocket(url);
+        socket.binaryType = 'arraybuffer';
         
         socket.onopen = function() {
             $('#messagebox').append('<div class="alert alert-success fade in"><button type="button" class="close" data-dismiss="alert">&times;</button>Successfully connected!</div>');        
@@ -14,19 +88,39 @@
 
         socket.onmessage = function(event) {
             //console.log('Client received a message',event);
-            infoCallback(JSON.parse(event.data));
+            var event_data = (event.data instanceof ArrayBuffer) ? decodeBinary(event.data) : JSON.parse(event.data);
+
+            if ("initial" == event_data.type || "history" == event_data.type)
+            {
+                if ("initial" == event_data.type)
+                {
+                    historySince = null;
+                }
+                historySession = event_data.session;
+                $.each(event_data.data, function(key, value) {
+                    var key_int = parseInt(key);
+                    historySince = (historySince === null || key_int > historySince) ? key_int : historySince;
+                });
+            }
+
+            infoCallback(event_data);
         };
 	
         // Listen for socket closes
         socket.onclose = function(event) {
             $('#messagebox').append('<div class="alert alert-danger fade in"><button type="button" class="close" data-dismiss="alert">&times;</button>Disconnected!</div>');        
             //console.log('Client notified socket has closed', event);
+            setTimeout(function(){
+                $('#messagebox').children('.alert-danger').remove();
+                smokematic.connect(infoCallback);
+                }, 5000);
         };
     } 
 }(window.smokematic = window.smokematic || {}, jQuery));
 
 $(function () {
     var data = {food_temp: [], pit_temp: [], blower_speed: [], setpoint: []};
+    var history = {};
 
     var options = {
         legend: {position: "sw"},
@@ -58,27 +152,51 @@ $(function () {
             }
 
         }
+        else if ("lid" == event_data.type)
+        {
+            $('#messagebox').children('.lid-alert').remove();
+            if ("open" == event_data.data.state)
+            {
+                $('#messagebox').append('<div class="alert alert-warning lid-alert fade in"><button type="button" class="close" data-dismiss="alert">&times;</button>Lid open, holding the blower</div>');
+            }
+            else if ("recovering" == event_data.data.state)
+            {
+                $('#messagebox').append('<div class="alert alert-info lid-alert fade in"><button type="button" class="close" data-dismiss="alert">&times;</button>Lid closed, recovering pit temperature</div>');
+            }
+            return;
+        }
         else
         {
-            var max_time = -1;
+            if ("initial" == event_data.type)
+            {
+                history = {};
+            }
+
+            $.each(event_data.data, function(key, value) {
+                history[parseInt(key)] = value;
+            });
+
+            /* Wait until the whole backlog has arrived before redrawing */
+            if (event_data.more)
+            {
+                return;
+            }
+
             var times = [];
             data.food_temp = [];
             data.pit_temp = [];
             data.setpoint = [];
             data.blower_speed = [];
 
-            $.each(event_data.data, function(key, value) {
-                var key_int = parseInt(key);
-                max_time = key_int > max_time ? key_int: max_time;
-                times.push(key_int);
+            $.each(history, function(key, value) {
+                times.push(parseInt(key));
             });
             
             times.sort(function(a,b){return a-b;});
 
-            $.each(times, function(time_offset) {
-                var entry_time = time + ((time_offset - max_time) * 60 * 1000);
-                var time_offset_str = String(time_offset);
-                var data_item = event_data.data[time_offset_str];
+            $.each(times, function(index, time_offset) {
+                var entry_time = time + ((time_offset - event_data.latest) * 60 * 1000);
+                var data_item = history[time_offset];
 
                 data.food_temp.push([entry_time, data_item.food_temp[0]]);
                 data.pit_temp.push([entry_time, data_item.pit_temp]);
@@ -0,0 +1,52 @@
+import json
+import os.path
+import unittest
+
+from smokematic.simulator import SETTLE_TOLERANCE, simulate
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'smokematic', 'skel', 'config.json')
+
+PROFILE = {0: 225, 120: 275, 360: 250}
+
+DURATION = 480
+
+SEEDS = range(4)
+
+class FeedForwardTest(unittest.TestCase):
+    """
+    Simulated cooks with model feed-forward must settle to the setpoint
+    """
+    def setUp(self):
+        with open(CONFIG_PATH) as f:
+            self.config = json.load(f)
+
+    def assert_settles(self, max_dead_time):
+        self.config['feed_forward'] = {
+            'enabled': True,
+            'max_dead_time': max_dead_time,
+            'min_points': 30}
+
+        for seed in SEEDS:
+            report, points = simulate(self.config, PROFILE, DURATION, feed_forward=True, seed=seed)
+
+            for step in report['steps']:
+                self.assertIsNotNone(
+                    step['settling_time'],
+                    'Seed {} never settled to {}F'.format(seed, step['setpoint']))
+
+            # The end of the 275F step, where a bad fit used to hold the pit
+            # about 15F above the setpoint
+            late = [pit_temp for minute, pit_temp, _, _ in points if 210 <= minute < 240]
+            self.assertLess(
+                abs(sum(late) / len(late) - 275),
+                SETTLE_TOLERANCE,
+                'Seed {} held the pit at {:.1f}F'.format(seed, sum(late) / len(late)))
+
+    def test_default_dead_time(self):
+        self.assert_settles(600)
+
+    def test_short_dead_time(self):
+        self.assert_settles(120)
+
+if '__main__' == __name__:
+    unittest.main()